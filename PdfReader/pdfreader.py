@@ -1,9 +1,192 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-from pdfminer.high_level import extract_text
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+from pypdf import PdfReader
 import docx2txt
 
+# Extraction du texte : "auto" (pypdf si la mise en page le permet, sinon pdfminer), "pypdf" ou "pdfminer"
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto")
+# Nombre de processus qui extraient les pages en parallèle
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Nombre de pages extraites par tâche du pool
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# En dessous de ce nombre de pages, l'extraction reste dans le processus appelant
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+# Nombre de documents dont le texte extrait est gardé en mémoire (clé : empreinte SHA-256 du fichier)
+PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", "32"))
+
+_pool = None
+_lock = threading.Lock()
+_cache = OrderedDict()
+_counts = {"documents": 0, "pages_pypdf": 0, "pages_pdfminer": 0, "pages_sans_texte": 0, "cache": 0}
+
+
+def _texte_exploitable(text: str) -> bool:
+    """
+    Le texte de pypdf est gardé s'il ressemble à du texte courant : ni caractères illisibles,
+    ni mots collés (espaces perdus par une mise en page en colonnes ou positionnée)
+    """
+    stripped = text.strip()
+    if not stripped:
+        return False
+    illisibles = sum(1 for c in stripped if c == "�" or (ord(c) < 32 and c not in "\n\t\r"))
+    if illisibles > 0.02 * len(stripped):
+        return False
+    words = stripped.split()
+    return sum(len(w) for w in words) / len(words) < 15
+
+
+def _has_fonts(page) -> bool:
+    """
+    Une page sans police ne contient que des images (scan) : aucun texte à extraire
+    """
+    try:
+        resources = page.get("/Resources")
+        return resources is not None and "/Font" in resources.get_object()
+    except Exception:
+        return True
+
+
+def _pdfminer_pages(path: str, page_numbers) -> list:
+    texts = []
+    for layout in extract_pages(path, page_numbers=page_numbers):
+        texts.append("".join(element.get_text() for element in layout if isinstance(element, LTTextContainer)))
+    return texts
+
+
+def _extract_range(path: str, start: int, end: int, backend: str = PDF_BACKEND) -> list:
+    """
+    Extrait les pages [start, end[ (exécuté dans un processus du pool)
+    Returns:
+        list: (texte, moteur utilisé) par page
+    """
+    if backend == "pdfminer":
+        return [(text, "pdfminer") for text in _pdfminer_pages(path, range(start, end))]
+
+    reader = PdfReader(path)
+    pages = [None] * (end - start)
+    relire = []
+    for i in range(start, end):
+        page = reader.pages[i]
+        text = page.extract_text() or ""
+        if backend == "pypdf" or _texte_exploitable(text):
+            pages[i - start] = (text, "pypdf")
+        elif not text.strip() and not _has_fonts(page):
+            pages[i - start] = ("", "sans_texte")
+        else:
+            relire.append(i)
+    # Mise en page que pypdf restitue mal : ces pages seules passent par pdfminer
+    if relire:
+        for i, text in zip(relire, _pdfminer_pages(path, relire)):
+            pages[i - start] = (text, "pdfminer")
+    return pages
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Pool de processus partagé, créé au premier PDF volumineux (démarrage "spawn" : le serveur a des threads)
+    """
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _read_bytes(file) -> bytes:
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+
+def _count(engine: str):
+    key = "pages_sans_texte" if engine == "sans_texte" else f"pages_{engine}"
+    with _lock:
+        _counts[key] += 1
+
+
+def iter_pdf_pages(file, backend: str = PDF_BACKEND):
+    """
+    Extrait le texte d'un PDF page par page, dans l'ordre, au fur et à mesure : les plages de
+    PDF_PAGES_PER_TASK pages sont extraites en parallèle par le pool de processus et chaque
+    page est rendue dès que sa plage est prête. Le texte d'un document déjà lu est repris du cache.
+    Args:
+        file: Chemin, octets ou fichier (BytesIO, UploadFile.file...)
+        backend (str): "auto", "pypdf" ou "pdfminer"
+    Yields:
+        str: Texte de chaque page
+    """
+    data = _read_bytes(file)
+    key = (hashlib.sha256(data).hexdigest(), backend)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _counts["cache"] += 1
+    if cached is not None:
+        yield from cached
+        return
+
+    with _lock:
+        _counts["documents"] += 1
+    # Les processus du pool lisent le fichier sur disque plutôt que de recevoir une copie par tâche
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(data)
+        path = tmp.name
+    pages = []
+    futures = []
+    try:
+        page_count = len(PdfReader(path).pages)
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+                  for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+
+        if page_count < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+            results = (_extract_range(path, start, end, backend) for start, end in ranges)
+        else:
+            pool = get_process_pool()
+            futures = [pool.submit(_extract_range, path, start, end, backend) for start, end in ranges]
+            results = (future.result() for future in futures)
+
+        for result in results:
+            for text, engine in result:
+                _count(engine)
+                pages.append(text)
+                yield text
+    finally:
+        # Lecture interrompue (client déconnecté) : les plages pas encore commencées sont abandonnées
+        for future in futures:
+            future.cancel()
+        os.remove(path)
+
+    with _lock:
+        _cache[key] = pages
+        while len(_cache) > PDF_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
 def extract_text_from_pdf(file):
-    return extract_text(file)
+    return "\f".join(iter_pdf_pages(file))
 
 
 def extract_text_from_docx(file):
@@ -24,3 +207,8 @@ def extract_text_from_upload(file):
         return file.getvalue().decode("utf-8")
     else:
         return file.getvalue().decode("utf-8")
+
+
+def stats() -> dict:
+    with _lock:
+        return {**_counts, "documents_en_cache": len(_cache)}
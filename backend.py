@@ -1,14 +1,25 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from pydantic import BaseModel
+import asyncio
 from typing import List, Optional
 import uvicorn
 from forme import analyser_arrete, contexte
-from rag import get_result, init
-from catégorie import categorize_llm
+from rag import get_result, get_agent, init, warmup, codes_for_categories
+import rag
+from catégorie import categorize_llm, serialiser_categories
+from categorisation_lot import BatchStats, acategorize_many, bounded_concurrency, parse_jsonl
+import catégorie
 import json
-from PdfReader.pdfreader import extract_text_from_upload
+from PdfReader.pdfreader import extract_text_from_upload, iter_pdf_pages
+from PdfReader import pdfreader
 import io
 from fastapi.middleware.cors import CORSMiddleware
+from workers import LimitedStreamingResponse, get_limiter, iterate_blocking, reserve_slot, run_blocking
+import workers
+import llm_cache
+import llm
+from llm import llm_error_status
+from context_builder import usage_meter
 
 app = FastAPI(title="API Analyse d'Actes Administratifs")
 
@@ -22,6 +33,29 @@ app.add_middleware(
 
 #init()
 
+# Limites de concurrence et de file d'attente par endpoint (surchargeables par variables d'environnement)
+get_limiter("upload", max_concurrency=4, max_queue=16)
+get_limiter("categoriser", max_concurrency=4, max_queue=16)
+get_limiter("analyser", max_concurrency=4, max_queue=16)
+get_limiter("analyser-validite", max_concurrency=2, max_queue=8)
+get_limiter("categoriser-lot", max_concurrency=1, max_queue=2)
+
+@app.on_event("startup")
+def charger_rag():
+    """
+    Charge le modèle d'embedding, la base vectorielle et le catégoriseur une seule fois au démarrage
+    """
+    warmup()
+    catégorie.warmup()
+
+@app.on_event("shutdown")
+async def fermer_clients():
+    """
+    Ferme les connexions HTTP partagées vers l'API LLM et le pool d'extraction des PDF
+    """
+    await llm.aclose()
+    pdfreader.shutdown()
+
 # Ajouter ces classes pour la validation des données
 class TexteRequest(BaseModel):
     texte: str
@@ -31,6 +65,29 @@ class TexteRequest(BaseModel):
         "date": "2023",
         "lieu": "Paris"
     }
+    # Restriction facultative de la recherche juridique : codes ("CC", "CP", "CGCT", "CSI")
+    # ou catégories d'acte ("6", "6.1"...) dont on déduit les codes
+    codes: Optional[List[str]] = None
+    categories: Optional[List[str]] = None
+    # /analyse-complete : restreindre la recherche aux codes des catégories trouvées par le
+    # catégoriseur (l'analyse de validité attend alors la catégorisation au lieu de tourner en parallèle)
+    filtrer_par_categories: bool = False
+
+    def codes_recherche(self):
+        # Sans catégories, inutile de charger l'index creux pour connaître les codes ingérés
+        if self.codes or not self.categories:
+            return self.codes
+        return codes_for_categories(self.categories)
+
+class ActeLot(BaseModel):
+    id: Optional[str] = None
+    texte: str
+
+class LotRequest(BaseModel):
+    # Textes seuls (identifiés par leur position) ou actes identifiés
+    textes: List[str] = []
+    actes: List[ActeLot] = []
+    concurrence: Optional[int] = None
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
@@ -43,15 +100,41 @@ async def upload_file(file: UploadFile = File(...)):
         file_obj = io.BytesIO(contents)
         file_obj.type = file.content_type
         
-        texte = extract_text_from_upload(file_obj)
+        texte = await run_blocking("upload", extract_text_from_upload, file_obj)
         return {"texte": texte}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Erreur lors de la lecture du fichier: {str(e)}"
         )
 
+@app.post("/upload/pages")
+async def upload_file_pages(file: UploadFile = File(...)):
+    """
+    Endpoint pour lire un PDF page par page : une ligne JSON par page (NDJSON) dès qu'elle est
+    extraite, puis une ligne de bilan
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=415, detail="Seuls les fichiers PDF sont lus page par page")
+    contents = await file.read()
+    slot = await reserve_slot("upload")
+
+    async def lignes():
+        numero = 0
+        try:
+            async for texte in iterate_blocking(iter_pdf_pages(contents)):
+                numero += 1
+                yield json.dumps({"page": numero, "texte": texte}, ensure_ascii=False) + "\n"
+            yield json.dumps({"bilan": {"pages": numero}}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Erreur dans /upload/pages: {str(e)}")  # Log de debug
+            yield json.dumps({"erreur": f"Erreur lors de la lecture du fichier: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    return LimitedStreamingResponse(slot, lignes(), media_type="application/x-ndjson")
+
 @app.post("/categoriser")
 async def categoriser_texte(request: TexteRequest):
     """
@@ -59,25 +142,56 @@ async def categoriser_texte(request: TexteRequest):
     """
     try:
         print(f"Données reçues dans /categoriser: {request}")  # Log de debug
-        resultats = categorize_llm(request.texte, DEBUG=False)
-        return [
-            {
-                "sub_category": {
-                    "value": res.sub_category.value,
-                    "name": res.sub_category.name
-                },
-                "main_category": {
-                    "value": res.main_category.value,
-                    "name": res.main_category.name
-                },
-                "confidence": res.confidence,
-                "explanation": res.explanation
-            }
-            for res in resultats
-        ]
+        resultats = await run_blocking("categoriser", categorize_llm, request.texte, DEBUG=False)
+        return serialiser_categories(resultats)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Erreur dans /categoriser: {str(e)}")  # Log de debug
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=llm_error_status(e) or 500, detail=str(e))
+
+def _reponse_lot(slot, actes, concurrence: Optional[int] = None):
+    """
+    Réponse NDJSON d'un lot : une ligne par acte au fil des catégorisations, puis le bilan ;
+    la concurrence demandée par le client est bornée (voir bounded_concurrency)
+    """
+    async def lignes():
+        stats = BatchStats()
+        try:
+            async for resultat in acategorize_many(actes, concurrency=bounded_concurrency(concurrence), stats=stats):
+                yield json.dumps(resultat, ensure_ascii=False) + "\n"
+            yield json.dumps({"bilan": stats.summary()}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Erreur dans /categoriser-lot: {str(e)}")  # Log de debug
+            yield json.dumps({"erreur": str(e)}, ensure_ascii=False) + "\n"
+
+    return LimitedStreamingResponse(slot, lignes(), media_type="application/x-ndjson")
+
+@app.post("/categoriser-lot")
+async def categoriser_lot(request: LotRequest):
+    """
+    Endpoint pour catégoriser un lot de textes : une ligne JSON par texte (NDJSON) au fur et
+    à mesure des catégorisations, puis une ligne de bilan avec le débit
+    """
+    print(f"Données reçues dans /categoriser-lot: {len(request.textes) + len(request.actes)} textes")  # Log de debug
+    slot = await reserve_slot("categoriser-lot")
+    actes = request.textes + [acte.dict() for acte in request.actes]
+    return _reponse_lot(slot, actes, request.concurrence)
+
+@app.post("/categoriser-lot/fichier")
+async def categoriser_lot_fichier(file: UploadFile = File(...), concurrence: Optional[int] = Form(None)):
+    """
+    Endpoint pour catégoriser un fichier JSONL d'actes ({"id", "texte"} par ligne), avec la
+    même réponse NDJSON que /categoriser-lot
+    """
+    contents = await file.read()
+    try:
+        actes = list(parse_jsonl(contents.decode("utf-8").splitlines()))
+    except (UnicodeDecodeError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Fichier JSONL invalide : {str(e)}")
+    print(f"Données reçues dans /categoriser-lot/fichier: {len(actes)} textes")  # Log de debug
+    slot = await reserve_slot("categoriser-lot")
+    return _reponse_lot(slot, actes, concurrence)
 
 @app.post("/analyser")
 async def analyser_texte(request: TexteRequest):
@@ -87,13 +201,15 @@ async def analyser_texte(request: TexteRequest):
     try:
         print(f"Données reçues dans /analyser: {request}")  # Log de debug
         # On crée un contexte par défaut si nécessaire
-        resultat = analyser_arrete(contenu=request.texte)
+        resultat = await run_blocking("analyser", analyser_arrete, contenu=request.texte)
         if isinstance(resultat, str):
             return json.loads(resultat)
         return resultat
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Erreur dans /analyser: {str(e)}")  # Log de debug
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=llm_error_status(e) or 500, detail=str(e))
 
 @app.post("/analyser-validite")
 async def analyser_validite(request: TexteRequest):
@@ -102,11 +218,103 @@ async def analyser_validite(request: TexteRequest):
     """
     try:
         print(f"Données reçues dans /analyser-validite: {request}")  # Log de debug
-        resultat = get_result(request.texte)
-        return {"analyse": resultat}
+        return await run_blocking(
+            "analyser-validite", get_result, request.texte, with_metrics=True, codes=request.codes_recherche()
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Erreur dans /analyser-validite: {str(e)}")  # Log de debug
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=llm_error_status(e) or 500, detail=str(e))
+
+@app.post("/analyser-validite/stream")
+async def analyser_validite_stream(request: TexteRequest):
+    """
+    Endpoint pour analyser la validité juridique d'un texte en flux (Server-Sent Events) :
+    évènements de progression puis morceaux de l'analyse au fil de la génération
+    """
+    print(f"Données reçues dans /analyser-validite/stream: {request}")  # Log de debug
+    # La place est réservée avant de répondre pour pouvoir renvoyer un 429/503
+    slot = await reserve_slot("analyser-validite")
+
+    async def evenements():
+        try:
+            agent = await asyncio.to_thread(get_agent)
+            async for evenement in agent.astream_fraud_risk_from_text(request.texte, codes=request.codes_recherche()):
+                yield f"event: {evenement['event']}\ndata: {json.dumps(evenement['data'], ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"Erreur dans /analyser-validite/stream: {str(e)}")  # Log de debug
+            yield f"event: erreur\ndata: {json.dumps(str(e), ensure_ascii=False)}\n\n"
+
+    return LimitedStreamingResponse(
+        slot,
+        evenements(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/analyse-complete")
+async def analyse_complete(request: TexteRequest):
+    """
+    Endpoint qui lance en parallèle l'analyse de forme, la catégorisation et
+    l'analyse de validité d'un texte et retourne un document unique.
+    La recherche juridique de l'analyse de validité n'est restreinte que par les codes ou
+    catégories de la requête ; avec filtrer_par_categories, et sans codes ni catégories, elle
+    est restreinte aux codes des catégories trouvées, au prix d'une exécution après la catégorisation.
+    """
+    print(f"Données reçues dans /analyse-complete: {request}")  # Log de debug
+    categorisation = asyncio.ensure_future(run_blocking("categoriser", categorize_llm, request.texte, DEBUG=False))
+
+    async def validite_filtree():
+        codes = request.codes_recherche()
+        if codes is None and request.filtrer_par_categories:
+            try:
+                codes = codes_for_categories(await asyncio.shield(categorisation))
+            except Exception:
+                codes = None
+        return await run_blocking("analyser-validite", get_result, request.texte, with_metrics=True, codes=codes)
+
+    forme, categories, validite = await asyncio.gather(
+        run_blocking("analyser", analyser_arrete, contenu=request.texte),
+        categorisation,
+        validite_filtree(),
+        return_exceptions=True,
+    )
+
+    # Chaque partie échoue indépendamment : les erreurs sont regroupées dans "erreurs"
+    resultat = {"analyse": None, "categories": None, "validite": None, "erreurs": {}}
+    for cle, valeur in (("analyse", forme), ("categories", categories), ("validite", validite)):
+        if isinstance(valeur, BaseException):
+            print(f"Erreur dans /analyse-complete ({cle}): {str(valeur)}")  # Log de debug
+            resultat["erreurs"][cle] = valeur.detail if isinstance(valeur, HTTPException) else str(valeur)
+        elif cle == "analyse":
+            resultat[cle] = json.loads(valeur) if isinstance(valeur, str) else valeur
+        elif cle == "categories":
+            resultat[cle] = serialiser_categories(valeur)
+        else:
+            resultat[cle] = valeur
+
+    # API LLM indisponible pour toutes les parties : la réponse porte son statut (503 ou 504)
+    statuts = [llm_error_status(v) for v in (forme, categories, validite) if isinstance(v, BaseException)]
+    if len(statuts) == 3 and all(statuts):
+        raise HTTPException(status_code=max(statuts), detail=resultat["erreurs"])
+    return resultat
+
+@app.get("/metriques")
+async def metriques():
+    """
+    Compteurs de fonctionnement : caches LLM et RAG, catégorisation locale ou par le LLM,
+    files d'attente des endpoints, extraction des PDF
+    """
+    return {
+        "cache_llm": llm_cache.stats(),
+        "clients_llm": llm.stats(),
+        "rag": rag.stats(),
+        "llm": usage_meter.stats(),
+        "categorisation": catégorie.stats(),
+        "workers": workers.stats(),
+        "pdf": pdfreader.stats(),
+    }
 
 @app.get("/")
 async def root():
@@ -117,9 +325,15 @@ async def root():
         "message": "API d'analyse d'actes administratifs",
         "endpoints": [
             "/categoriser - POST - Catégorisation d'un texte administratif",
+            "/categoriser-lot - POST - Catégorisation d'un lot de textes (une ligne JSON par texte)",
+            "/categoriser-lot/fichier - POST - Catégorisation d'un fichier JSONL d'actes (une ligne JSON par texte)",
             "/analyser - POST - Analyse de la forme d'un texte administratif",
             "/analyser-validite - POST - Analyse de la validité juridique d'un texte",
-            "/upload - POST - Upload et lecture d'un fichier (PDF, DOCX, etc.)"
+            "/analyser-validite/stream - POST - Analyse de la validité juridique en flux (Server-Sent Events)",
+            "/analyse-complete - POST - Analyse de forme, catégorisation et validité en un seul appel",
+            "/upload - POST - Upload et lecture d'un fichier (PDF, DOCX, etc.)",
+            "/upload/pages - POST - Lecture d'un PDF page par page (NDJSON, au fil de l'extraction)",
+            "/metriques - GET - Compteurs de fonctionnement (cache, files d'attente)"
         ]
     }
 
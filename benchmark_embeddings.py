@@ -0,0 +1,70 @@
+import argparse
+import statistics
+import time
+
+from rag import build_embedding_model, detect_device, load_documents
+
+QUERIES = [
+    "arrêté municipal",
+    "pouvoirs de police du maire",
+    "couvre-feu pour les mineurs",
+    "occupation du domaine public",
+    "délégation de signature",
+]
+
+
+def benchmark(backend, batch_size, device, texts, query_runs):
+    """
+    Mesure le débit d'encodage des morceaux (ingestion) et la latence d'encodage d'une requête
+    """
+    start = time.perf_counter()
+    model = build_embedding_model(device=device, batch_size=batch_size, backend=backend)
+    load_time = time.perf_counter() - start
+
+    # Une passe de chauffe pour ne pas mesurer l'initialisation paresseuse
+    model.embed_documents(texts[:batch_size])
+
+    start = time.perf_counter()
+    model.embed_documents(texts)
+    ingestion_time = time.perf_counter() - start
+
+    latencies = []
+    for i in range(query_runs):
+        start = time.perf_counter()
+        model.embed_query(QUERIES[i % len(QUERIES)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    return {
+        "backend": backend,
+        "batch_size": batch_size,
+        "chargement_s": load_time,
+        "morceaux_par_s": len(texts) / ingestion_time,
+        "requete_ms_moyenne": statistics.mean(latencies),
+        "requete_ms_p95": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mesure le débit d'encodage de sentence-camembert-base")
+    parser.add_argument("--fichier", default="docs/code_penal.pdf", help="Document dont les morceaux sont encodés")
+    parser.add_argument("--morceaux", type=int, default=512, help="Nombre de morceaux encodés")
+    parser.add_argument("--backends", default="torch,quantized", help="Backends à comparer (torch, quantized, onnx)")
+    parser.add_argument("--batch-sizes", default="16,32,64", help="Tailles de lot à comparer")
+    parser.add_argument("--device", default=None, help="Périphérique (détecté automatiquement par défaut)")
+    parser.add_argument("--requetes", type=int, default=50, help="Nombre d'encodages de requête mesurés")
+    args = parser.parse_args()
+
+    device = args.device or detect_device()
+    texts = [doc.page_content for doc in load_documents(args.fichier)[:args.morceaux]]
+    print(f"{len(texts)} morceaux de {args.fichier}, device={device}")
+
+    print(f"{'backend':<10} {'lot':>5} {'chargement (s)':>15} {'morceaux/s':>11} {'requête moy. (ms)':>18} {'requête p95 (ms)':>17}")
+    for backend in args.backends.split(","):
+        if backend == "quantized" and device != "cpu":
+            print(f"{backend:<10} ignoré : disponible uniquement sur cpu")
+            continue
+        for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+            r = benchmark(backend, batch_size, device, texts, args.requetes)
+            print(f"{r['backend']:<10} {r['batch_size']:>5} {r['chargement_s']:>15.1f} {r['morceaux_par_s']:>11.1f} "
+                  f"{r['requete_ms_moyenne']:>18.1f} {r['requete_ms_p95']:>17.1f}")
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from catégorie import get_categorizer, serialiser_categories
+
+# Nombre de textes catégorisés simultanément dans un lot
+CATEGORIZATION_BATCH_CONCURRENCY = int(os.getenv("CATEGORIZATION_BATCH_CONCURRENCY", "8"))
+
+
+def parse_jsonl(lines):
+    """
+    Lit des lignes JSONL d'actes : {"id": ..., "texte": ...} par ligne (id facultatif : numéro de ligne)
+    """
+    for line_number, line in enumerate(lines, 1):
+        if line.strip():
+            record = json.loads(line)
+            yield {"id": record.get("id", line_number), "texte": record["texte"]}
+
+
+def read_jsonl(path: str):
+    """
+    Lit un fichier JSONL d'actes (voir parse_jsonl)
+    """
+    with open(path, encoding="utf-8") as f:
+        yield from parse_jsonl(f)
+
+
+def bounded_concurrency(requested: int = None) -> int:
+    """
+    Concurrence demandée par un client, bornée par CATEGORIZATION_BATCH_CONCURRENCY
+    """
+    if not requested:
+        return CATEGORIZATION_BATCH_CONCURRENCY
+    return max(1, min(requested, CATEGORIZATION_BATCH_CONCURRENCY))
+
+
+def _records(items):
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            yield {"id": i, "texte": item}
+        else:
+            yield {"id": i if item.get("id") is None else item["id"], "texte": item["texte"]}
+
+
+class Checkpoint:
+    """
+    Fichier JSONL des résultats, écrit au fil de l'eau : il sert aussi de point de reprise,
+    les actes déjà présents (sans erreur) ne sont pas recatégorisés après un arrêt
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        truncated = False
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    truncated = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Dernière ligne tronquée par un arrêt brutal
+                        continue
+                    if "erreur" not in record:
+                        self.done.add(record["id"])
+        self._file = open(path, "a", encoding="utf-8")
+        if truncated:
+            self._file.write("\n")
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BatchStats:
+    """
+    Avancement et débit d'un lot
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.done = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        return {
+            "traites": self.done,
+            "erreurs": self.errors,
+            "repris": self.skipped,
+            "duree_s": round(elapsed, 1),
+            "actes_par_s": round(self.done / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+async def acategorize_many(items, concurrency: int = CATEGORIZATION_BATCH_CONCURRENCY, checkpoint: Checkpoint = None,
+                           stats: BatchStats = None, progress_every: int = 100):
+    """
+    Catégorise un lot d'actes avec au plus concurrency catégorisations simultanées
+    Args:
+        items: Textes, ou dictionnaires {"id", "texte"} (liste, générateur ou read_jsonl)
+        concurrency (int): Nombre de textes en cours de catégorisation
+        checkpoint (Checkpoint): Reprise : les actes déjà catégorisés sont ignorés, les nouveaux y sont écrits
+        stats (BatchStats): Compteurs mis à jour au fil du lot
+        progress_every (int): Fréquence d'affichage du débit
+    Yields:
+        dict: {"id", "categories"} ou {"id", "erreur"}, dans l'ordre de fin de traitement
+    """
+    categorizer = get_categorizer()
+    stats = stats or BatchStats()
+
+    async def categorize(record):
+        try:
+            result = await categorizer.acategorize(record["texte"])
+            ranked = sorted(result.subcategories, key=lambda x: x.confidence, reverse=True)
+            return {"id": record["id"], "categories": serialiser_categories(ranked)}
+        except Exception as e:
+            return {"id": record["id"], "erreur": str(e)}
+
+    # Au plus concurrency tâches en vol : le lot n'est jamais chargé entièrement en mémoire
+    pending = set()
+    records = _records(items)
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency:
+                record = next(records, None)
+                if record is None:
+                    exhausted = True
+                elif checkpoint is not None and record["id"] in checkpoint.done:
+                    stats.skipped += 1
+                else:
+                    pending.add(asyncio.ensure_future(categorize(record)))
+            if not pending:
+                break
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                output = task.result()
+                stats.done += 1
+                stats.errors += "erreur" in output
+                if checkpoint is not None:
+                    checkpoint.write(output)
+                if progress_every and stats.done % progress_every == 0:
+                    print(f"Catégorisation par lot : {stats.summary()}")
+                yield output
+    finally:
+        # Lot interrompu (client déconnecté, arrêt) : les catégorisations en cours sont annulées
+        for task in pending:
+            task.cancel()
+
+
+def categorize_file(input_path: str, output_path: str, concurrency: int = CATEGORIZATION_BATCH_CONCURRENCY) -> dict:
+    """
+    Catégorise un fichier JSONL vers un fichier JSONL de résultats ; relancée avec le même
+    fichier de sortie, elle reprend là où elle s'était arrêtée
+    Returns:
+        dict: Bilan (nombre d'actes, erreurs, débit)
+    """
+    checkpoint = Checkpoint(output_path)
+    stats = BatchStats()
+
+    async def run():
+        async for _ in acategorize_many(read_jsonl(input_path), concurrency, checkpoint, stats):
+            pass
+
+    try:
+        asyncio.run(run())
+    finally:
+        checkpoint.close()
+    return stats.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catégorise un fichier JSONL d'actes ({\"id\", \"texte\"} par ligne)")
+    parser.add_argument("entree", help="Fichier JSONL des actes")
+    parser.add_argument("sortie", help="Fichier JSONL des résultats (reprise automatique s'il existe)")
+    parser.add_argument("--concurrence", type=int, default=CATEGORIZATION_BATCH_CONCURRENCY,
+                        help="Nombre de catégorisations simultanées")
+    args = parser.parse_args()
+    print(f"Bilan : {categorize_file(args.entree, args.sortie, args.concurrence)}")
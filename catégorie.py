@@ -1,216 +1,415 @@
 from typing import List, Dict
+from functools import lru_cache
+import asyncio
+import threading
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import SystemMessage
 import os
 
-from entities.catégorie import SubCategory, MainCategory, CategoryResult
-from llm import get_llm
+from entities.catégorie import SubCategory, MainCategory, CategoryResult, SubCategoryResult
+from llm import get_llm, get_structured_llm
+from classifieur import (
+    CATEGORIZATION_LOCAL_THRESHOLD, CentroidClassifier, load_labelled_examples, main_category_examples,
+    select_main_categories, subcategory_examples,
+)
 
 
 
+# Descriptions des sous-catégories de la nomenclature ACTES simplifiée
+SUBCATEGORY_DESCRIPTIONS = {
+    # 1. COMMANDE PUBLIQUE
+    SubCategory.MARCHES_PUBLICS: """Actes relatifs aux marchés publics incluant :
+        - Délibérations de constitution de la commission d'appel d'offres
+        - Délibérations relatives au règlement intérieur
+        - Délibérations d'autorisation de signature
+        - Délibérations/décisions relatives aux MAPA
+        - Délibérations relatives aux avenants et marchés complémentaires""",
+    
+    SubCategory.DELEGATIONS_SERVICE_PUBLIC: """Actes relatifs aux délégations de service public incluant :
+        - Contrats et avenants
+        - Commission d'ouverture des plis
+        - Désignation commission DSP
+        - Autorisation à signer""",
+    
+    SubCategory.CONVENTIONS_MANDAT: """Documents relatifs aux conventions de mandat :
+        - Délibérations
+        - Conventions
+        - Avenants
+        - Compte-rendus""",
+    
+    SubCategory.AUTRES_CONTRATS: """Documents relatifs aux :
+        - Partenariats public-privé
+        - Conventions publiques d'aménagement""",
+    
+    SubCategory.TRANSACTIONS: "Documents relatifs aux protocoles transactionnels et accords amiables",
+    
+    SubCategory.ACTES_MAITRISE_OEUVRE: "Documents relatifs aux marchés de maîtrise d'œuvre selon le type de procédure retenue",
+    
+    SubCategory.ACTES_SPECIAUX_DIVERS: "Procédures de commande publique ne pouvant être classées dans les autres rubriques",
+    
+    # 2. URBANISME
+    SubCategory.DOCUMENTS_URBANISME: """Documents d'urbanisme incluant :
+        - SCOT : arrêtés d'enquête publique, délibérations de périmètre, approbations
+        - PLU : arrêtés d'enquête publique, délibérations d'élaboration, modifications
+        - Cartes communales : délibérations d'élaboration et d'approbation
+        - ZAC : concertation, dossiers de création/réalisation""",
+    
+    SubCategory.ACTES_OCCUPATION_SOLS: """Actes relatifs au droit d'occupation des sols :
+        - Certificats d'urbanisme
+        - Permis de construire/démolir/lotir
+        - Déclarations de travaux
+        - Arrêtés d'alignement
+        - DUP de voirie""",
+    
+    SubCategory.DROIT_PREEMPTION_URBAIN: """Actes relatifs au droit de préemption :
+        - Délibérations d'institution du DPU
+        - Décisions de préemption""",
+    
+    # 3. DOMAINE ET PATRIMOINE
+    SubCategory.ACQUISITIONS: "Délibérations concernant les acquisitions gratuites ou onéreuses",
+    
+    SubCategory.ALIENATIONS: "Délibérations et arrêtés concernant les cessions gratuites ou onéreuses",
+    
+    SubCategory.LOCATIONS: """Actes relatifs aux locations :
+        - Baux à prendre
+        - Baux emphytéotiques""",
+    
+    SubCategory.LIMITES_TERRITORIALES: """Actes relatifs aux limites territoriales :
+        - Modifications des limites
+        - Dossiers d'enquête
+        - Délibérations de périmètres""",
+    
+    SubCategory.ACTES_GESTION_DOMAINE_PUBLIC: """Actes de gestion du domaine public :
+        - Classement/déclassement des voiries
+        - Affectation/désaffectation de biens
+        - Tarifs des services publics locaux
+        - Concessions de cimetière""",
+    
+    SubCategory.ACTES_GESTION_DOMAINE_PRIVE: "Délibérations et arrêtés concernant les baux à donner",
+    
+    # 4. FONCTION PUBLIQUE
+    SubCategory.PERSONNEL_TITULAIRE_FPT: "Personnel titulaire de la fonction publique territoriale",
+    
+    SubCategory.PERSONNEL_CONTRACTUEL: "Personnel contractuel de la fonction publique territoriale",
+    
+    SubCategory.FONCTION_PUBLIQUE_HOSPITALIERE: "Fonction publique hospitalière",
+    
+    SubCategory.AUTRES_CATEGORIES_PERSONNEL: "Autres catégories de personnel",
+    
+    SubCategory.REGIME_INDEMNITAIRE: "Régime indemnitaire",
+    
+    # 5. INSTITUTIONS ET VIE POLITIQUE
+    SubCategory.ELECTION_EXECUTIF: "Élection exécutive",
+    
+    SubCategory.FONCTIONNEMENT_ASSEMBLEES: "Fonctionnement des assemblées",
+    
+    SubCategory.DESIGNATION_REPRESENTANTS: "Désignation de représentants",
+    
+    SubCategory.DELEGATION_FONCTIONS: "Délégation de fonctions",
+    
+    SubCategory.DELEGATION_SIGNATURE: "Délégation de signature",
+    
+    SubCategory.EXERCICE_MANDATS_LOCAUX: "Exercice des mandats locaux",
+    
+    SubCategory.INTERCOMMUNALITE: "Intercommunalité",
+    
+    SubCategory.DECISION_ESTER_JUSTICE: "Décision est-elle de justice ?",
+    
+    # 6. LIBERTES PUBLIQUES ET POUVOIRS DE POLICE
+    SubCategory.POLICE_MUNICIPALE: "Police municipale",
+    
+    SubCategory.POUVOIRS_PRESIDENT_CONSEIL_GENERAL: "Pouvoirs du président du conseil général",
+    
+    SubCategory.AUTRES_ACTES_REGLEMENTAIRES: "Autres actes réglementaires",
+    
+    SubCategory.ACTES_PRIS_NOM_ETAT: "Actes pris en nom d'état",
+    
+    # 7. FINANCES LOCALES
+    SubCategory.DECISIONS_BUDGETAIRES: "Décisions budgétaires",
+    
+    SubCategory.FISCALITE: "Fiscalité",
+    
+    SubCategory.EMPRUNTS: "Emprunts",
+    
+    SubCategory.INTERVENTIONS_ECONOMIQUES: "Interventions économiques",
+    
+    SubCategory.SUBVENTIONS: "Subventions",
+    
+    SubCategory.CONTRIBUTIONS_BUDGETAIRES: "Contributions budgétaires",
+    
+    SubCategory.AVANCES: "Avances",
+    
+    SubCategory.FONDS_CONCOURS: "Fonds de concours",
+    
+    SubCategory.PRISE_PARTICIPATION: "Prise de participation",
+    
+    SubCategory.DIVERS_FINANCES: "Divers financés",
+    
+    # 8. DOMAINES DE COMPETENCES PAR THEMES
+    SubCategory.ENSEIGNEMENT: "Enseignement",
+    
+    SubCategory.AIDE_SOCIALE: "Aide sociale",
+    
+    SubCategory.POLITIQUE_VILLE_HABITAT_LOGEMENT: "Politique de la ville, de l'habitat et du logement",
+    
+    SubCategory.ENVIRONNEMENT: "Environnement",
+    
+    # 9. AUTRES DOMAINES DE COMPETENCES
+    SubCategory.AUTRES_DOMAINES_COMMUNES: "Autres domaines communaux",
+    
+    SubCategory.AUTRES_DOMAINES_DEPARTEMENTS: "Autres domaines départementaux",
+    
+    SubCategory.VOEUX_ET_MOTIONS: "Voeux et motions",
+}
+
+
+# Sous-catégories de chaque catégorie principale
+CATEGORY_HIERARCHY: Dict[MainCategory, List[SubCategory]] = {
+    main_cat: [sub_cat for sub_cat in SubCategory if sub_cat.value.startswith(main_cat.value)]
+    for main_cat in MainCategory
+}
+
+
+def _render_nomenclature(main_categories=None) -> str:
+    categories_str = ""
+    for main_cat in main_categories or MainCategory:
+        categories_str += f"{main_cat.value}. {main_cat.name}\n"
+        for sub_cat in CATEGORY_HIERARCHY[main_cat]:
+            description = SUBCATEGORY_DESCRIPTIONS.get(sub_cat, "Description non disponible")
+            categories_str += f"  {sub_cat.value} {sub_cat.name}: {description}\n"
+    return categories_str
+
+
+def _system_prompt(nomenclature: str) -> str:
+    return f"""Vous êtes un expert en catégorisation des actes administratifs selon la NOMENCLATURE ACTES SIMPLIFIEE.
+Analysez le texte fourni et identifiez toutes les sous-catégories pertinentes en vous basant sur leurs descriptions.
+
+Pour chaque sous-catégorie identifiée, vous devez fournir :
+1. La sous-catégorie concernée
+2. Sa catégorie principale (grand famille)
+3. Un score de confiance entre 0 et 1
+4. Une explication détaillée justifiant la pertinence
+
+{nomenclature}
+Retournez une liste structurée de toutes les sous-catégories pertinentes,
+chacune avec sa catégorie principale, son score de confiance et son explication."""
+
+
+def _build_prompt(system_prompt: str) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=system_prompt),
+        ("human", "Texte à catégoriser : {text}"),
+    ])
+
+
+# Nomenclature rendue une seule fois à l'import
+NOMENCLATURE = _render_nomenclature()
+
+# Le message système (consignes et nomenclature) est identique pour tous les textes : placé en tête
+# du prompt, il forme un préfixe commun que le serveur du modèle peut garder en cache d'un appel à l'autre
+SYSTEM_PROMPT = _system_prompt(NOMENCLATURE)
+
+CATEGORIZATION_PROMPT = _build_prompt(SYSTEM_PROMPT)
+
+# Catégorisation locale (sans LLM) quand le classifieur des sous-catégories est assez confiant.
+# Désactivée par défaut : sa précision n'a pas encore été mesurée sur des actes annotés
+# (python classifieur.py actes_annotes.jsonl) ni le seuil calibré
+CATEGORIZATION_LOCAL = os.getenv("CATEGORIZATION_LOCAL", "0") == "1"
+
+# "plat" (par défaut) : toute la nomenclature est envoyée au LLM ; "hierarchique" : les catégories
+# principales probables sont choisies par un classifieur local et seules leurs sous-catégories sont
+# envoyées au LLM, la nomenclature complète restant utilisée quand ce classifieur hésite
+CATEGORIZATION_MODE = os.getenv("CATEGORIZATION_MODE", "plat")
+
+
+@lru_cache(maxsize=None)
+def focused_prompt(main_categories: frozenset) -> ChatPromptTemplate:
+    """
+    Prompt réduit aux sous-catégories des catégories principales données, compilé une fois par combinaison
+    """
+    main_categories = sorted(main_categories, key=lambda main_cat: int(main_cat.value))
+    return _build_prompt(_system_prompt(_render_nomenclature(main_categories)))
+
+
+@lru_cache(maxsize=None)
+def get_main_category_classifier() -> CentroidClassifier:
+    """
+    Classifieur des catégories principales partagé, dont les centroïdes sont calculés à partir
+    des descriptions de la nomenclature
+    """
+    return CentroidClassifier(main_category_examples(SUBCATEGORY_DESCRIPTIONS))
+
+
+@lru_cache(maxsize=None)
+def get_subcategory_classifier() -> CentroidClassifier:
+    """
+    Classifieur des sous-catégories partagé : descriptions de la nomenclature et exemples
+    annotés de CATEGORIZATION_EXAMPLES
+    """
+    return CentroidClassifier(subcategory_examples(SUBCATEGORY_DESCRIPTIONS, load_labelled_examples()))
+
+
+# Textes catégorisés localement, par le LLM faute de confiance du classifieur local (repli),
+# et par le LLM sans essai local (CATEGORIZATION_LOCAL=0)
+_counts = {"locales": 0, "repli_llm": 0, "llm": 0}
+_counts_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _counts_lock:
+        _counts[key] += 1
+
+
+def stats() -> dict:
+    with _counts_lock:
+        # Le taux de repli ne porte que sur les textes soumis au classifieur local
+        essais = _counts["locales"] + _counts["repli_llm"]
+        return {**_counts, "taux_repli_llm": _counts["repli_llm"] / essais if essais else None}
+
+
 class ActesCategorizer:
-    def __init__(self, model_name: str = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8"):
+    def __init__(self, model_name: str = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8", hierarchical: bool = None,
+                 local: bool = None):
         self.llm = get_llm(model_name=model_name)
-        self.categories = self._generate_category_hierarchy()
-        self.structured_llm = self.llm.with_structured_output(CategoryResult)
-
-    def _generate_category_hierarchy(self) -> Dict[MainCategory, List[SubCategory]]:
-        hierarchy = {}
-        for main_cat in MainCategory:
-            hierarchy[main_cat] = [sub_cat for sub_cat in SubCategory if sub_cat.value.startswith(main_cat.value)]
-        return hierarchy
+        self.categories = CATEGORY_HIERARCHY
+        # Sortie structurée partagée (voir llm.get_structured_llm), avec la méthode par défaut de with_structured_output
+        self.structured_llm = get_structured_llm(CategoryResult, method="json_schema", model_name=model_name)
+        self.chain = CATEGORIZATION_PROMPT | self.structured_llm
+        self.hierarchical = CATEGORIZATION_MODE == "hierarchique" if hierarchical is None else hierarchical
+        self.local = CATEGORIZATION_LOCAL if local is None else local
+        self._chains = {}
 
     def categorize(self, text: str) -> CategoryResult:
-        categories_str = self._format_categories()
-        prompt = ChatPromptTemplate.from_template(
-            """
-            Vous êtes un expert en catégorisation des actes administratifs selon la NOMENCLATURE ACTES SIMPLIFIEE.
-            Analysez le texte fourni et identifiez toutes les sous-catégories pertinentes en vous basant sur leurs descriptions.
-            
-            Pour chaque sous-catégorie identifiée, vous devez fournir :
-            1. La sous-catégorie concernée
-            2. Sa catégorie principale (grand famille)
-            3. Un score de confiance entre 0 et 1
-            4. Une explication détaillée justifiant la pertinence
-
-            {categories}
-
-            Texte à catégoriser : {text}
-
-            Retournez une liste structurée de toutes les sous-catégories pertinentes, 
-            chacune avec sa catégorie principale, son score de confiance et son explication.
-            """
-        )
-
-        messages = prompt.format_messages(
-            categories=categories_str,
-            text=text
-        )
-
-        return self.structured_llm.invoke(messages)
+        # Le texte est encodé une seule fois pour le classifieur local et la première étape hiérarchique
+        vector = self._embed(text) if self.local or self.hierarchical else None
+        result, chain = self._route(text, vector)
+        return result if result is not None else chain.invoke({"text": text})
+
+    async def acategorize(self, text: str) -> CategoryResult:
+        """
+        Version asynchrone de categorize : l'encodage passe par un thread, l'appel au LLM est asynchrone
+        """
+        vector = await asyncio.to_thread(self._embed, text) if self.local or self.hierarchical else None
+        result, chain = self._route(text, vector)
+        return result if result is not None else await chain.ainvoke({"text": text})
+
+    def _route(self, text: str, vector):
+        """
+        Returns:
+            tuple: (résultat local, None) si le classifieur local suffit, sinon (None, chaîne LLM à appeler)
+        """
+        if self.local and vector is not None:
+            result = self.categorize_local(text, vector)
+            if result is not None:
+                _count("locales")
+                return result, None
+            _count("repli_llm")
+        else:
+            _count("llm")
+
+        main_categories = self.select_main_categories(text, vector) if self.hierarchical else None
+        if not main_categories:
+            return None, self.chain
+        return None, self._focused_chain(main_categories)
+
+    def categorize_local(self, text: str, vector=None) -> CategoryResult:
+        """
+        Catégorisation sans LLM : sous-catégorie au centroïde le plus proche, retenue seulement
+        si sa probabilité atteint CATEGORIZATION_LOCAL_THRESHOLD
+        Returns:
+            CategoryResult: Une sous-catégorie, ou None si la confiance est insuffisante
+        """
+        sub_cat, confidence, similarity = get_subcategory_classifier().predict(text, vector)
+        if confidence < CATEGORIZATION_LOCAL_THRESHOLD:
+            return None
+        return CategoryResult(subcategories=[SubCategoryResult(
+            sub_category=sub_cat,
+            main_category=MainCategory(sub_cat.value.split(".")[0]),
+            confidence=round(confidence, 3),
+            explanation=f"Sous-catégorie la plus proche du texte dans la nomenclature "
+                        f"(similarité {similarity:.2f}), déterminée sans appel au LLM",
+        )])
+
+    def _embed(self, text: str):
+        try:
+            return get_subcategory_classifier().embed(text)
+        except Exception as e:
+            print(f"Modèle d'embedding indisponible, catégorisation par le LLM : {str(e)}")
+            return None
+
+    def select_main_categories(self, text: str, vector=None) -> tuple:
+        """
+        Première étape de la catégorisation hiérarchique : catégories principales probables
+        d'après les embeddings du texte (vide si le classifieur hésite, None s'il est indisponible :
+        la nomenclature complète est alors envoyée au LLM)
+        """
+        try:
+            return tuple(select_main_categories(get_main_category_classifier(), text, vector=vector))
+        except Exception as e:
+            print(f"Classifieur des catégories principales indisponible, nomenclature complète : {str(e)}")
+            return None
+
+    def _focused_chain(self, main_categories: tuple):
+        key = frozenset(main_categories)
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = self._chains.setdefault(key, focused_prompt(key) | self.structured_llm)
+        return chain
 
     def _format_categories(self) -> str:
-        categories_str = ""
-        for main_cat in MainCategory:
-            categories_str += f"{main_cat.value}. {main_cat.name}\n"
-            for sub_cat in self.categories[main_cat]:
-                categories_str += f"  {sub_cat.value} {sub_cat.name}: {self._get_subcategory_description(sub_cat)}\n"
-        return categories_str
+        return NOMENCLATURE
 
     def _get_subcategory_description(self, sub_cat: SubCategory) -> str:
-        descriptions = {
-            # 1. COMMANDE PUBLIQUE
-            SubCategory.MARCHES_PUBLICS: """Actes relatifs aux marchés publics incluant :
-                - Délibérations de constitution de la commission d'appel d'offres
-                - Délibérations relatives au règlement intérieur
-                - Délibérations d'autorisation de signature
-                - Délibérations/décisions relatives aux MAPA
-                - Délibérations relatives aux avenants et marchés complémentaires""",
-            
-            SubCategory.DELEGATIONS_SERVICE_PUBLIC: """Actes relatifs aux délégations de service public incluant :
-                - Contrats et avenants
-                - Commission d'ouverture des plis
-                - Désignation commission DSP
-                - Autorisation à signer""",
-            
-            SubCategory.CONVENTIONS_MANDAT: """Documents relatifs aux conventions de mandat :
-                - Délibérations
-                - Conventions
-                - Avenants
-                - Compte-rendus""",
-            
-            SubCategory.AUTRES_CONTRATS: """Documents relatifs aux :
-                - Partenariats public-privé
-                - Conventions publiques d'aménagement""",
-            
-            SubCategory.TRANSACTIONS: "Documents relatifs aux protocoles transactionnels et accords amiables",
-            
-            SubCategory.ACTES_MAITRISE_OEUVRE: "Documents relatifs aux marchés de maîtrise d'œuvre selon le type de procédure retenue",
-            
-            SubCategory.ACTES_SPECIAUX_DIVERS: "Procédures de commande publique ne pouvant être classées dans les autres rubriques",
-            
-            # 2. URBANISME
-            SubCategory.DOCUMENTS_URBANISME: """Documents d'urbanisme incluant :
-                - SCOT : arrêtés d'enquête publique, délibérations de périmètre, approbations
-                - PLU : arrêtés d'enquête publique, délibérations d'élaboration, modifications
-                - Cartes communales : délibérations d'élaboration et d'approbation
-                - ZAC : concertation, dossiers de création/réalisation""",
-            
-            SubCategory.ACTES_OCCUPATION_SOLS: """Actes relatifs au droit d'occupation des sols :
-                - Certificats d'urbanisme
-                - Permis de construire/démolir/lotir
-                - Déclarations de travaux
-                - Arrêtés d'alignement
-                - DUP de voirie""",
-            
-            SubCategory.DROIT_PREEMPTION_URBAIN: """Actes relatifs au droit de préemption :
-                - Délibérations d'institution du DPU
-                - Décisions de préemption""",
-            
-            # 3. DOMAINE ET PATRIMOINE
-            SubCategory.ACQUISITIONS: "Délibérations concernant les acquisitions gratuites ou onéreuses",
-            
-            SubCategory.ALIENATIONS: "Délibérations et arrêtés concernant les cessions gratuites ou onéreuses",
-            
-            SubCategory.LOCATIONS: """Actes relatifs aux locations :
-                - Baux à prendre
-                - Baux emphytéotiques""",
-            
-            SubCategory.LIMITES_TERRITORIALES: """Actes relatifs aux limites territoriales :
-                - Modifications des limites
-                - Dossiers d'enquête
-                - Délibérations de périmètres""",
-            
-            SubCategory.ACTES_GESTION_DOMAINE_PUBLIC: """Actes de gestion du domaine public :
-                - Classement/déclassement des voiries
-                - Affectation/désaffectation de biens
-                - Tarifs des services publics locaux
-                - Concessions de cimetière""",
-            
-            SubCategory.ACTES_GESTION_DOMAINE_PRIVE: "Délibérations et arrêtés concernant les baux à donner",
-            
-            # 4. FONCTION PUBLIQUE
-            SubCategory.PERSONNEL_TITULAIRE_FPT: "Personnel titulaire de la fonction publique territoriale",
-            
-            SubCategory.PERSONNEL_CONTRACTUEL: "Personnel contractuel de la fonction publique territoriale",
-            
-            SubCategory.FONCTION_PUBLIQUE_HOSPITALIERE: "Fonction publique hospitalière",
-            
-            SubCategory.AUTRES_CATEGORIES_PERSONNEL: "Autres catégories de personnel",
-            
-            SubCategory.REGIME_INDEMNITAIRE: "Régime indemnitaire",
-            
-            # 5. INSTITUTIONS ET VIE POLITIQUE
-            SubCategory.ELECTION_EXECUTIF: "Élection exécutive",
-            
-            SubCategory.FONCTIONNEMENT_ASSEMBLEES: "Fonctionnement des assemblées",
-            
-            SubCategory.DESIGNATION_REPRESENTANTS: "Désignation de représentants",
-            
-            SubCategory.DELEGATION_FONCTIONS: "Délégation de fonctions",
-            
-            SubCategory.DELEGATION_SIGNATURE: "Délégation de signature",
-            
-            SubCategory.EXERCICE_MANDATS_LOCAUX: "Exercice des mandats locaux",
-            
-            SubCategory.INTERCOMMUNALITE: "Intercommunalité",
-            
-            SubCategory.DECISION_ESTER_JUSTICE: "Décision est-elle de justice ?",
-            
-            # 6. LIBERTES PUBLIQUES ET POUVOIRS DE POLICE
-            SubCategory.POLICE_MUNICIPALE: "Police municipale",
-            
-            SubCategory.POUVOIRS_PRESIDENT_CONSEIL_GENERAL: "Pouvoirs du président du conseil général",
-            
-            SubCategory.AUTRES_ACTES_REGLEMENTAIRES: "Autres actes réglementaires",
-            
-            SubCategory.ACTES_PRIS_NOM_ETAT: "Actes pris en nom d'état",
-            
-            # 7. FINANCES LOCALES
-            SubCategory.DECISIONS_BUDGETAIRES: "Décisions budgétaires",
-            
-            SubCategory.FISCALITE: "Fiscalité",
-            
-            SubCategory.EMPRUNTS: "Emprunts",
-            
-            SubCategory.INTERVENTIONS_ECONOMIQUES: "Interventions économiques",
-            
-            SubCategory.SUBVENTIONS: "Subventions",
-            
-            SubCategory.CONTRIBUTIONS_BUDGETAIRES: "Contributions budgétaires",
-            
-            SubCategory.AVANCES: "Avances",
-            
-            SubCategory.FONDS_CONCOURS: "Fonds de concours",
-            
-            SubCategory.PRISE_PARTICIPATION: "Prise de participation",
-            
-            SubCategory.DIVERS_FINANCES: "Divers financés",
-            
-            # 8. DOMAINES DE COMPETENCES PAR THEMES
-            SubCategory.ENSEIGNEMENT: "Enseignement",
-            
-            SubCategory.AIDE_SOCIALE: "Aide sociale",
-            
-            SubCategory.POLITIQUE_VILLE_HABITAT_LOGEMENT: "Politique de la ville, de l'habitat et du logement",
-            
-            SubCategory.ENVIRONNEMENT: "Environnement",
-            
-            # 9. AUTRES DOMAINES DE COMPETENCES
-            SubCategory.AUTRES_DOMAINES_COMMUNES: "Autres domaines communaux",
-            
-            SubCategory.AUTRES_DOMAINES_DEPARTEMENTS: "Autres domaines départementaux",
-            
-            SubCategory.VOEUX_ET_MOTIONS: "Voeux et motions",
-        }
-        return descriptions.get(sub_cat, "Description non disponible")
+        return SUBCATEGORY_DESCRIPTIONS.get(sub_cat, "Description non disponible")
 
     def get_categories(self) -> Dict[str, List[str]]:
         return {main.name: [f"{sub.value}: {sub.name}" for sub in subs]
                 for main, subs in self.categories.items()}
 
 
+@lru_cache(maxsize=None)
+def get_categorizer(model_name: str = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8") -> ActesCategorizer:
+    """
+    Retourne le catégoriseur partagé pour un modèle donné, créé au premier appel
+    """
+    return ActesCategorizer(model_name=model_name)
+
+
+def warmup():
+    """
+    Crée le catégoriseur partagé et calcule les centroïdes des classifieurs locaux
+    """
+    categorizer = get_categorizer()
+    vector = categorizer._embed("arrêté municipal") if categorizer.local or categorizer.hierarchical else None
+    if vector is not None and categorizer.local:
+        get_subcategory_classifier().scores(vector=vector)
+    if vector is not None and categorizer.hierarchical:
+        get_main_category_classifier().scores(vector=vector)
+
+
+def serialiser_categories(resultats):
+    """
+    Convertit les résultats de catégorisation en dictionnaires JSON
+    """
+    return [
+        {
+            "sub_category": {
+                "value": res.sub_category.value,
+                "name": res.sub_category.name
+            },
+            "main_category": {
+                "value": res.main_category.value,
+                "name": res.main_category.name
+            },
+            "confidence": res.confidence,
+            "explanation": res.explanation
+        }
+        for res in resultats
+    ]
+
+
 def categorize_llm(text_to_categorize: str, DEBUG : bool = True):
-    categorizer = ActesCategorizer()
+    categorizer = get_categorizer()
     result = categorizer.categorize(text_to_categorize)
 
     # Tri des résultats par confiance décroissante
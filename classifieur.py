@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from entities.catégorie import MainCategory, SubCategory
+
+# Nombre de caractères du texte encodé (CamemBERT ne lit que les 512 premiers tokens)
+CLASSIFIER_MAX_CHARS = int(os.getenv("CLASSIFIER_MAX_CHARS", "2000"))
+# Exemples annotés facultatifs (JSONL : {"texte": ..., "sous_categorie": "6.1"}) ajoutés aux descriptions
+CATEGORIZATION_EXAMPLES = os.getenv("CATEGORIZATION_EXAMPLES", "")
+# Confiance minimale de la sous-catégorie locale pour se passer du LLM
+CATEGORIZATION_LOCAL_THRESHOLD = float(os.getenv("CATEGORIZATION_LOCAL_THRESHOLD", "0.6"))
+# Catégories principales gardées au plus par la première étape hiérarchique
+CATEGORIZATION_STAGE1_TOP_K = int(os.getenv("CATEGORIZATION_STAGE1_TOP_K", "3"))
+# Écart de similarité à la plus proche en deçà duquel une catégorie principale est gardée
+CATEGORIZATION_STAGE1_MARGIN = float(os.getenv("CATEGORIZATION_STAGE1_MARGIN", "0.05"))
+# Température du softmax qui convertit les similarités aux centroïdes en probabilités
+CATEGORIZATION_TEMPERATURE = float(os.getenv("CATEGORIZATION_TEMPERATURE", "0.02"))
+
+
+def _label(enum_member) -> str:
+    return enum_member.name.replace("_", " ").lower()
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class CentroidClassifier:
+    """
+    Classifieur par plus proche centroïde sur les embeddings CamemBERT : chaque classe est
+    représentée par la moyenne normalisée des embeddings de ses textes d'exemple, et un texte
+    reçoit la similarité cosinus entre son embedding et chaque centroïde.
+    Les centroïdes sont calculés au premier appel, en un seul lot d'encodage.
+    """
+
+    def __init__(self, examples: Dict[object, List[str]], embedding_model=None):
+        """
+        Args:
+            examples (dict): Textes d'exemple de chaque classe
+            embedding_model: Modèle d'embedding (celui du RAG par défaut)
+        """
+        self.examples = examples
+        self._embedding_model = embedding_model
+        self._lock = threading.Lock()
+        self.labels = None
+        self.centroids = None
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            from rag import get_embedding_model
+            self._embedding_model = get_embedding_model()
+        return self._embedding_model
+
+    def _fit(self):
+        if self.centroids is not None:
+            return
+        with self._lock:
+            if self.centroids is not None:
+                return
+            labels = [label for label, texts in self.examples.items() if texts]
+            texts = [text for label in labels for text in self.examples[label]]
+            vectors = _normalize(self.embedding_model.embed_documents(texts))
+            centroids = []
+            start = 0
+            for label in labels:
+                end = start + len(self.examples[label])
+                centroids.append(vectors[start:end].mean(axis=0))
+                start = end
+            self.labels = labels
+            self.centroids = _normalize(centroids)
+
+    def embed(self, text: str) -> np.ndarray:
+        return _normalize(self.embedding_model.embed_documents([text[:CLASSIFIER_MAX_CHARS]])[0])
+
+    def scores(self, text: str = None, vector: np.ndarray = None) -> List[Tuple[object, float]]:
+        """
+        Returns:
+            list: (classe, similarité cosinus) par similarité décroissante
+        """
+        self._fit()
+        vector = self.embed(text) if vector is None else vector
+        similarities = self.centroids @ vector
+        order = np.argsort(-similarities)
+        return [(self.labels[i], float(similarities[i])) for i in order]
+
+    def predict(self, text: str = None, vector: np.ndarray = None, temperature: float = CATEGORIZATION_TEMPERATURE):
+        """
+        Classe la plus proche et sa probabilité (softmax des similarités divisées par la température)
+        Returns:
+            tuple: (classe, probabilité, similarité cosinus)
+        """
+        ranked = self.scores(text, vector)
+        similarities = np.array([score for _, score in ranked], dtype=np.float64)
+        weights = np.exp((similarities - similarities[0]) / temperature)
+        return ranked[0][0], float(weights[0] / weights.sum()), ranked[0][1]
+
+
+def main_category_examples(descriptions: Dict[SubCategory, str]) -> Dict[MainCategory, List[str]]:
+    """
+    Textes d'exemple de chaque catégorie principale : une phrase par sous-catégorie
+    (nom et description), préfixée du nom de la catégorie principale
+    """
+    examples = {}
+    for main_cat in MainCategory:
+        examples[main_cat] = [
+            f"{_label(main_cat)} - {_label(sub_cat)} : {descriptions.get(sub_cat, '')}"
+            for sub_cat in SubCategory if sub_cat.value.split(".")[0] == main_cat.value
+        ]
+    return examples
+
+
+def load_labelled_examples(path: str = CATEGORIZATION_EXAMPLES) -> Dict[SubCategory, List[str]]:
+    """
+    Lit les exemples annotés d'un fichier JSONL ({"texte": ..., "sous_categorie": "6.1"} par ligne)
+    """
+    examples = {}
+    if not path:
+        return examples
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                examples.setdefault(SubCategory(record["sous_categorie"]), []).append(record["texte"])
+            except (ValueError, KeyError) as e:
+                print(f"{path}, ligne {line_number} ignorée : {str(e)}")
+    return examples
+
+
+def subcategory_examples(descriptions: Dict[SubCategory, str],
+                         labelled: Dict[SubCategory, List[str]] = None) -> Dict[SubCategory, List[str]]:
+    """
+    Textes d'exemple de chaque sous-catégorie : son nom et sa description, puis les exemples annotés
+    """
+    labelled = labelled or {}
+    return {
+        sub_cat: [f"{_label(sub_cat)} : {descriptions.get(sub_cat, '')}"] + labelled.get(sub_cat, [])
+        for sub_cat in SubCategory
+    }
+
+
+def evaluate(classifier: CentroidClassifier, examples: Dict[SubCategory, List[str]],
+             thresholds: List[float]) -> List[dict]:
+    """
+    Mesure, pour chaque seuil de confiance, la part des textes annotés que le classifieur local
+    catégoriserait sans LLM (couverture) et la part de ces textes correctement catégorisés (précision).
+    Les textes évalués ne doivent pas figurer parmi les exemples qui ont servi aux centroïdes.
+    Args:
+        examples (dict): Textes annotés de chaque sous-catégorie (voir load_labelled_examples)
+        thresholds (list): Seuils de confiance comparés
+    Returns:
+        list: {"seuil", "couverture", "precision", "textes"} par seuil
+    """
+    predictions = [
+        (expected, *classifier.predict(text)[:2])
+        for expected, texts in examples.items() for text in texts
+    ]
+    results = []
+    for threshold in thresholds:
+        retained = [(expected, predicted) for expected, predicted, confidence in predictions if confidence >= threshold]
+        correct = sum(1 for expected, predicted in retained if expected == predicted)
+        results.append({
+            "seuil": threshold,
+            "couverture": len(retained) / len(predictions) if predictions else 0.0,
+            "precision": correct / len(retained) if retained else None,
+            "textes": len(predictions),
+        })
+    return results
+
+
+def select_main_categories(classifier: CentroidClassifier, text: str, top_k: int = CATEGORIZATION_STAGE1_TOP_K,
+                           margin: float = CATEGORIZATION_STAGE1_MARGIN, vector: np.ndarray = None) -> List[MainCategory]:
+    """
+    Première étape de la catégorisation hiérarchique : catégories principales probables,
+    c'est-à-dire la plus proche et celles à moins de margin de similarité.
+    Si plus de top_k catégories sont dans cette marge, le classifieur ne les départage pas :
+    aucune n'est retenue et la nomenclature complète est envoyée au LLM.
+    Returns:
+        list: Catégories principales retenues, vide si la première étape n'est pas assez nette
+    """
+    ranked = classifier.scores(text, vector)
+    best = ranked[0][1]
+    close = [label for label, score in ranked if score >= best - margin]
+    return close if len(close) <= top_k else []
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from catégorie import get_subcategory_classifier
+
+    parser = argparse.ArgumentParser(
+        description="Mesure la précision de la catégorisation locale sur des actes annotés, avant de l'activer"
+    )
+    parser.add_argument("fichier", help="Actes annotés (JSONL : {\"texte\": ..., \"sous_categorie\": \"6.1\"} par ligne), "
+                                        "distincts de CATEGORIZATION_EXAMPLES")
+    parser.add_argument("--seuils", default="0.5,0.6,0.7,0.8,0.9", help="Seuils de confiance comparés")
+    args = parser.parse_args()
+    thresholds = [float(threshold) for threshold in args.seuils.split(",")]
+    for row in evaluate(get_subcategory_classifier(), load_labelled_examples(args.fichier), thresholds):
+        precision = "-" if row["precision"] is None else f"{row['precision']:.1%}"
+        print(f"seuil {row['seuil']:.2f} : couverture {row['couverture']:.1%}, précision {precision} ({row['textes']} textes)")
@@ -0,0 +1,205 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8")
+# Nombre de tokens réservés au document et aux références dans le prompt d'analyse
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "6000"))
+# Coût en euros pour 1000 tokens envoyés / générés (0 par défaut : API Albert)
+LLM_COST_INPUT_PER_1K = float(os.getenv("LLM_COST_INPUT_PER_1K", "0"))
+LLM_COST_OUTPUT_PER_1K = float(os.getenv("LLM_COST_OUTPUT_PER_1K", "0"))
+
+# Approximation utilisée si le tokenizer du modèle n'est pas disponible
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(name: str = TOKENIZER_NAME):
+    """
+    Retourne le tokenizer du modèle, ou None s'il ne peut pas être chargé
+    (les comptes sont alors estimés à partir du nombre de caractères)
+    """
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        print(f"Tokenizer {name} indisponible, estimation des tokens par caractères : {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Tronque un texte à max_tokens tokens
+    """
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens * _CHARS_PER_TOKEN]
+    tokens = tokenizer.encode(text, add_special_tokens=False)
+    if len(tokens) <= max_tokens:
+        return text
+    return tokenizer.decode(tokens[:max_tokens])
+
+
+@dataclass
+class PackedContext:
+    document: str
+    passages: str
+    citations: List[dict] = field(default_factory=list)
+    document_tokens: int = 0
+    passages_tokens: int = 0
+    document_truncated: bool = False
+    passages_dropped: int = 0
+
+    def metrics(self) -> dict:
+        return {
+            "tokens_document": self.document_tokens,
+            "tokens_references": self.passages_tokens,
+            "document_tronque": self.document_truncated,
+            "references_retenues": len(self.citations),
+            "references_ecartees": self.passages_dropped,
+        }
+
+
+class ContextBuilder:
+    """
+    Remplit un budget de tokens avec le document à analyser puis les passages retrouvés,
+    dans l'ordre de priorité : le document (jusqu'à document_share du budget), puis les
+    passages dans leur ordre de classement, chacun identifié par [R1], [R2]...
+    Le budget non utilisé par les passages revient au document.
+    """
+
+    def __init__(self, budget: int = RAG_CONTEXT_TOKENS, document_share: float = 0.5, min_passage_tokens: int = 64):
+        self.budget = budget
+        self.document_share = document_share
+        self.min_passage_tokens = min_passage_tokens
+
+    def build(self, document: str, passages) -> PackedContext:
+        """
+        Args:
+            document (str): Texte du document à analyser
+            passages (list): Documents LangChain retrouvés, du plus au moins pertinent
+        """
+        document_tokens = count_tokens(document)
+        document_budget = min(document_tokens, int(self.budget * self.document_share))
+        remaining = self.budget - document_budget
+
+        citations = []
+        blocks = []
+        dropped = 0
+        for passage in passages:
+            ref = f"R{len(citations) + 1}"
+            header = f"[{ref}] {_describe(passage.metadata)}\n"
+            content = passage.page_content.strip()
+            tokens = count_tokens(header + content)
+            if tokens > remaining:
+                # Le dernier passage est tronqué s'il reste assez de place pour qu'il soit utile
+                if remaining - count_tokens(header) < self.min_passage_tokens:
+                    dropped += 1
+                    continue
+                content = truncate_to_tokens(content, remaining - count_tokens(header))
+                tokens = remaining
+            blocks.append(header + content)
+            citations.append({
+                "ref": ref,
+                "id": passage.metadata.get("id"),
+                "source": passage.metadata.get("source"),
+                "score": passage.metadata.get("score"),
+                "tokens": tokens,
+            })
+            remaining -= tokens
+
+        passages_tokens = self.budget - document_budget - remaining
+        # Rend au document la place laissée libre par les passages
+        document_budget = min(document_tokens, self.budget - passages_tokens)
+        packed_document = truncate_to_tokens(document, document_budget)
+
+        return PackedContext(
+            document=packed_document,
+            passages="\n\n".join(blocks),
+            citations=citations,
+            document_tokens=min(document_tokens, document_budget),
+            passages_tokens=passages_tokens,
+            document_truncated=document_budget < document_tokens,
+            passages_dropped=dropped,
+        )
+
+
+def _describe(metadata: dict) -> str:
+    source = os.path.basename(metadata.get("source", "") or "")
+    page = metadata.get("page")
+    return f"({source}, page {page + 1})" if source and page is not None else f"({source})" if source else ""
+
+
+class UsageMeter:
+    """
+    Compteurs cumulés de tokens et de coût des appels LLM
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cached_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    def measure(self, step: str, prompt: str, response_text: str, elapsed: float, usage: dict = None,
+                cached: bool = False) -> dict:
+        """
+        Mesure un appel : tokens rapportés par l'API (usage_metadata) si disponibles, sinon comptés.
+        Une réponse servie par le cache LLM n'a rien consommé : ni tokens ni coût
+        (son usage_metadata est celui de l'appel d'origine)
+        """
+        if cached:
+            with self._lock:
+                self.calls += 1
+                self.cached_calls += 1
+            return {"etape": step, "tokens_entree": 0, "tokens_sortie": 0, "cout": 0.0, "duree_s": elapsed,
+                    "cache": True}
+        if usage:
+            input_tokens = usage.get("input_tokens", 0)
+            output_tokens = usage.get("output_tokens", 0)
+        else:
+            input_tokens = count_tokens(prompt)
+            output_tokens = count_tokens(response_text)
+        cost = input_tokens / 1000 * LLM_COST_INPUT_PER_1K + output_tokens / 1000 * LLM_COST_OUTPUT_PER_1K
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost += cost
+        return {
+            "etape": step,
+            "tokens_entree": input_tokens,
+            "tokens_sortie": output_tokens,
+            "cout": cost,
+            "duree_s": elapsed,
+            "cache": False,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "appels": self.calls,
+            "appels_en_cache": self.cached_calls,
+            "tokens_entree": self.input_tokens,
+            "tokens_sortie": self.output_tokens,
+            "cout": self.cost,
+        }
+
+
+usage_meter = UsageMeter()
@@ -0,0 +1,20 @@
+import argparse
+import time
+
+from rag import COLLECTION_NAME, PERSIST_DIRECTORY, VECTOR_INDEX_DIRECTORY
+from vector_backend import ChromaBackend, export_memmap
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exporte la base Chroma en un index mmap en lecture seule (VECTOR_BACKEND=mmap)"
+    )
+    parser.add_argument("--dossier", default=VECTOR_INDEX_DIRECTORY, help="Dossier de l'index exporté")
+    parser.add_argument("--taille-page", type=int, default=5000, help="Nombre de morceaux lus par appel à Chroma")
+    parser.add_argument("--faiss", action="store_true", help="Construire aussi un index HNSW FAISS (nécessite faiss ; chargé en entier par chaque worker)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # Les vecteurs sont relus tels quels : le modèle d'embedding n'est pas chargé
+    source = ChromaBackend(None, COLLECTION_NAME, PERSIST_DIRECTORY)
+    count = export_memmap(source, args.dossier, page_size=args.taille_page, build_faiss=args.faiss)
+    print(f"{count} morceaux exportés dans {args.dossier} en {time.perf_counter() - start:.1f}s")
@@ -1,9 +1,23 @@
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, Field
-from typing import Dict, Optional
-import os
+from pydantic import BaseModel, Field, create_model
+from typing import Dict, List, Optional, Tuple
 import json
+import os
+import re
 from enum import Enum
+from functools import lru_cache
+from operator import itemgetter
+from langchain_core.runnables import RunnableParallel
+from llm import get_structured_llm, llm_error_status
+
+# Au-delà de cette longueur, le document est analysé section par section (visas, considérants, dispositif, signature)
+FORME_LONG_DOCUMENT_CHARS = int(os.getenv("FORME_LONG_DOCUMENT_CHARS", "8000"))
+# Longueur maximale d'une section envoyée au modèle (début et fin conservés au-delà)
+FORME_SECTION_MAX_CHARS = int(os.getenv("FORME_SECTION_MAX_CHARS", "12000"))
+# Longueur de l'extrait de chaque section (début et fin) montré aux analyses qui jugent l'acte entier
+FORME_OUTLINE_EXCERPT_CHARS = int(os.getenv("FORME_OUTLINE_EXCERPT_CHARS", "600"))
+# Pré-extraction par règles des champs sans jugement (collectivité, signataire, « Fait à ... », publication),
+# retirés du schéma que le modèle doit remplir, et des extraits qui servent de preuves
+FORME_PRE_EXTRACTION = os.getenv("FORME_PRE_EXTRACTION", "1") == "1"
 
 contexte = """
 Prendre un arrêté
@@ -228,55 +242,464 @@ class AnalyseArrete(BaseModel):
     class Config:
         use_enum_values = True  # Utiliser les valeurs des énumérations lors de la sérialisation
 
-def analyser_arrete(contexte: str = contexte, contenu: str = contenu) -> str:
-    # Récupération de la clé API
-    api_key = os.getenv("API_KEY")
-    base_url = "https://albert.api.etalab.gouv.fr/v1"
-    
-    llm = ChatOpenAI(
-        base_url=base_url, 
-        api_key=api_key, 
-        model_name="neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8"
-    )
-    
-    # Utilisation de with_structured_output pour obtenir une sortie structurée
-    structured_llm = llm.with_structured_output(
-        AnalyseArrete,
-        method="function_calling"
-    )
+# Début de chaque section d'un acte (premières lignes correspondantes)
+SECTION_PATTERNS = {
+    "visas": re.compile(r"^\s*vu\b", re.IGNORECASE),
+    "considerants": re.compile(r"^\s*consid[ée]rant\b", re.IGNORECASE),
+    "dispositif": re.compile(
+        r"^\s*(arr[êe]te|arr[êe]tons|d[ée]cide|d[ée]lib[èe]re)\s*:?\s*$|^\s*article\s+(premier|1er|1)\b",
+        re.IGNORECASE
+    ),
+    "signature": re.compile(r"^\s*(fait\s+[àa]|fait\s+le|ainsi\s+fait|d[ée]lib[ée]r[ée]\s+en|pour\s+extrait)\b",
+                            re.IGNORECASE),
+}
 
-    # Création du prompt
-    prompt = f"""Tu es un expert en droit administratif français. Analyse le document suivant selon le contexte fourni.
-    Fournis une analyse détaillée et précise du document en évaluant sa conformité aux exigences légales. verfie 
-    
+# Parties du contexte utiles à l'évaluation de chaque section (titres de paragraphes de `contexte`)
+CONTEXT_HEADINGS = (
+    "Prendre un arrêté", "La motivation des actes", "La transmission des actes", "La publicité des actes",
+    "Le registre des actes", "La communication au public", "Le retrait et l'abrogation des arrêtés",
+    "La rétroactivité",
+)
+
+
+def split_sections(contenu: str) -> Dict[str, str]:
+    """
+    Découpe un acte en sections : en-tête, visas, considérants, dispositif et bloc de signature
+    Returns:
+        dict: Texte de chaque section trouvée ; vide si le dispositif n'a pas été repéré
+    """
+    lines = contenu.splitlines()
+    starts = {}
+    for i, line in enumerate(lines):
+        for name, pattern in SECTION_PATTERNS.items():
+            if name not in starts and pattern.match(line):
+                # Le bloc de signature suit le dispositif ; les autres sections le précèdent
+                if name == "signature" and "dispositif" not in starts:
+                    continue
+                if name in ("visas", "considerants") and "dispositif" in starts:
+                    continue
+                starts[name] = i
+    if "dispositif" not in starts:
+        return {}
+
+    # La signature est le dernier « Fait à ... » du document
+    for i in range(len(lines) - 1, starts["dispositif"], -1):
+        if SECTION_PATTERNS["signature"].match(lines[i]):
+            starts["signature"] = i
+            break
+
+    boundaries = sorted(starts.items(), key=lambda item: item[1])
+    sections = {"entete": "\n".join(lines[:boundaries[0][1]]).strip()}
+    for (name, start), (_, end) in zip(boundaries, boundaries[1:] + [(None, len(lines))]):
+        sections[name] = "\n".join(lines[start:end]).strip()
+    return sections
+
+
+def _context_parts(contexte: str) -> Dict[str, str]:
+    """
+    Paragraphes du contexte indexés par leur titre (vide si le contexte n'a pas ces titres)
+    """
+    parts, current = {}, None
+    for line in contexte.strip().splitlines():
+        if line.strip() in CONTEXT_HEADINGS:
+            current = line.strip()
+            parts[current] = [line]
+        elif current is not None:
+            parts[current].append(line)
+    return {title: "\n".join(text) for title, text in parts.items()}
+
+
+def _truncate_section(text: str, max_chars: int = FORME_SECTION_MAX_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    # Les derniers articles (publication, transmission, exécution) sont en fin de dispositif
+    half = max_chars // 2
+    return f"{text[:half]}\n[...]\n{text[-half:]}"
+
+
+_MOIS = "janvier|février|fevrier|mars|avril|mai|juin|juillet|août|aout|septembre|octobre|novembre|décembre|decembre"
+_DATE = rf"(?:\d{{1,2}}(?:er)?\s+(?:{_MOIS})\s+\d{{4}}|\d{{1,2}}/\d{{1,2}}/\d{{4}})"
+_FAIT_A = re.compile(rf"^[ \t]*fait\s+[àa]\s+(?P<lieu>[^,\n]+?),?\s+le\s+(?P<date>{_DATE})", re.IGNORECASE | re.MULTILINE)
+_VISA = re.compile(r"^[ \t]*vu\b.*$", re.IGNORECASE | re.MULTILINE)
+_CONSIDERANT = re.compile(r"^[ \t]*consid[ée]rant\b.*$", re.IGNORECASE | re.MULTILINE)
+_FORMULE = re.compile(r"^[ \t]*(arr[êe]te|arr[êe]tons|d[ée]cide|d[ée]lib[èe]re)[ \t]*:?[ \t]*$",
+                      re.IGNORECASE | re.MULTILINE)
+_ARTICLE_PREMIER = re.compile(r"^[ \t]*article\s+(premier|1er|1)\b.*$", re.IGNORECASE | re.MULTILINE)
+# Publication ou affichage de l'acte (la transmission ou notification au préfet relève de la transmission)
+_PUBLICATION = re.compile(
+    r"^.*\b(publi[ée]e?s?|publication|affich[ée]e?s?|affichage|recueil des actes administratifs)\b.*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_PREFET = re.compile(r"\b(pr[ée]f[eè]te?s?|pr[ée]fecture|sous-pr[ée]f\w*|repr[ée]sentant de l'[ÉE]tat|"
+                     r"contr[ôo]le de l[ée]galit[ée]|transmis\w*)\b", re.IGNORECASE)
+# Prénom NOM ou NOM Prénom, éventuellement précédé d'une civilité
+_SIGNATAIRE = re.compile(
+    r"^[ \t]*(?:(?:M\.|Mme|Monsieur|Madame)\s+)?"
+    r"((?:[A-ZÉÈÎÏ][a-zéèêëîïôûç'-]+[ \t]+)+[A-ZÉÈÀÂÊÎÔÛÇ][A-ZÉÈÀÂÊÎÔÛÇ' -]+|[A-ZÉÈÀÂÊÎÔÛÇ][A-ZÉÈÀÂÊÎÔÛÇ'-]+(?:[ \t]+[A-ZÉÈÎÏ][a-zéèêëîïôûç'-]+)+)[ \t]*$",
+    re.MULTILINE
+)
+# Collectivité émettrice, cherchée seulement dans l'en-tête et le bloc de signature (les visas
+# citent d'autres collectivités) ; nom composé de mots à majuscule sur la même ligne
+_COLLECTIVITE = re.compile(
+    r"\b(?:Ville|Commune|Mairie|Maire|Métropole|Département|Région)[ \t]+(?:de[ \t]+la[ \t]+|de[ \t]+l'|du[ \t]+|des[ \t]+|de[ \t]+|d')"
+    r"([A-ZÉÈÂÎ][\w'-]*(?:[ \t-](?:sur|sous|en|le|la|les|lès|du|de)?[ \t-]?[A-ZÉÈÂÎ][\w'-]*)*)"
+)
+# Longueur de l'en-tête examiné quand aucune section n'est repérée
+ENTETE_MAX_CHARS = 500
+
+# Nombre de lignes du bloc de signature examinées après « Fait à ..., le ... »
+SIGNATURE_LINES = 4
+
+
+def _preuve(match, group: int = 0) -> dict:
+    return {"debut": match.start(group), "fin": match.end(group), "extrait": match.group(group).strip()}
+
+
+def pre_extraire(contenu: str) -> Tuple[Dict[str, object], Dict[str, List[dict]]]:
+    """
+    Repère par règles les éléments de forme d'un acte. Les champs qui ne demandent pas de jugement
+    sont remplis directement et retirés du schéma que le modèle doit produire : collectivité,
+    signataire, date (« Fait à ..., le ... ») et mention de publication ou d'affichage.
+    Les visas, considérants, dispositif et bloc de signature ne sont repérés que comme preuves :
+    leur conformité reste jugée par le modèle.
+    Returns:
+        tuple: (champs remplis par les règles, preuves : positions et extraits par élément)
+    """
+    champs, preuves = {}, {}
+
+    visas = list(_VISA.finditer(contenu))
+    if visas:
+        preuves["visas"] = [_preuve(m) for m in visas]
+
+    considerants = list(_CONSIDERANT.finditer(contenu))
+    if considerants:
+        preuves["considerants"] = [_preuve(m) for m in considerants]
+
+    formule = _FORMULE.search(contenu)
+    article = _ARTICLE_PREMIER.search(contenu, formule.end() if formule else 0)
+    if article:
+        preuves["dispositif"] = [_preuve(m) for m in (formule, article) if m]
+        # Mention de publication ou d'affichage dans le dispositif, hors transmission au préfet
+        publications = [m for m in _PUBLICATION.finditer(contenu, article.start()) if not _PREFET.search(m.group())]
+        if publications:
+            preuves["publication"] = [_preuve(m) for m in publications]
+            champs["publication"] = ConformiteDetail(
+                etat="conforme",
+                explication=f"Mention de publication ou d'affichage : « {publications[0].group().strip()} »",
+            )
+
+    fait_a = None
+    for fait_a in _FAIT_A.finditer(contenu):
+        pass
+    signature_debut = len(contenu)
+    if fait_a:
+        signature_debut = fait_a.start()
+        preuves["date"] = [{**_preuve(fait_a), "lieu": fait_a.group("lieu").strip(), "date": fait_a.group("date")}]
+        champs["date"] = ConformiteDetail(
+            etat="conforme",
+            explication=f"Acte daté du {fait_a.group('date')} à {fait_a.group('lieu').strip()} : « {fait_a.group().strip()} »",
+        )
+        # Le nom du signataire suit la qualité (« Le Maire », ...) sous la date
+        bloc_fin = fait_a.end()
+        for _ in range(SIGNATURE_LINES):
+            fin_ligne = contenu.find("\n", bloc_fin + 1)
+            bloc_fin = len(contenu) if fin_ligne == -1 else fin_ligne
+        signataire = _SIGNATAIRE.search(contenu, fait_a.end(), bloc_fin)
+        if signataire:
+            bloc = contenu[fait_a.start():signataire.end()]
+            preuves["signature"] = [{"debut": fait_a.start(), "fin": signataire.end(), "extrait": bloc.strip()}]
+            preuves["signataire"] = [_preuve(signataire, 1)]
+            champs["signataire"] = " ".join(signataire.group(1).split())
+
+    # En-tête : ce qui précède les visas, considérants ou le dispositif
+    debuts = [m.start() for m in (visas[:1] + considerants[:1] + [formule, article]) if m]
+    entete_fin = min(debuts) if debuts else min(len(contenu), ENTETE_MAX_CHARS)
+    collectivite = _COLLECTIVITE.search(contenu, 0, entete_fin) or _COLLECTIVITE.search(contenu, signature_debut)
+    if collectivite:
+        preuves["collectivité"] = [_preuve(collectivite)]
+        champs["collectivité"] = collectivite.group(1)
+    return champs, preuves
+
+
+def _champs_pour(schema, champs: Dict[str, object]) -> Dict[str, object]:
+    """
+    Champs pré-extraits qui appartiennent au schéma (directement ou dans sa conformité légale)
+    """
+    noms = set(schema.model_fields)
+    if "conformite_aux_exigences_legales" in noms:
+        noms |= set(ConformiteLegale.model_fields)
+    return {name: value for name, value in champs.items() if name in noms}
+
+
+@lru_cache(maxsize=None)
+def schema_sans(schema, noms: frozenset):
+    """
+    Variante du schéma sans les champs déjà remplis par les règles : le modèle ne les produit pas.
+    Créée une fois par combinaison, de sorte que le client structuré partagé (llm.py) l'est aussi.
+    """
+    if not noms:
+        return schema
+    fields = {}
+    for name, field in schema.model_fields.items():
+        if name in noms:
+            continue
+        annotation = field.annotation
+        if annotation is ConformiteLegale:
+            annotation = schema_sans(ConformiteLegale, noms)
+        fields[name] = (annotation, field)
+    return create_model(schema.__name__, __config__=schema.model_config, __doc__=schema.__doc__, **fields)
+
+
+def completer(schema, resultat: BaseModel, champs: Dict[str, object]) -> BaseModel:
+    """
+    Reconstitue le schéma complet à partir de la réponse du modèle et des champs pré-extraits
+    """
+    data = resultat.model_dump()
+    for name, value in champs.items():
+        if name in schema.model_fields:
+            data[name] = value
+        else:
+            data["conformite_aux_exigences_legales"][name] = value
+    return schema(**data)
+
+
+class AnalysePartielle(BaseModel):
+    observation: str = Field(description="Observations sur la partie analysée")
+    niveau_de_confiance: str = Field(description="Note en pourcentage")
+
+
+class AnalyseVisas(AnalysePartielle):
+    visas: ConformiteDetail
+
+
+class AnalyseConsiderants(AnalysePartielle):
+    considerants: ConformiteDetail
+
+
+class AnalyseDispositif(AnalysePartielle):
+    dispositif: ConformiteDetail
+    publication: ConformiteDetail
+    transmission: ConformiteDetail
+
+
+class AnalyseEnteteSignature(AnalysePartielle):
+    type_de_document: TypeDocument = Field(description="Type du document administratif (ex : arrêté, décision, ...)")
+    ecriture: ConformiteDetail
+    date: ConformiteDetail
+    signature: ConformiteDetail
+    completion: ConformiteDetail
+    collectivité: str = Field(description="Nom de la collectivité (ville, commune, ...) qui a emis le texte")
+    signataire: str = Field(description="Nom et prénom du signataire ")
+
+    class Config:
+        use_enum_values = True
+
+
+# Analyses partielles : schéma, sections du document, parties du contexte et consigne
+PARTIAL_ANALYSES = {
+    "visas": (AnalyseVisas, ("visas",), ("Prendre un arrêté",),
+              "Évalue uniquement les visas (textes en application desquels l'acte est pris)."),
+    "considerants": (AnalyseConsiderants, ("considerants",), ("Prendre un arrêté", "La motivation des actes"),
+                     "Évalue uniquement les considérants, c'est-à-dire la motivation de l'acte."),
+    "dispositif": (AnalyseDispositif, ("dispositif",),
+                   ("Prendre un arrêté", "La transmission des actes", "La publicité des actes", "La rétroactivité"),
+                   "Évalue le dispositif (articles de l'acte) ainsi que les mentions de publication et de transmission."),
+    "entete_signature": (AnalyseEnteteSignature, ("entete", "signature"),
+                         ("Prendre un arrêté", "Le registre des actes", "Le retrait et l'abrogation des arrêtés"),
+                         "Évalue le type de document, l'écriture, la date, la signature et la complétude de l'acte, "
+                         "et précise la collectivité et le signataire. L'écriture et la complétude portent sur "
+                         "l'acte entier : juge-les aussi d'après les extraits des autres sections du plan."),
+}
+
+# Analyses qui jugent l'acte entier : leur plan du document contient un extrait de chaque section
+WHOLE_DOCUMENT_ANALYSES = {"entete_signature"}
+
+SECTION_LABELS = {"entete": "En-tête", "visas": "Visas", "considerants": "Considérants",
+                  "dispositif": "Dispositif", "signature": "Bloc de signature"}
+
+
+def _partial_prompt(instruction: str, context: str, sections: Dict[str, str], names, outline: str,
+                    notes: str = "") -> str:
+    document = "\n\n".join(
+        f"[{SECTION_LABELS[name]}]\n{_truncate_section(sections[name])}" for name in names if sections.get(name)
+    ) or "(section absente)"
+    return f"""Tu es un expert en droit administratif français. Tu analyses une partie d'un document selon le contexte fourni.
+    {instruction}
+    Justifie chaque état de conformité avec des extraits du document.
+    {notes}
     Le type de document doit être l'une des valeurs suivantes : arrêté, décision, délibération, convention, autre.
 
-    précise les personnes physique et les villes impliqué
-    
+    Plan du document : {outline}
+
     Contexte:
-    {contexte}
-    
-    Document à analyser:
-    {contenu}
+    {context}
+
+    Partie du document à analyser:
+    {document}
+    """
+
+
+def _outline(sections: Dict[str, str], excerpts: bool = False, exclude=()) -> str:
+    """
+    Plan du document : sections trouvées et leur longueur, avec au besoin le début et la fin
+    de chaque section (sauf celles d'exclude, déjà transmises en entier)
+    """
+    if not excerpts:
+        return ", ".join(f"{SECTION_LABELS[name]} ({len(text)} caractères)" for name, text in sections.items() if text)
+    return "\n" + "\n\n".join(
+        f"[{SECTION_LABELS[name]}, {len(text)} caractères]"
+        + ("" if name in exclude else f"\n{_truncate_section(text, FORME_OUTLINE_EXCERPT_CHARS)}")
+        for name, text in sections.items() if text
+    )
+
+
+def _confidence(value: str) -> Optional[float]:
+    match = re.search(r"\d+(?:[.,]\d+)?", value or "")
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def merge_partial_analyses(partials: Dict[str, AnalysePartielle]) -> AnalyseArrete:
+    """
+    Réunit les analyses partielles en une AnalyseArrete : champs de conformité de chaque section,
+    observations concaténées et confiance la plus basse
+    """
+    entete = partials["entete_signature"]
+    dispositif = partials["dispositif"]
+    conformite = ConformiteLegale(
+        ecriture=entete.ecriture,
+        date=entete.date,
+        signature=entete.signature,
+        visas=partials["visas"].visas,
+        considerants=partials["considerants"].considerants,
+        dispositif=dispositif.dispositif,
+        publication=dispositif.publication,
+        transmission=dispositif.transmission,
+        completion=entete.completion,
+    )
+    observation = "\n".join(
+        f"{label} : {partials[name].observation}" for name, label in (
+            ("entete_signature", "Forme"), ("visas", "Visas"), ("considerants", "Considérants"),
+            ("dispositif", "Dispositif")
+        ) if partials[name].observation
+    )
+    confidences = [c for c in (_confidence(p.niveau_de_confiance) for p in partials.values()) if c is not None]
+    return AnalyseArrete(
+        type_de_document=entete.type_de_document,
+        conformite_aux_exigences_legales=conformite,
+        Observation=observation,
+        niveau_de_confiance=f"{min(confidences):g}%" if confidences else entete.niveau_de_confiance,
+        collectivité=entete.collectivité,
+        signataire=entete.signataire,
+    )
+
+
+def _absent(section: str) -> ConformiteDetail:
+    return ConformiteDetail(etat="non conforme",
+                            explication=f"Aucune section « {SECTION_LABELS[section].lower()} » repérée dans le document")
+
+
+def _note_absence(section: str) -> str:
+    return (f"Aucune section « {SECTION_LABELS[section].lower()} » n'a été repérée dans le document. "
+            f"Indique d'après les extraits du plan si elle était requise pour cet acte : "
+            f"conforme si elle ne l'est pas, non conforme sinon.")
+
+
+def analyser_par_sections(contexte: str, sections: Dict[str, str], champs: Dict[str, object] = None) -> AnalyseArrete:
+    """
+    Analyse map-reduce d'un long document : une analyse partielle par groupe de sections, exécutées
+    en parallèle avec seulement les parties utiles du contexte, puis réunies (la latence suit la
+    plus longue section et non la longueur totale)
+    Args:
+        champs (dict): Champs remplis par pre_extraire, retirés du schéma de l'analyse partielle concernée
     """
+    champs = champs or {}
+    context_parts = _context_parts(contexte)
+    outline = _outline(sections)
 
+    prompts, schemas, remplis, partials = {}, {}, {}, {}
+    for name, (schema, section_names, headings, instruction) in PARTIAL_ANALYSES.items():
+        absent = not any(sections.get(section) for section in section_names)
+        if name == "visas" and absent:
+            # Un arrêté sans visas n'indique pas ses fondements : inutile d'interroger le modèle
+            partials[name] = schema(observation="", niveau_de_confiance="", **{name: _absent(name)})
+            continue
+        # Considérants absents : seuls certains actes doivent être motivés, le modèle en juge sur les extraits
+        notes = _note_absence(name) if absent else ""
+        plan = _outline(sections, excerpts=True, exclude=section_names) \
+            if absent or name in WHOLE_DOCUMENT_ANALYSES else outline
+        context = "\n".join(context_parts[h] for h in headings if h in context_parts) or contexte
+        prompts[name] = _partial_prompt(instruction, context, sections, section_names, plan, notes)
+        schemas[name] = schema
+        remplis[name] = _champs_pour(schema, champs)
+
+    if prompts:
+        parallel = RunnableParallel({
+            name: itemgetter(name) | get_structured_llm(schema_sans(schema, frozenset(remplis[name])),
+                                                        method="function_calling")
+            for name, schema in schemas.items()
+        })
+        results = parallel.invoke(prompts, config={"max_concurrency": len(prompts)})
+        partials.update({name: completer(schemas[name], result, remplis[name]) for name, result in results.items()})
+    return merge_partial_analyses(partials)
+
+
+def analyser_arrete(contexte: str = contexte, contenu: str = contenu) -> str:
     # Exécution de l'analyse
     try:
-        resultat = structured_llm.invoke(prompt)
+        # Champs sans jugement remplis par règles (avec leurs extraits) : le modèle ne produit que le reste
+        champs, preuves = pre_extraire(contenu) if FORME_PRE_EXTRACTION else ({}, {})
+        sections = split_sections(contenu) if len(contenu) > FORME_LONG_DOCUMENT_CHARS else {}
+        if sections:
+            resultat = analyser_par_sections(contexte, sections, champs)
+        else:
+            resultat = _analyser_document(contexte, contenu, champs)
         # Conversion explicite en JSON
         if isinstance(resultat, str):
             # Si le résultat est déjà une chaîne JSON
             return resultat
         elif hasattr(resultat, 'model_dump'):
             # Si c'est un modèle Pydantic
-            return json.dumps(resultat.model_dump(), ensure_ascii=False, indent=2)
+            analyse = resultat.model_dump()
+            if preuves:
+                analyse["preuves"] = preuves
+            return json.dumps(analyse, ensure_ascii=False, indent=2)
         else:
             # Pour tout autre type
             return json.dumps(resultat, ensure_ascii=False, indent=2)
     except Exception as e:
+        # L'indisponibilité de l'API (délai dépassé, erreurs transitoires) remonte à l'appelant
+        if llm_error_status(e):
+            raise
         return json.dumps({"erreur": str(e)}, ensure_ascii=False, indent=2)
 
 
+def _analyser_document(contexte: str, contenu: str, champs: Dict[str, object] = None):
+    """
+    Analyse du document entier en un seul appel (documents courts ou sans sections repérables)
+    Args:
+        champs (dict): Champs remplis par pre_extraire, que le modèle n'a pas à produire
+    """
+    champs = _champs_pour(AnalyseArrete, champs or {})
+    # Modèle partagé (pool de connexions et sortie structurée créés une seule fois, voir llm.py)
+    structured_llm = get_structured_llm(schema_sans(AnalyseArrete, frozenset(champs)), method="function_calling")
+
+    # Création du prompt
+    prompt = f"""Tu es un expert en droit administratif français. Analyse le document suivant selon le contexte fourni.
+    Fournis une analyse détaillée et précise du document en évaluant sa conformité aux exigences légales. verfie 
+    
+    Le type de document doit être l'une des valeurs suivantes : arrêté, décision, délibération, convention, autre.
+
+    précise les personnes physique et les villes impliqué
+
+    Contexte:
+    {contexte}
+    
+    Document à analyser:
+    {contenu}
+    """
+    return completer(AnalyseArrete, structured_llm.invoke(prompt), champs)
+
+
 
 # Exemple d'utilisation
 if __name__ == "__main__":
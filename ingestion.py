@@ -0,0 +1,432 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from legal_splitter import LegalCodeSplitter
+from rag import PERSIST_DIRECTORY, load_documents, load_pdf_range, pdf_page_count
+
+# Codes juridiques indexés dans la base RAG
+CORPUS = [
+    "docs/code_civil.pdf",
+    "docs/code_penal.pdf",
+    "docs/code_territorial.pdf",
+    "docs/code_de_securite_intérieure.pdf",
+]
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "ingestion_manifest.json")
+# Version du découpage et des métadonnées : à incrémenter quand ils changent pour forcer la réingestion
+INGESTION_VERSION = 5
+
+
+def file_hash(path: str) -> str:
+    """
+    Hash SHA-256 du contenu d'un fichier, lu par blocs
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Hash SHA-256 du contenu d'un morceau de document
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(path: str, content_hash: str) -> str:
+    """
+    Identifiant Chroma déterministe d'un morceau : dépend du fichier et du contenu
+    """
+    return hashlib.sha256(f"{path}\x00{content_hash}".encode("utf-8")).hexdigest()
+
+
+class IngestionManifest:
+    """
+    Manifeste d'ingestion : pour chaque fichier, son hash et la correspondance
+    hash de morceau -> identifiant Chroma, ou {"doublon_de": identifiant} si le morceau a été
+    écarté comme doublon d'un morceau déjà indexé, ainsi que la version d'ingestion avec
+    laquelle il a été indexé
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def is_unchanged(self, path: str, digest: str) -> bool:
+        entry = self.files.get(path)
+        return entry is not None and entry["sha256"] == digest and self.is_current(path)
+
+    def is_current(self, path: str) -> bool:
+        return self.files.get(path, {}).get("version", 1) == INGESTION_VERSION
+
+    def chunks(self, path: str) -> dict:
+        return self.files.get(path, {}).get("chunks", {})
+
+    def ids(self, path: str) -> list:
+        """
+        Identifiants Chroma des morceaux indexés d'un fichier (doublons écartés exclus)
+        """
+        return [entry for entry in self.chunks(path).values() if isinstance(entry, str)]
+
+    def dependents(self, removed_ids) -> dict:
+        """
+        Morceaux écartés comme doublons d'un des morceaux supprimés
+        Returns:
+            dict: Fichier -> hashes de ces morceaux
+        """
+        found = {}
+        for path, entry in self.files.items():
+            for h, chunk in entry.get("chunks", {}).items():
+                if isinstance(chunk, dict) and chunk.get("doublon_de") in removed_ids:
+                    found.setdefault(path, []).append(h)
+        return found
+
+    def release(self, path: str, hashes):
+        """
+        Retire des morceaux du manifeste pour qu'ils soient réingérés ; le fichier est marqué
+        comme modifié, de sorte qu'une ingestion interrompue le reprenne à la prochaine synchronisation
+        """
+        entry = self.files[path]
+        for h in hashes:
+            entry["chunks"].pop(h, None)
+        entry["sha256"] = None
+
+    def record(self, path: str, digest: str, chunks: dict):
+        self.files[path] = {"sha256": digest, "chunks": chunks, "version": INGESTION_VERSION}
+
+    def forget(self, path: str):
+        self.files.pop(path, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def _delete_ids(agent, ids):
+    return agent.delete([id_ for id_ in ids if isinstance(id_, str)])
+
+
+def _parse_file(path, loader):
+    """
+    Étape 1 (processus séparé) : lecture du fichier et découpage en morceaux
+    """
+    start = time.perf_counter()
+    texts = loader(path)
+    return path, texts, time.perf_counter() - start
+
+
+def _parse_range(path, start, end):
+    """
+    Étape 1 pour un PDF (processus séparé) : lecture et segmentation d'une plage de pages
+    """
+    started = time.perf_counter()
+    pages, segments = load_pdf_range(path, start, end)
+    return path, start, pages, segments, time.perf_counter() - started
+
+
+_DONE = object()
+
+
+def _put(q, item, stop):
+    # put bloquant qui abandonne si une autre étape a échoué
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise RuntimeError("Pipeline d'ingestion interrompu")
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+class _Pipeline:
+    """
+    Étapes 2 et 3 de l'ingestion, chacune dans son thread et reliées par des files bornées :
+    encodage par lots puis écriture dans Chroma par un unique écrivain (qui tient aussi le manifeste)
+    """
+
+    def __init__(self, agent, manifest, queue_size):
+        self.agent = agent
+        self.manifest = manifest
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.errors = []
+        self.pending_chunks = {}
+        self.embedded = 0
+        self.written = 0
+        self.embed_time = 0.0
+        self.write_time = 0.0
+        self.threads = [
+            threading.Thread(target=self._run, args=(self._embed_stage,), name="ingestion-embed", daemon=True),
+            threading.Thread(target=self._run, args=(self._write_stage,), name="ingestion-write", daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, item):
+        _put(self.embed_queue, item, self.stop)
+
+    def finish(self):
+        """
+        Signale la fin des entrées, attend les deux étapes et relève leur éventuelle erreur
+        """
+        try:
+            self.submit(_DONE)
+        except RuntimeError:
+            pass
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def abort(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self, stage):
+        try:
+            stage()
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+
+    def _embed_stage(self):
+        while True:
+            item = _get(self.embed_queue, self.stop)
+            if item is _DONE:
+                break
+            if item[0] == "lot":
+                _, path, hashes, texts, ids = item
+                start = time.perf_counter()
+                vectors = self.agent._embed_batch(texts)
+                self.embed_time += time.perf_counter() - start
+                self.embedded += len(texts)
+                item = ("lot", path, hashes, texts, ids, vectors)
+            _put(self.write_queue, item, self.stop)
+        _put(self.write_queue, _DONE, self.stop)
+
+    def _write_stage(self):
+        while True:
+            item = _get(self.write_queue, self.stop)
+            if item is _DONE:
+                break
+            start = time.perf_counter()
+            kind = item[0]
+            if kind == "supprimer":
+                _delete_ids(self.agent, item[1])
+            elif kind == "lot":
+                _, path, hashes, texts, ids, vectors = item
+                written_ids, duplicate_of = self.agent._write_batch(texts, vectors, ids)
+                # Un doublon garde la trace du morceau qu'il duplique, pour être réingéré si celui-ci disparaît
+                entries = [id_ if original is None else {"doublon_de": original}
+                           for id_, original in zip(written_ids, duplicate_of)]
+                self.pending_chunks.setdefault(path, {}).update(zip(hashes, entries))
+                self.written += sum(1 for id_ in written_ids if id_ is not None)
+            elif kind == "fichier":
+                # Tous les lots du fichier sont écrits : il peut entrer dans le manifeste
+                _, path, digest, kept_chunks = item
+                chunks = {**kept_chunks, **self.pending_chunks.pop(path, {})}
+                self.manifest.record(path, digest, chunks)
+                self.agent.sparse_index.save()
+                self.manifest.save()
+            self.write_time += time.perf_counter() - start
+
+
+def sync_corpus(agent, paths=CORPUS, manifest_path: str = MANIFEST_PATH, parse_workers: int = None,
+                embed_batch_size: int = 256, queue_size: int = 8, loader=load_documents, pages_per_task: int = 64):
+    """
+    Synchronise la base vectorielle avec les fichiers du corpus :
+    - les fichiers inchangés (même hash) sont ignorés sans être relus
+    - seuls les morceaux nouveaux ou modifiés sont encodés et ajoutés
+    - les morceaux disparus et les fichiers retirés du corpus sont supprimés de la base
+    - les morceaux écartés comme doublons d'un morceau supprimé sont réingérés
+
+    Les fichiers modifiés traversent un pipeline : lecture et découpage dans un pool de
+    processus (parse_workers, un par cœur par défaut), par plages de pages_per_task pages pour
+    les PDF, encodage par lots de embed_batch_size morceaux, puis écriture par un unique thread ;
+    les étapes sont reliées par des files de queue_size lots.
+    """
+    manifest = IngestionManifest(manifest_path)
+    start = time.perf_counter()
+
+    # Base créée avant l'index creux : il est reconstruit depuis Chroma
+    if len(agent.sparse_index) == 0 and agent.vector_store.count() > 0:
+        agent.rebuild_sparse_index()
+
+    removed_ids = set()
+    for path in list(manifest.files):
+        if path not in paths or not os.path.exists(path):
+            ids = manifest.ids(path)
+            removed_ids.update(ids)
+            deleted = _delete_ids(agent, ids)
+            manifest.forget(path)
+            print(f"{path} : retiré du corpus, {deleted} morceaux supprimés")
+    agent.sparse_index.save()
+    manifest.save()
+
+    changed = {}
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"{path} : fichier introuvable, ignoré")
+            continue
+        digest = file_hash(path)
+        if manifest.is_unchanged(path, digest):
+            print(f"{path} : inchangé")
+            continue
+        changed[path] = digest
+
+    totals = {"lus": 0, "encodes": 0, "ajoutes": 0, "lecture": 0.0, "encodage": 0.0, "ecriture": 0.0}
+    while True:
+        # Doublons d'un morceau supprimé : réingérés, ils sont peut-être devenus uniques
+        dependents = manifest.dependents(removed_ids)
+        for path, hashes in dependents.items():
+            manifest.release(path, hashes)
+            changed.setdefault(path, file_hash(path))
+            print(f"{path} : {len(hashes)} doublons de morceaux supprimés à réingérer")
+        if dependents:
+            manifest.save()
+        if not changed:
+            break
+        removed_ids = _ingest(agent, manifest, changed, parse_workers, embed_batch_size, queue_size, loader,
+                              pages_per_task, totals)
+        changed = {}
+
+    if totals["lus"]:
+        elapsed = time.perf_counter() - start
+        print(f"Ingestion terminée en {elapsed:.1f}s : {totals['lus']} morceaux lus, {totals['encodes']} encodés, "
+              f"{totals['ajoutes']} ajoutés ({totals['encodes'] / elapsed:.1f} morceaux/s) ; "
+              f"lecture {totals['lecture']:.1f}s cumulés, encodage {totals['encodage']:.1f}s, "
+              f"écriture {totals['ecriture']:.1f}s")
+    return manifest
+
+
+def _ingest(agent, manifest, changed, parse_workers, embed_batch_size, queue_size, loader, pages_per_task,
+            totals) -> set:
+    """
+    Fait passer les fichiers modifiés dans le pipeline d'ingestion. Les PDF sont lus par plages
+    de pages, en parallèle même pour un seul fichier ; les plages d'un fichier sont assemblées
+    dans l'ordre (articles à cheval sur deux plages compris) avant l'encodage.
+    Args:
+        changed (dict): Fichier -> hash de son contenu
+        totals (dict): Compteurs et durées cumulés, mis à jour
+    Returns:
+        set: Identifiants des morceaux supprimés de la base
+    """
+    # Plages de pages de chaque PDF (le chargeur par défaut sait les lire séparément)
+    ranges = {}
+    for path in changed:
+        if loader is load_documents and path.lower().endswith(".pdf"):
+            page_count = pdf_page_count(path)
+            ranges[path] = [(start, min(start + pages_per_task, page_count))
+                            for start in range(0, page_count, pages_per_task)] or [(0, 0)]
+    task_count = sum(len(r) for r in ranges.values()) + len(changed) - len(ranges)
+    parse_workers = parse_workers or min(task_count, os.cpu_count() or 1)
+
+    pipeline = _Pipeline(agent, manifest, queue_size)
+    pipeline.start()
+    removed_ids = set()
+    parts, parse_times = {}, {}
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=parse_workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(_parse_range, path, start, end)
+                for path, path_ranges in ranges.items() for start, end in path_ranges
+            ] + [pool.submit(_parse_file, path, loader) for path in changed if path not in ranges]
+            for future in as_completed(futures):
+                result = future.result()
+                if len(result) == 3:
+                    path, texts, elapsed = result
+                else:
+                    path, start, pages, segments, elapsed = result
+                    parts.setdefault(path, {})[start] = (pages, segments)
+                    parse_times[path] = parse_times.get(path, 0.0) + elapsed
+                    if len(parts[path]) < len(ranges[path]):
+                        continue
+                    # Toutes les plages sont lues : assemblage dans l'ordre des pages
+                    path_parts = parts.pop(path)
+                    ordered = [path_parts[start] for start, _ in ranges[path]]
+                    texts = LegalCodeSplitter().split_segments(
+                        path,
+                        [page for pages, _ in ordered for page in pages],
+                        [segment for _, segments in ordered for segment in segments],
+                    )
+                    elapsed = parse_times.pop(path)
+                totals["lecture"] += elapsed
+                totals["lus"] += len(texts)
+                removed_ids.update(_submit_file(pipeline, manifest, path, changed[path], texts, elapsed,
+                                                embed_batch_size))
+    except BaseException:
+        pipeline.abort()
+        raise
+    pipeline.finish()
+
+    totals["encodes"] += pipeline.embedded
+    totals["ajoutes"] += pipeline.written
+    totals["encodage"] += pipeline.embed_time
+    totals["ecriture"] += pipeline.write_time
+    return removed_ids
+
+
+def _submit_file(pipeline, manifest, path, digest, texts, elapsed, embed_batch_size) -> list:
+    """
+    Compare les morceaux d'un fichier au manifeste et envoie au pipeline les suppressions et
+    les lots à encoder
+    Returns:
+        list: Identifiants des morceaux supprimés
+    """
+    old_chunks = manifest.chunks(path)
+    # Indexé avec une ancienne version : tous les morceaux sont remplacés (métadonnées comprises)
+    stale = {} if manifest.is_current(path) else old_chunks
+    if stale:
+        old_chunks = {}
+
+    # Un même contenu peut apparaître plusieurs fois dans le fichier : on ne le garde qu'une fois
+    new_texts = {}
+    for text in texts:
+        new_texts.setdefault(chunk_hash(text.page_content), text)
+
+    removed = [id_ for h, id_ in old_chunks.items() if h not in new_texts] + list(stale.values())
+    removed = [id_ for id_ in removed if isinstance(id_, str)]
+    kept = {h: id_ for h, id_ in old_chunks.items() if h in new_texts}
+    to_add = [(h, text) for h, text in new_texts.items() if h not in old_chunks]
+    print(f"{path} : {len(texts)} morceaux lus en {elapsed:.1f}s, {len(to_add)} à encoder, "
+          f"{len(removed)} à supprimer, {len(kept)} inchangés")
+
+    pipeline.submit(("supprimer", removed))
+    for i in range(0, len(to_add), embed_batch_size):
+        batch = to_add[i:i + embed_batch_size]
+        pipeline.submit((
+            "lot",
+            path,
+            [h for h, _ in batch],
+            [text for _, text in batch],
+            [chunk_id(path, h) for h, _ in batch],
+        ))
+    pipeline.submit(("fichier", path, digest, kept))
+    return removed
@@ -1,12 +1,29 @@
+import argparse
+
 from rag import init
 
-def initialize_rag():
+def initialize_rag(**kwargs):
     """
     Initialise le système RAG au démarrage
     """
     print("Initialisation du système RAG...")
-    init()
+    init(**kwargs)
     print("Système RAG initialisé avec succès")
 
 if __name__ == "__main__":
-    initialize_rag() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Synchronise la base RAG avec les codes juridiques de docs/")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="Nombre de processus de lecture/découpage des PDF (défaut : un par cœur)")
+    parser.add_argument("--pages-per-task", type=int, default=64,
+                        help="Nombre de pages d'un PDF lues par tâche du pool")
+    parser.add_argument("--embed-batch-size", type=int, default=256,
+                        help="Nombre de morceaux encodés par lot")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Nombre maximal de lots en attente entre deux étapes")
+    args = parser.parse_args()
+    initialize_rag(
+        parse_workers=args.parse_workers,
+        embed_batch_size=args.embed_batch_size,
+        queue_size=args.queue_size,
+        pages_per_task=args.pages_per_task,
+    )
@@ -0,0 +1,189 @@
+import os
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# Code juridique de chaque fichier du corpus, enregistré dans la métadonnée "code"
+CODES = {
+    "code_civil": "CC",
+    "code_penal": "CP",
+    "code_territorial": "CGCT",
+    "code_de_securite_intérieure": "CSI",
+}
+
+# Niveaux de la hiérarchie des codes, du plus général au plus précis
+LEVELS = ["partie", "livre", "titre", "chapitre", "section", "sous_section", "paragraphe"]
+
+_PARTIE = re.compile(r"^Partie\s+(législative|réglementaire|arrêtés)\b.*$", re.IGNORECASE)
+_HEADING = re.compile(
+    r"^(Livre|Titre|Chapitre|Section|Sous-section|Paragraphe)\s+"
+    r"([IVXLC]+(?:er)?|\d+(?:er)?|[A-Z]+)(?:\s+(?:bis|ter|quater))?\s*:\s*\S.*$",
+    re.IGNORECASE,
+)
+_ARTICLE = re.compile(
+    r"^Article\s+((?:[LRDA]\*{0,2}\s?)?\d+(?:[-.]\d+)*(?:\s?(?:bis|ter|quater|quinquies|[A-Z]))?"
+    r"|premier|1er|préliminaire)\s*$",
+    re.IGNORECASE,
+)
+# Pied de page des PDF Légifrance, répété sur chaque page
+_FOOTER = re.compile(r"^.+ - Dernière modification le .+ - Document généré le .+$")
+
+
+def code_for_source(path: str) -> str:
+    """
+    Code juridique d'un fichier (ex : "docs/code_penal.pdf" -> "CP"), le nom du fichier à défaut
+    """
+    name = os.path.splitext(os.path.basename(path or ""))[0]
+    return CODES.get(name, name)
+
+
+def _normalize_article(number: str) -> str:
+    """
+    Numéro d'article au format de l'index creux : "L. 111-1" -> "L111-1", "premier" -> "1"
+    """
+    number = re.sub(r"[\s.*]", "", number)
+    if number.lower() in ("premier", "1er"):
+        return "1"
+    return number[:1].upper() + number[1:]
+
+
+class LegalCodeSplitter:
+    """
+    Découpe un code juridique (PDF Légifrance) en un morceau par article.
+    Le code ("CC", "CP", "CGCT", "CSI") et la hiérarchie Partie / Livre / Titre / Chapitre /
+    Section / Sous-section / Paragraphe sont conservés dans les métadonnées ; seuls les articles trop longs sont redécoupés.
+    Un document sans intitulé d'article est découpé par RecursiveCharacterTextSplitter.
+    """
+
+    def __init__(self, max_article_chars: int = 4000, chunk_size: int = 2000, chunk_overlap: int = 200):
+        self.max_article_chars = max_article_chars
+        self.fallback_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000, chunk_overlap=200, separators=["Article"]
+        )
+        self.long_article_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=["\n", ". ", " "]
+        )
+
+    def split_documents(self, documents):
+        """
+        Args:
+            documents (list): Pages d'un ou plusieurs fichiers (une source par fichier)
+        Returns:
+            list: Un Document par article (ou par partie d'article trop long)
+        """
+        by_source = {}
+        for document in documents:
+            by_source.setdefault(document.metadata.get("source"), []).append(document)
+
+        chunks = []
+        for source, pages in by_source.items():
+            chunks.extend(self.split_segments(source, pages, self.segment_pages(pages)))
+        return chunks
+
+    def split_segments(self, source, pages, segments):
+        """
+        Assemble les segments des pages d'un fichier (voir segment_pages) en morceaux
+        Args:
+            source (str): Fichier d'origine (détermine le code)
+            pages (list): Pages du fichier, dans l'ordre (découpage de repli sans intitulé d'article)
+            segments (list): Segments de toutes les pages, dans l'ordre
+        """
+        articles = self.assemble(segments) or self.fallback_splitter.split_documents(pages)
+        for article in articles:
+            article.metadata["code"] = code_for_source(source)
+        return articles
+
+    def segment_pages(self, pages):
+        """
+        Première étape du découpage, qui ne dépend pas des pages précédentes : chaque ligne utile
+        est classée (intitulé, début d'article ou texte). Des plages de pages d'un même fichier
+        peuvent ainsi être segmentées séparément, en parallèle, puis assemblées dans l'ordre.
+        Returns:
+            list: ("intitule", niveau, texte), ("article", numéro, texte, métadonnées de la page) ou ("ligne", texte)
+        """
+        segments = []
+        for page in pages:
+            metadata = {k: v for k, v in page.metadata.items() if v is not None}
+            for raw_line in page.page_content.split("\n"):
+                line = raw_line.strip()
+                if not line or _FOOTER.match(line):
+                    continue
+                level, value = self._match_heading(line)
+                if level is not None:
+                    segments.append(("intitule", level, value))
+                    continue
+                match = _ARTICLE.match(line)
+                if match:
+                    segments.append(("article", _normalize_article(match.group(1)), line, metadata))
+                else:
+                    segments.append(("ligne", line))
+        return segments
+
+    def assemble(self, segments):
+        """
+        Seconde étape : rattache chaque ligne à son article ou à son intitulé et reconstitue la
+        hiérarchie, y compris pour les articles à cheval sur deux plages de pages
+        Returns:
+            list: Un Document par article (ou par partie d'article trop long)
+        """
+        hierarchy = {}
+        articles = []
+        current = None
+        heading_level = None
+
+        for segment in segments:
+            kind = segment[0]
+            if kind == "intitule":
+                _, level, value = segment
+                # Un intitulé répété (ex : "Partie législative") ne réinitialise pas les niveaux inférieurs
+                if not hierarchy.get(level, "").startswith(value):
+                    hierarchy[level] = value
+                    for lower in LEVELS[LEVELS.index(level) + 1:]:
+                        hierarchy.pop(lower, None)
+                    heading_level = level
+                current = None
+            elif kind == "article":
+                _, number, line, metadata = segment
+                current = {
+                    "article": number,
+                    "heading": line,
+                    "lines": [],
+                    "metadata": {**metadata, **hierarchy},
+                }
+                articles.append(current)
+                heading_level = None
+            elif current is not None:
+                current["lines"].append(segment[1])
+            elif heading_level is not None:
+                # Intitulé trop long, poursuivi sur la ligne suivante
+                hierarchy[heading_level] += " " + segment[1]
+
+        return [chunk for article in articles for chunk in self._article_chunks(article)]
+
+    @staticmethod
+    def _match_heading(line):
+        match = _PARTIE.match(line)
+        if match:
+            return "partie", line
+        match = _HEADING.match(line)
+        if match:
+            return match.group(1).lower().replace("-", "_"), line
+        return None, None
+
+    def _article_chunks(self, article):
+        body = "\n".join(article["lines"])
+        metadata = {**article["metadata"], "article": article["article"]}
+        text = f"{article['heading']}\n{body}"
+        if len(text) <= self.max_article_chars:
+            return [Document(page_content=text, metadata=metadata)]
+
+        # Article très long : chaque partie reprend l'intitulé pour rester rattachée à l'article
+        parts = self.long_article_splitter.split_text(body)
+        return [
+            Document(
+                page_content=f"{article['heading']}\n{part}",
+                metadata={**metadata, "partie_article": i + 1, "parties_article": len(parts)},
+            )
+            for i, part in enumerate(parts)
+        ]
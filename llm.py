@@ -1,23 +1,528 @@
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import json
 import os
+import random
+import threading
+import time
+import httpx
+import openai
+from llm_cache import get_llm_cache
 
 load_dotenv()
 
 BASE_URL = "https://albert.api.etalab.gouv.fr/v1"
 API_KEY = os.getenv("API_KEY")
+DEFAULT_MODEL_NAME = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8"
 
+# Pool de connexions HTTP partagé par tous les clients LLM du processus
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
 
-def get_llm(base_url: str = BASE_URL, api_key: str = API_KEY, model_name: str = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8") -> ChatOpenAI:
+# Politique de résilience des appels : délai jusqu'aux en-têtes de la réponse (tentatives comprises), nouvelles
+# tentatives avec attente exponentielle, disjoncteur, et requête doublée après la latence p95
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Réponses de l'API considérées comme transitoires (nouvelle tentative)
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+
+class LLMTimeoutError(httpx.TimeoutException):
+    """
+    Délai d'un appel au LLM dépassé avant les en-têtes de la réponse, toutes tentatives comprises
+    """
+
+
+class LLMUnavailableError(httpx.TransportError):
+    """
+    API LLM indisponible : disjoncteur ouvert ou erreurs transitoires après toutes les tentatives
+    """
+
+
+def llm_error_status(error):
+    """
+    Code HTTP à renvoyer pour une erreur d'appel au LLM (en remontant les causes) :
+    504 si le délai est dépassé, 503 si l'API est indisponible, None pour les autres erreurs
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (httpx.TimeoutException, openai.APITimeoutError)):
+            return 504
+        if isinstance(error, (LLMUnavailableError, openai.APIConnectionError)):
+            return 503
+        if isinstance(error, openai.APIStatusError) and error.status_code in TRANSIENT_STATUS:
+            return 503
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _model_of(request) -> str:
+    """
+    Modèle visé par une requête (champ "model" du corps JSON), pour tenir un disjoncteur par modèle
+    """
+    try:
+        return json.loads(request.content).get("model") or request.url.path
+    except (ValueError, AttributeError, httpx.RequestNotRead):
+        return request.url.path
+
+
+class _Breaker:
+    """
+    Disjoncteur d'un modèle : échecs consécutifs, ouverture, et appel d'essai en cours après la pause
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+
+class ResiliencePolicy:
+    """
+    État partagé de la politique de résilience : un disjoncteur par modèle (ouvert après
+    breaker_threshold appels échoués d'affilée, toutes tentatives épuisées, puis un seul appel
+    d'essai admis après breaker_cooldown secondes), latences récentes pour le seuil de
+    doublement (p95) et compteurs publiés dans /metriques.
+    Les réponses 429 (limite de débit) sont retentées mais ne comptent pas pour le disjoncteur :
+    l'API répond, elle demande seulement de ralentir.
+    """
+
+    def __init__(self, deadline: float = LLM_DEADLINE, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX,
+                 breaker_threshold: int = LLM_BREAKER_THRESHOLD, breaker_cooldown: float = LLM_BREAKER_COOLDOWN,
+                 hedge: bool = LLM_HEDGE, hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=500)
+        self.breakers = {}
+        self.counters = {
+            "appels": 0,
+            "reessais": 0,
+            "erreurs_transitoires": 0,
+            "limites_debit": 0,
+            "delais_depasses": 0,
+            "appels_echoues": 0,
+            "rejets_disjoncteur": 0,
+            "ouvertures_disjoncteur": 0,
+            "appels_essai": 0,
+            "requetes_doublees": 0,
+            "doublons_gagnants": 0,
+        }
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def start(self, request, timeout=None) -> tuple:
+        """
+        Début d'un appel : refusé si le disjoncteur du modèle est ouvert. Une fois la pause écoulée,
+        un seul appel d'essai est admis ; les autres restent refusés jusqu'à son issue.
+        Returns:
+            tuple: (modèle, échéance time.monotonic de l'appel, True pour l'appel d'essai)
+        """
+        model = _model_of(request)
+        probe = False
+        with self._lock:
+            self.counters["appels"] += 1
+            breaker = self.breakers.setdefault(model, _Breaker())
+            if breaker.opened_at is not None:
+                if breaker.probing or time.monotonic() - breaker.opened_at < self.breaker_cooldown:
+                    self.counters["rejets_disjoncteur"] += 1
+                    raise LLMUnavailableError(f"API LLM indisponible pour {model} (disjoncteur ouvert)",
+                                              request=request)
+                breaker.probing = probe = True
+                self.counters["appels_essai"] += 1
+        # Le délai demandé par l'appelant (timeout du client) est retenu s'il est plus court
+        read_timeout = (timeout or {}).get("read")
+        deadline = min(self.deadline, read_timeout) if read_timeout else self.deadline
+        return model, time.monotonic() + deadline, probe
+
+    def attempt_failed(self, status: int = None, timeout: bool = False):
+        """
+        Échec d'une tentative (compteurs seulement : le disjoncteur ne voit que l'issue de l'appel)
+        """
+        name = "delais_depasses" if timeout else "limites_debit" if status == 429 else "erreurs_transitoires"
+        self.count(name)
+
+    def success(self, model: str, elapsed: float):
+        with self._lock:
+            self.latencies.append(elapsed)
+            breaker = self.breakers[model]
+            breaker.failures = 0
+            breaker.opened_at = None
+
+    def failure(self, model: str, probe: bool = False, throttled: bool = False):
+        """
+        Échec d'un appel, toutes tentatives épuisées : compte une fois pour le disjoncteur,
+        sauf si la dernière réponse était une limite de débit (429)
+        """
+        with self._lock:
+            self.counters["appels_echoues"] += 1
+            if throttled:
+                return
+            breaker = self.breakers[model]
+            breaker.failures += 1
+            # L'échec de l'appel d'essai rouvre le disjoncteur pour une nouvelle pause
+            if probe or (breaker.opened_at is None and breaker.failures >= self.breaker_threshold):
+                breaker.opened_at = time.monotonic()
+                self.counters["ouvertures_disjoncteur"] += 1
+
+    def finish(self, model: str, probe: bool):
+        """
+        Fin d'un appel, quelle qu'en soit l'issue (annulation comprise) : libère l'appel d'essai
+        """
+        if probe:
+            with self._lock:
+                self.breakers[model].probing = False
+
+    def backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def hedge_delay(self, request):
+        """
+        Latence p95 des derniers appels, après laquelle une seconde requête identique est envoyée
+        (None si le doublement est désactivé, pour les réponses en flux ou sans assez de mesures)
+        """
+        if not self.hedge or b'"stream": true' in request.content or b'"stream":true' in request.content:
+            return None
+        with self._lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                **self.counters,
+                "disjoncteurs_ouverts": sorted(
+                    model for model, breaker in self.breakers.items() if breaker.opened_at is not None
+                ),
+                "latence_p95_s": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+            }
+
+
+def _attempt_timeout(remaining: float) -> dict:
+    """
+    Délais httpx d'une tentative. L'échéance de l'appel borne l'attente des en-têtes de la
+    réponse (tentatives et pauses comprises), pas la lecture du corps : celui-ci est lu après
+    le retour du transport, chaque lecture étant seulement limitée par le délai "read" fixé
+    ici. Un corps qui arrive lentement peut donc dépasser l'échéance, comme une réponse en flux.
+    """
+    per_attempt = min(remaining, LLM_HTTP_TIMEOUT)
+    return {"connect": min(per_attempt, 10.0), "read": per_attempt, "write": per_attempt, "pool": per_attempt}
+
+
+def _exhausted(request, timed_out: bool, detail: str):
+    if timed_out:
+        return LLMTimeoutError(f"Délai de l'appel au LLM dépassé ({detail})", request=request)
+    return LLMUnavailableError(f"API LLM indisponible ({detail})", request=request)
+
+
+def _close_when_done(futures):
+    """
+    Ferme la réponse de chaque requête doublée abandonnée dès qu'elle arrive, pour rendre sa connexion au pool
+    """
+    for future in futures:
+        future.add_done_callback(lambda f: f.exception() is None and f.result().close())
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """
+    Transport httpx synchrone qui applique la politique de résilience à chaque requête
+    (échéance, nouvelles tentatives, disjoncteur, doublement)
+    """
+
+    def __init__(self, policy: ResiliencePolicy, **transport_options):
+        self.policy = policy
+        self._transport = httpx.HTTPTransport(**transport_options)
+        self._hedge_executor = None
+
+    def handle_request(self, request):
+        policy = self.policy
+        model, deadline, probe = policy.start(request, request.extensions.get("timeout"))
+        try:
+            timed_out, throttled, detail = False, False, "aucune tentative"
+            for attempt in range(policy.max_retries + 1):
+                if attempt:
+                    pause = policy.backoff(attempt - 1)
+                    if time.monotonic() + pause >= deadline:
+                        break
+                    policy.count("reessais")
+                    time.sleep(pause)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                request.extensions["timeout"] = _attempt_timeout(remaining)
+                start = time.monotonic()
+                try:
+                    response = self._send(request, deadline)
+                except httpx.TimeoutException as e:
+                    policy.attempt_failed(timeout=True)
+                    timed_out, throttled, detail = True, False, str(e) or type(e).__name__
+                    continue
+                except httpx.TransportError as e:
+                    policy.attempt_failed()
+                    timed_out, throttled, detail = False, False, str(e) or type(e).__name__
+                    continue
+                if response.status_code in TRANSIENT_STATUS:
+                    response.close()
+                    policy.attempt_failed(response.status_code)
+                    timed_out, throttled, detail = False, response.status_code == 429, f"HTTP {response.status_code}"
+                    continue
+                policy.success(model, time.monotonic() - start)
+                return response
+            policy.failure(model, probe, throttled)
+            raise _exhausted(request, timed_out or time.monotonic() >= deadline, detail)
+        finally:
+            policy.finish(model, probe)
+
+    def _send(self, request, deadline):
+        delay = self.policy.hedge_delay(request)
+        if delay is None or time.monotonic() + delay >= deadline:
+            return self._transport.handle_request(request)
+
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS)
+        first = self._hedge_executor.submit(self._transport.handle_request, request)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        self.policy.count("requetes_doublees")
+        second = self._hedge_executor.submit(self._transport.handle_request, request)
+
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Les deux requêtes continuent en arrière-plan : leurs réponses seront fermées à leur arrivée
+                _close_when_done(pending)
+                raise httpx.ReadTimeout("Délai dépassé pour les deux requêtes", request=request)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # La requête perdante est fermée dès qu'elle se termine
+                _close_when_done(pending)
+                if future is second:
+                    self.policy.count("doublons_gagnants")
+                return future.result()
+        raise error
+
+    def close(self):
+        self._transport.close()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """
+    Version asynchrone de ResilientTransport
+    """
+
+    def __init__(self, policy: ResiliencePolicy, **transport_options):
+        self.policy = policy
+        self._transport = httpx.AsyncHTTPTransport(**transport_options)
+
+    async def handle_async_request(self, request):
+        policy = self.policy
+        model, deadline, probe = policy.start(request, request.extensions.get("timeout"))
+        try:
+            timed_out, throttled, detail = False, False, "aucune tentative"
+            for attempt in range(policy.max_retries + 1):
+                if attempt:
+                    pause = policy.backoff(attempt - 1)
+                    if time.monotonic() + pause >= deadline:
+                        break
+                    policy.count("reessais")
+                    await asyncio.sleep(pause)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                request.extensions["timeout"] = _attempt_timeout(remaining)
+                start = time.monotonic()
+                try:
+                    response = await self._send(request, deadline)
+                except httpx.TimeoutException as e:
+                    policy.attempt_failed(timeout=True)
+                    timed_out, throttled, detail = True, False, str(e) or type(e).__name__
+                    continue
+                except httpx.TransportError as e:
+                    policy.attempt_failed()
+                    timed_out, throttled, detail = False, False, str(e) or type(e).__name__
+                    continue
+                if response.status_code in TRANSIENT_STATUS:
+                    await response.aclose()
+                    policy.attempt_failed(response.status_code)
+                    timed_out, throttled, detail = False, response.status_code == 429, f"HTTP {response.status_code}"
+                    continue
+                policy.success(model, time.monotonic() - start)
+                return response
+            policy.failure(model, probe, throttled)
+            raise _exhausted(request, timed_out or time.monotonic() >= deadline, detail)
+        finally:
+            policy.finish(model, probe)
+
+    async def _send(self, request, deadline):
+        delay = self.policy.hedge_delay(request)
+        if delay is None or time.monotonic() + delay >= deadline:
+            return await self._transport.handle_async_request(request)
+
+        first = asyncio.ensure_future(self._transport.handle_async_request(request))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        self.policy.count("requetes_doublees")
+        second = asyncio.ensure_future(self._transport.handle_async_request(request))
+
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise httpx.ReadTimeout("Délai dépassé pour les deux requêtes", request=request)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is second:
+                        self.policy.count("doublons_gagnants")
+                    return task.result()
+            raise error
+        finally:
+            # La requête perdante est annulée
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+policy = ResiliencePolicy()
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_clients = {}
+_structured_clients = {}
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_clients():
+    """
+    Retourne les clients httpx (synchrone et asynchrone) partagés, créés au premier appel :
+    les connexions TLS vers l'API restent ouvertes (keep-alive) et sont réutilisées d'une requête à l'autre,
+    et chaque requête passe par la politique de résilience partagée.
+    Le client asynchrone est destiné à la boucle d'évènements du serveur.
+    """
+    global _http_client, _async_http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                timeout = httpx.Timeout(LLM_HTTP_TIMEOUT, connect=10.0)
+                _async_http_client = httpx.AsyncClient(
+                    transport=AsyncResilientTransport(policy, limits=_limits()), timeout=timeout
+                )
+                _http_client = httpx.Client(transport=ResilientTransport(policy, limits=_limits()), timeout=timeout)
+    return _http_client, _async_http_client
+
+
+def get_llm(base_url: str = BASE_URL, api_key: str = API_KEY, model_name: str = DEFAULT_MODEL_NAME, cache: bool = True,
+            deadline: float = None) -> ChatOpenAI:
     """
-    Crée et retourne une instance de ChatOpenAI configurée.
+    Retourne le client ChatOpenAI partagé pour un modèle, créé au premier appel.
 
     Args:
         base_url (str): URL de base de l'API ALbert
         api_key (str): Clé API pour l'authentification pour l'API Albert
         model_name (str): Nom du modèle à utiliser
+        cache (bool): Utiliser le cache partagé des réponses (voir llm_cache.py)
+        deadline (float): Délai d'un appel jusqu'aux en-têtes de la réponse, en secondes, s'il doit être
+            plus court que LLM_DEADLINE (voir _attempt_timeout)
 
     Returns:
         ChatOpenAI: Modèle depuis l'API Albert
     """
-    return ChatOpenAI(base_url=base_url, api_key=api_key, model_name=model_name)
+    key = (base_url, api_key, model_name, cache, deadline)
+    llm = _clients.get(key)
+    if llm is None:
+        http_client, async_http_client = get_http_clients()
+        with _lock:
+            llm = _clients.get(key)
+            if llm is None:
+                llm = ChatOpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                    model_name=model_name,
+                    cache=get_llm_cache() if cache else None,
+                    http_client=http_client,
+                    http_async_client=async_http_client,
+                    # Les nouvelles tentatives sont gérées par la politique de résilience
+                    max_retries=0,
+                    timeout=deadline,
+                )
+                _clients[key] = llm
+    return llm
+
+
+def get_structured_llm(schema, method: str = "function_calling", model_name: str = DEFAULT_MODEL_NAME):
+    """
+    Retourne le modèle partagé enveloppé par with_structured_output(schema), créé une fois par schéma
+    """
+    key = (schema, method, model_name)
+    structured_llm = _structured_clients.get(key)
+    if structured_llm is None:
+        llm = get_llm(model_name=model_name)
+        with _lock:
+            structured_llm = _structured_clients.setdefault(key, llm.with_structured_output(schema, method=method))
+    return structured_llm
+
+
+def stats() -> dict:
+    return {"clients": len(_clients), "clients_structures": len(_structured_clients), "resilience": policy.stats()}
+
+
+async def aclose():
+    """
+    Ferme les pools de connexions partagés (arrêt du serveur)
+    """
+    global _http_client, _async_http_client
+    with _lock:
+        http_client, async_http_client = _http_client, _async_http_client
+        _http_client = _async_http_client = None
+        _clients.clear()
+        _structured_clients.clear()
+    if http_client is not None:
+        http_client.close()
+        await async_http_client.aclose()
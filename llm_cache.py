@@ -0,0 +1,198 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")
+# Durée de vie d'une réponse en secondes (7 jours par défaut)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "512"))
+LLM_CACHE_DISK_SIZE = int(os.getenv("LLM_CACHE_DISK_SIZE", "10000"))
+
+
+class TieredLLMCache(BaseCache):
+    """
+    Cache des réponses LLM à deux niveaux : LRU en mémoire puis SQLite sur disque.
+
+    La clé est le hash SHA-256 de la configuration du modèle (nom, paramètres et
+    schéma de sortie structurée, fournis par LangChain dans llm_string) et du prompt.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 memory_size: int = LLM_CACHE_MEMORY_SIZE, disk_size: int = LLM_CACHE_DISK_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return _mark_hit(value, "memoire")
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            serialized, created = row
+            if now - created >= self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            value = [loads(generation) for generation in _split(serialized)]
+            self._remember(key, created, value)
+            self.disk_hits += 1
+            return _mark_hit(value, "disque")
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        serialized = _join([dumps(generation) for generation in return_val])
+        with self._lock:
+            self._remember(key, now, return_val)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now),
+            )
+            self.writes += 1
+            self._prune_disk()
+            self._conn.commit()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _prune_disk(self):
+        # Supprime les entrées expirées puis les moins récemment utilisées au-delà de la taille maximale
+        self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        excess = count - self.disk_size
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+        }
+
+
+def _mark_hit(generations, level: str):
+    """
+    Copies des générations en cache, marquées dans les métadonnées de leur message
+    (response_metadata["cache"]) : les réponses servies par le cache ne sont pas facturées
+    """
+    marked = []
+    for generation in generations:
+        generation = generation.model_copy(deep=True)
+        message = getattr(generation, "message", None)
+        if message is not None:
+            message.response_metadata = {**message.response_metadata, "cache": level}
+        marked.append(generation)
+    return marked
+
+
+def is_cached(message) -> bool:
+    """
+    Vrai si la réponse du LLM a été servie par le cache (voir _mark_hit)
+    """
+    return "cache" in (getattr(message, "response_metadata", None) or {})
+
+
+# Les générations sérialisées sont stockées dans une seule colonne, séparées par un caractère de contrôle
+_SEPARATOR = "\x1e"
+
+
+def _join(parts):
+    return _SEPARATOR.join(parts)
+
+
+def _split(serialized):
+    return serialized.split(_SEPARATOR) if serialized else []
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Retourne le cache LLM partagé par le processus, ou None s'il est désactivé (LLM_CACHE=0)
+    """
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TieredLLMCache()
+    return _cache
+
+
+def stats() -> dict:
+    if _cache is None:
+        return {"enabled": LLM_CACHE_ENABLED}
+    return {"enabled": True, **_cache.stats()}
@@ -1,90 +1,646 @@
-from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.chains import RetrievalQA
 from langchain_community.document_loaders import TextLoader
 from langchain_community.document_loaders import PyPDFLoader
+from pypdf import PdfReader
 from dotenv import load_dotenv
 import os
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
+from collections import OrderedDict, defaultdict
+import threading
+import unicodedata
+import asyncio
+import time
+import uuid
+import numpy as np
 
 # Charger les variables d'environnement
 load_dotenv()
 from llm import get_llm
+from llm_cache import is_cached
+from sparse_index import SparseIndex, cited_articles, extract_article_refs
+from legal_splitter import LegalCodeSplitter
+from vector_backend import ChromaBackend, MemmapBackend
+from context_builder import ContextBuilder, RAG_CONTEXT_TOKENS, get_tokenizer, truncate_to_tokens, usage_meter
+
+DEFAULT_MODEL_NAME = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8"
+EMBEDDING_MODEL_NAME = "dangvantuan/sentence-camembert-base"
+COLLECTION_NAME = "rag_collection"
+PERSIST_DIRECTORY = "./chroma_langchain_db"
+# Base vectorielle : "chroma" (lecture et écriture) ou "mmap" (index exporté en lecture seule,
+# partagé entre processus, voir export_index.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DIRECTORY = os.getenv("VECTOR_INDEX_DIRECTORY", "./vector_index")
+SPARSE_INDEX_PATH = os.path.join(PERSIST_DIRECTORY, "sparse_index.pkl")
+# Seuil de similarité cosinus au-delà duquel un morceau est considéré comme un doublon
+# (équivalent à la distance L2 de 0.1 utilisée auparavant sur des vecteurs normalisés)
+DUPLICATE_SIMILARITY = 0.95
+# Nombre d'embeddings de requêtes (mots-clés) gardés en mémoire
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+# Similarité cosinus minimale d'un passage retrouvé pour entrer dans le prompt
+RETRIEVAL_MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", "0.25"))
+# Constante de la fusion par rang réciproque (RRF) des recherches dense et BM25
+RRF_K = 60
+# Poids, dans la fusion RRF, de la liste des articles cités par le texte (accès direct par numéro)
+RRF_EXACT_WEIGHT = float(os.getenv("RRF_EXACT_WEIGHT", "2"))
+# Codes juridiques pertinents pour chaque catégorie principale d'acte (voir entities/catégorie.py) ;
+# une catégorie absente ne restreint pas la recherche. Seuls les codes réellement ingérés sont
+# retenus (voir RAGAgent.available_codes) : le CGCT n'est pas dans docs/, les catégories qui ne
+# relèvent que de lui ne restreignent donc pas la recherche tant qu'il n'est pas ingéré
+CATEGORY_CODES = {
+    "1": ["CGCT"],                      # Commande publique
+    "2": ["CGCT", "CC"],                # Urbanisme
+    "3": ["CGCT", "CC"],                # Domaine et patrimoine
+    "4": ["CGCT"],                      # Fonction publique
+    "5": ["CGCT"],                      # Institutions et vie politique
+    "6": ["CGCT", "CSI", "CP"],         # Libertés publiques et pouvoirs de police
+    "7": ["CGCT"],                      # Finances locales
+    "8": ["CGCT", "CC"],                # Domaines de compétences par thèmes
+}
+
+# Ressources partagées par tout le processus : le modèle d'embedding et la base
+# Chroma ne sont chargés qu'une seule fois, au premier usage ou via warmup()
+_lock = threading.Lock()
+_embedding_model = None
+_vector_store = None
+_sparse_index = None
+_agents = {}
+
+
+def detect_device() -> str:
+    """
+    Choisit le périphérique d'encodage : EMBEDDING_DEVICE s'il est défini,
+    sinon cuda ou mps s'ils sont disponibles, sinon cpu
+    """
+    device = os.getenv("EMBEDDING_DEVICE", "auto")
+    if device != "auto":
+        return device
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def build_embedding_model(device: str = None, batch_size: int = None, backend: str = None):
+    """
+    Construit un modèle d'embedding CamemBERT
+    Args:
+        device (str): cpu, mps ou cuda (détecté automatiquement par défaut)
+        batch_size (int): Nombre de textes encodés par passe (EMBEDDING_BATCH_SIZE, 32 par défaut)
+        backend (str): torch, quantized (int8 dynamique, CPU) ou onnx (EMBEDDING_BACKEND, torch par défaut)
+    """
+    device = device or detect_device()
+    batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "torch")
+    if backend not in ("torch", "quantized", "onnx"):
+        raise ValueError(f"Backend d'embedding inconnu : {backend}")
+
+    model_kwargs = {
+        "device": device,
+        "tokenizer_kwargs": {'legacy': True}
+    }
+    if backend == "onnx":
+        # Export ONNX via sentence-transformers >= 3.2 (nécessite optimum[onnxruntime])
+        model_kwargs["backend"] = "onnx"
+    encode_kwargs = {"normalize_embeddings": True, "batch_size": batch_size}
+    embedding_model = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs=model_kwargs,
+        encode_kwargs=encode_kwargs
+    )
+    if backend == "quantized":
+        if device != "cpu":
+            raise ValueError("Le backend quantized n'est disponible que sur cpu")
+        import torch
+        embedding_model.client = torch.quantization.quantize_dynamic(
+            embedding_model.client, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    print(f"Modèle d'embedding {EMBEDDING_MODEL_NAME} chargé (device={device}, backend={backend}, batch_size={batch_size})")
+    return embedding_model
+
+
+def get_embedding_model():
+    """
+    Retourne le modèle d'embedding partagé, chargé au premier appel
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _lock:
+            if _embedding_model is None:
+                _embedding_model = build_embedding_model()
+    return _embedding_model
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Enveloppe d'un modèle d'embedding avec un cache LRU des embeddings de requêtes,
+    indexé par le texte normalisé. Les documents ne sont pas mis en cache.
+    """
+
+    def __init__(self, embedding_model, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embedding_model = embedding_model
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+    def embed_documents(self, texts):
+        return self.embedding_model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        """
+        Encode plusieurs requêtes : les absentes du cache sont encodées en une seule passe
+        """
+        keys = [self.normalize(text) for text in texts]
+        with self._cache_lock:
+            found = {key: self._cache[key] for key in keys if key in self._cache}
+            for key in found:
+                self._cache.move_to_end(key)
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        self.hits += len(keys) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            # sentence-camembert encode requêtes et documents de la même façon
+            vectors = self.embedding_model.embed_documents(missing)
+            with self._cache_lock:
+                for key, vector in zip(missing, vectors):
+                    self._cache[key] = vector
+                    found[key] = vector
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return [found[key] for key in keys]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._cache),
+        }
+
+
+def get_vector_store():
+    """
+    Retourne la base vectorielle partagée (backend VECTOR_BACKEND), ouverte au premier appel
+    """
+    global _vector_store
+    if _vector_store is None:
+        embedding = CachedQueryEmbeddings(get_embedding_model())
+        with _lock:
+            if _vector_store is None:
+                if VECTOR_BACKEND == "mmap":
+                    _vector_store = MemmapBackend(embedding, VECTOR_INDEX_DIRECTORY)
+                elif VECTOR_BACKEND == "chroma":
+                    _vector_store = ChromaBackend(embedding, COLLECTION_NAME, PERSIST_DIRECTORY)
+                else:
+                    raise ValueError(f"VECTOR_BACKEND inconnu : {VECTOR_BACKEND} (chroma ou mmap)")
+    return _vector_store
+
+
+def _maximal_marginal_relevance(relevance, embeddings, k, lambda_mult):
+    """
+    Sélection gloutonne MMR : à chaque étape, le candidat qui maximise
+    lambda * pertinence - (1 - lambda) * similarité au plus proche déjà retenu
+    """
+    selected = []
+    max_similarity = np.full(len(relevance), -np.inf, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    while len(selected) < min(k, len(relevance)):
+        penalty = np.where(np.isfinite(max_similarity), max_similarity, 0)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, embeddings @ embeddings[best])
+    return selected
+
+
+def codes_for_categories(categories, available=None) -> list:
+    """
+    Codes juridiques à consulter pour des catégories d'acte (ex : ["6.1"] -> ["CGCT", "CSI", "CP"])
+    Args:
+        categories (list): Catégories principales ou sous-catégories ("6", "6.1"),
+            ou résultats du catégoriseur (CategoryResult)
+        available (set): Codes présents dans la base (par défaut ceux de l'index creux) ; les autres
+            sont écartés, et une catégorie dont aucun code n'est ingéré ne restreint pas la recherche
+    Returns:
+        list: Codes, ou None si une des catégories ne permet pas de restreindre la recherche
+    """
+    if available is None:
+        available = get_sparse_index().indexed_codes()
+    codes = []
+    for category in categories or []:
+        main = getattr(category, "main_category", category)
+        main = str(getattr(main, "value", main)).split(".")[0]
+        mapped = [code for code in CATEGORY_CODES.get(main, []) if code in available]
+        if not mapped:
+            return None
+        codes.extend(mapped)
+    return list(dict.fromkeys(codes)) or None
+
+
+def build_filter(codes=None, **hierarchy) -> dict:
+    """
+    Filtre de métadonnées au format "where" de Chroma
+    Args:
+        codes (list): Codes juridiques à consulter (ex : ["CGCT", "CSI"])
+        hierarchy: Niveaux de la hiérarchie imposés (ex : livre="Livre II : ...")
+    Returns:
+        dict: Filtre, ou None s'il n'y a aucune restriction
+    """
+    clauses = [{"code": {"$in": list(codes)}}] if codes else []
+    clauses.extend({level: {"$eq": value}} for level, value in hierarchy.items() if value)
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _summarize_metrics(context, calls):
+    """
+    Métriques d'une analyse : remplissage du contexte, citations et appels LLM
+    """
+    return {
+        "contexte": context.metrics(),
+        "citations": context.citations,
+        "appels": calls,
+        "appels_en_cache": sum(1 for call in calls if call.get("cache")),
+        "tokens_entree": sum(call["tokens_entree"] for call in calls),
+        "tokens_sortie": sum(call["tokens_sortie"] for call in calls),
+        "cout": sum(call["cout"] for call in calls),
+    }
+
+
+def stats() -> dict:
+    """
+    Compteurs du cache d'embeddings de requêtes (vide tant que la base n'est pas ouverte)
+    """
+    if _vector_store is None:
+        return {}
+    return {"cache_embeddings_requetes": _vector_store.embeddings.stats()}
+
+
+def load_documents(file_path):
+    """
+    Charge et découpe les documents en morceaux : un morceau par article pour les codes
+    juridiques, avec sa place dans la hiérarchie du code dans les métadonnées
+    Supporte les fichiers PDF
+    (fonction de module pour pouvoir être exécutée dans un processus séparé)
+    """
+    if file_path.lower().endswith('.pdf'):
+        loader = PyPDFLoader(file_path)
+    else:
+        loader = TextLoader(file_path)
+    documents = loader.load()
+    texts = LegalCodeSplitter().split_documents(documents)
+    return texts
+
+
+def pdf_page_count(file_path) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def load_pdf_range(file_path, start, end):
+    """
+    Extrait le texte des pages [start, end[ d'un PDF et les segmente (voir LegalCodeSplitter.segment_pages) ;
+    les plages d'un même fichier sont lues en parallèle puis assemblées dans l'ordre par
+    LegalCodeSplitter.split_segments (fonction de module pour pouvoir être exécutée dans un processus séparé)
+    Returns:
+        tuple: (pages, segments)
+    """
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    pages = [
+        # Mêmes texte et métadonnées de page que PyPDFLoader
+        Document(
+            page_content=(reader.pages[i].extract_text() or "").strip(),
+            metadata={"source": file_path, "total_pages": total_pages, "page": i, "page_label": reader.page_labels[i]},
+        )
+        for i in range(start, end)
+    ]
+    return pages, LegalCodeSplitter().segment_pages(pages)
+
+
+def get_sparse_index():
+    """
+    Retourne l'index creux (BM25 et numéros d'articles) partagé, chargé au premier appel
+    """
+    global _sparse_index
+    if _sparse_index is None:
+        with _lock:
+            if _sparse_index is None:
+                _sparse_index = SparseIndex.load(SPARSE_INDEX_PATH)
+    return _sparse_index
+
+
+def get_agent(model_name: str = DEFAULT_MODEL_NAME) -> "RAGAgent":
+    """
+    Retourne l'agent RAG partagé pour un modèle donné, créé au premier appel
+    """
+    agent = _agents.get(model_name)
+    if agent is None:
+        vector_store = get_vector_store()
+        with _lock:
+            agent = _agents.get(model_name)
+            if agent is None:
+                agent = RAGAgent(model_name=model_name, vector_store=vector_store, sparse_index=get_sparse_index())
+                _agents[model_name] = agent
+    return agent
+
+
+def warmup(model_name: str = DEFAULT_MODEL_NAME):
+    """
+    Charge le modèle d'embedding, ouvre la base et crée l'agent par défaut
+    pour que la première requête ne paie pas le coût d'initialisation
+    """
+    agent = get_agent(model_name)
+    # Un premier encodage charge réellement les poids et le tokenizer
+    agent.vector_store.embeddings.embed_query("arrêté municipal")
+    # Tokenizer du LLM utilisé pour le budget de contexte
+    get_tokenizer()
+    return agent
+
 
 class RAGAgent:
-    def __init__(self, model_name: str = "neuralmagic/Meta-Llama-3.1-70B-Instruct-FP8"):
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, vector_store=None, sparse_index=None):
         self.llm = get_llm(model_name=model_name)
-
-        embedding = self.get_embedding_model()
-        self.vector_store = Chroma(
-                embedding_function=embedding,
-                collection_name="rag_collection",
-                persist_directory="./chroma_langchain_db"
-            )
+        self.vector_store = vector_store if vector_store is not None else get_vector_store()
+        self.sparse_index = sparse_index if sparse_index is not None else get_sparse_index()
 
     def get_embedding_model(self):
-        # Get DB
-        model_name = "dangvantuan/sentence-camembert-base"
-        model_kwargs = {
-            "device": "mps",
-            "tokenizer_kwargs": {'legacy': True}
-        }
-        encode_kwargs = {"normalize_embeddings": True}
-        embedding_model = HuggingFaceEmbeddings(
-            model_name=model_name,
-            model_kwargs=model_kwargs,
-            encode_kwargs=encode_kwargs
-        )
-        return embedding_model
+        return get_embedding_model()
 
 
     def load_documents(self, file_path):
+        return load_documents(file_path)
+
+    def create_vector_store(self, texts, batch_size=1000, ids=None):
         """
-        Charge et découpe les documents en morceaux
-        Supporte les fichiers PDF
-        """
-        if file_path.lower().endswith('.pdf'):
-            loader = PyPDFLoader(file_path)
-        else:
-            loader = TextLoader(file_path)
-        documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, separators=["Article"])
-        texts = text_splitter.split_documents(documents)
-        return texts
-        
-    def create_vector_store(self, texts):
-        """
-        Crée une base de données vectorielle à partir des textes en évitant les doublons
+        Ajoute les textes à la base de données vectorielle en évitant les doublons.
+        Chaque lot est encodé une seule fois, les doublons sont détectés par similarité
+        cosinus vectorisée (dans le lot et contre la base) puis les textes retenus sont
+        insérés en un seul appel.
+        Args:
+            texts (list): Documents à ajouter
+            batch_size (int): Taille des lots encodés et insérés ensemble
+            ids (list): Identifiants à utiliser (générés aléatoirement par défaut)
+        Returns:
+            list: identifiant Chroma de chaque texte, None pour les doublons écartés
         """
-        embedding = self.get_embedding_model()
-        
-        # Vérifie si la base existe déjà
-        self.vector_store = Chroma(
-            embedding_function=embedding,
-            collection_name="rag_collection",
-            persist_directory="./chroma_langchain_db"
-        )
-        
-        # Traitement par lots de 1000 documents
-        batch_size = 1000
+        written_ids = []
+        start = time.perf_counter()
         for i in range(0, len(texts), batch_size):
             batch = texts[i:i + batch_size]
-            
-            # Vérifie les doublons pour chaque texte du lot
-            for text in batch:
-                # Recherche de documents similaires
-                similar_docs = self.vector_store.similarity_search_with_score(
-                    text.page_content,
-                    k=1
-                )
-                
-                # Si aucun document similaire n'est trouvé ou si la similarité est faible
-                if not similar_docs or similar_docs[0][1] > 0.1:
-                    self.vector_store.add_documents([text])
-            
-            print(f"Traitement du lot {i//batch_size + 1} terminé ({i+len(batch)}/{len(texts)} documents)")
-        
+            vectors = self._embed_batch(batch)
+            batch_ids = ids[i:i + batch_size] if ids is not None else None
+            written_ids.extend(self._write_batch(batch, vectors, batch_ids)[0])
+
+            elapsed = time.perf_counter() - start
+            print(f"Traitement du lot {i//batch_size + 1} terminé ({i+len(batch)}/{len(texts)} documents, "
+                  f"{(i + len(batch)) / elapsed:.1f} morceaux/s)")
+
+        self.sparse_index.save()
+        added = sum(1 for id_ in written_ids if id_ is not None)
+        print(f"{added} morceaux ajoutés, {len(written_ids) - added} doublons écartés")
+        return written_ids
+
+    def _embed_batch(self, texts):
+        """
+        Encode un lot de documents en une matrice normalisée (une ligne par document)
+        """
+        vectors = np.asarray(
+            self.vector_store.embeddings.embed_documents([text.page_content for text in texts]),
+            dtype=np.float32
+        )
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _write_batch(self, texts, vectors, ids=None):
+        """
+        Écarte les doublons d'un lot déjà encodé puis insère les survivants en un seul appel
+        Returns:
+            tuple: (identifiant de chaque texte, None pour les doublons ;
+                    identifiant du morceau dont chaque texte est le doublon, None pour les survivants)
+        """
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+        duplicate_of = self._find_duplicates(vectors, ids)
+        survivors = [j for j, original in enumerate(duplicate_of) if original is None]
+        if survivors:
+            survivor_ids = [ids[j] for j in survivors]
+            documents = [texts[j].page_content for j in survivors]
+            metadatas = [texts[j].metadata or None for j in survivors]
+            self.vector_store.add(
+                ids=survivor_ids,
+                embeddings=vectors[survivors].tolist(),
+                documents=documents,
+                metadatas=metadatas,
+            )
+            self.sparse_index.add(survivor_ids, documents, metadatas)
+        return [None if original else id_ for id_, original in zip(ids, duplicate_of)], duplicate_of
+
+    def _find_duplicates(self, vectors, ids, threshold=DUPLICATE_SIMILARITY):
+        """
+        Repère les vecteurs dont la similarité cosinus dépasse le seuil avec un vecteur
+        précédent du lot ou avec un document déjà présent dans la base
+        Returns:
+            list: identifiant du morceau gardé dont chaque vecteur est le doublon, None s'il est unique
+        """
+        # Doublons à l'intérieur du lot : on garde la première occurrence
+        similarity = vectors @ vectors.T
+        earlier = np.triu(similarity >= threshold, k=1)
+
+        # Doublons avec la base : une seule requête pour tout le lot
+        in_base = [None] * len(vectors)
+        if self.vector_store.count() > 0:
+            result = self.vector_store.query(
+                query_embeddings=vectors.tolist(),
+                n_results=1,
+                include=["distances"]
+            )
+            distances = np.array([d[0] if d else np.inf for d in result["distances"]], dtype=np.float32)
+            close = self._similarity(distances) >= threshold
+            in_base = [found[0] if is_close and found else None for found, is_close in zip(result["ids"], close)]
+
+        duplicate_of = []
+        for j in range(len(vectors)):
+            matches = np.flatnonzero(earlier[:, j])
+            if len(matches):
+                # La première occurrence peut elle-même être un doublon : on remonte au morceau gardé
+                first = matches[0]
+                duplicate_of.append(duplicate_of[first] or ids[first])
+            else:
+                duplicate_of.append(in_base[j])
+        return duplicate_of
+
+    def _similarity(self, distances):
+        """
+        Convertit des distances Chroma en similarités cosinus (vecteurs normalisés)
+        """
+        distances = np.asarray(distances, dtype=np.float32)
+        if (self.vector_store.metadata or {}).get("hnsw:space") == "cosine":
+            return 1 - distances
+        # Distance L2 au carré entre vecteurs normalisés : d = 2 - 2 cos
+        return 1 - distances / 2
+
+    def retrieve(self, queries, k=12, fetch_k=8, lambda_mult=0.5, min_similarity=RETRIEVAL_MIN_SIMILARITY,
+                 article_refs=None, where=None):
+        """
+        Recherche hybride groupée pour plusieurs requêtes :
+        - recherche dense : un seul encodage des requêtes et un seul appel à Chroma,
+          résultats sous le seuil de similarité écartés
+        - recherche BM25 sur l'index inversé et accès direct aux articles cités
+        - fusion des classements par rang réciproque (RRF) et dédoublonnage par identifiant ;
+          les articles cités forment une liste de plus, de poids RRF_EXACT_WEIGHT
+        - reclassement par pertinence marginale maximale (MMR) pour diversifier les passages
+        Args:
+            queries (list): Requêtes (mots-clés)
+            k (int): Nombre maximal de passages retournés
+            fetch_k (int): Nombre de candidats récupérés par requête et par méthode
+            lambda_mult (float): Compromis pertinence (1) / diversité (0) du MMR
+            min_similarity (float): Similarité cosinus minimale d'un passage dense
+            article_refs (list): Articles cités, numéros (ex : ["L2212-2"]) ou couples (numéro, code)
+                de cited_articles
+            where (dict): Filtre de métadonnées appliqué par Chroma et par l'index creux (voir build_filter)
+        Returns:
+            list: Documents retenus, avec leur identifiant et leur score dans les métadonnées
+        """
+        queries = [query for query in queries if query]
+        collection = self.vector_store
+        if (not queries and not article_refs) or collection.count() == 0:
+            return []
+
+        candidates = {}
+        rankings = []
+        if queries:
+            query_vectors = self.vector_store.embeddings.embed_queries(queries)
+            result = collection.query(
+                query_embeddings=query_vectors,
+                n_results=fetch_k,
+                where=where,
+                include=["documents", "metadatas", "distances", "embeddings"]
+            )
+            for q in range(len(queries)):
+                similarities = self._similarity(result["distances"][q])
+                ranking = []
+                for j, id_ in enumerate(result["ids"][q]):
+                    if similarities[j] < min_similarity:
+                        continue
+                    ranking.append(id_)
+                    candidates.setdefault(id_, {
+                        "document": result["documents"][q][j],
+                        "metadata": result["metadatas"][q][j] or {},
+                        "embedding": result["embeddings"][q][j],
+                    })
+                rankings.append(ranking)
+            rankings.extend(
+                [id_ for id_, _ in self.sparse_index.search(query, k=fetch_k, where=where)] for query in queries
+            )
+        exact_ids = self.sparse_index.lookup_articles(article_refs or [], where=where)[:k]
+
+        fused = defaultdict(float)
+        for ranking in rankings:
+            for rank, id_ in enumerate(ranking):
+                fused[id_] += 1 / (RRF_K + rank + 1)
+        for rank, id_ in enumerate(exact_ids):
+            fused[id_] += RRF_EXACT_WEIGHT / (RRF_K + rank + 1)
+        if not fused:
+            return []
+
+        # Passages trouvés uniquement par l'index creux : une seule lecture dans Chroma
+        missing = [id_ for id_ in fused if id_ not in candidates]
+        if missing:
+            fetched = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            for j, id_ in enumerate(fetched["ids"]):
+                candidates[id_] = {
+                    "document": fetched["documents"][j],
+                    "metadata": fetched["metadatas"][j] or {},
+                    "embedding": fetched["embeddings"][j],
+                }
+        fused = {id_: score for id_, score in fused.items() if id_ in candidates}
+        if not fused:
+            return []
+
+        ids = list(fused)
+        relevance = np.array([fused[id_] for id_ in ids], dtype=np.float32)
+        relevance /= relevance.max()
+        embeddings = np.asarray([candidates[id_]["embedding"] for id_ in ids], dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        selected_ids = [ids[i] for i in _maximal_marginal_relevance(relevance, embeddings, k, lambda_mult)]
+
+        return [
+            Document(
+                page_content=candidates[id_]["document"],
+                metadata={**candidates[id_]["metadata"], "id": id_, "score": fused[id_]},
+            )
+            for id_ in selected_ids
+        ]
+
+    def available_codes(self) -> set:
+        """
+        Codes juridiques réellement ingérés
+        """
+        return self.sparse_index.indexed_codes()
+
+    def lookup_article(self, ref):
+        """
+        Accès direct à un article par son numéro (ex : "L2212-2" ou "L. 2212-2"), sans encodage
+        Returns:
+            list: Morceaux qui définissent cet article
+        """
+        refs = extract_article_refs(ref) or [ref]
+        ids = self.sparse_index.lookup_articles(refs)
+        if not ids:
+            return []
+        fetched = self.vector_store.get(ids=ids, include=["documents", "metadatas"])
+        return [
+            Document(page_content=document, metadata={**(metadata or {}), "id": id_})
+            for id_, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+        ]
+
+    def delete(self, ids):
+        """
+        Supprime des morceaux de la base vectorielle et de l'index creux
+        """
+        ids = [id_ for id_ in ids if id_ is not None]
+        if ids:
+            self.vector_store.delete(ids=ids)
+            self.sparse_index.remove(ids)
+        return len(ids)
+
+    def rebuild_sparse_index(self, page_size=5000):
+        """
+        Reconstruit l'index creux à partir du contenu de la base vectorielle
+        """
+        collection = self.vector_store
+        self.sparse_index.remove(list(self.sparse_index.doc_lengths))
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page["ids"]:
+                break
+            self.sparse_index.add(page["ids"], page["documents"], page["metadatas"])
+            offset += len(page["ids"])
+        self.sparse_index.save()
+        print(f"Index creux reconstruit : {len(self.sparse_index)} morceaux")
+
     def inspect_collection(self):
         """
         Affiche le contenu de la base de données vectorielle
@@ -96,16 +652,52 @@ class RAGAgent:
         print(f"Nombre de documents : {len(collection['ids'])}")
 
 
-    def extract_keywords_with_llm(self, text, num_keywords=3):
+    def extract_keywords_with_llm(self, text, num_keywords=3, metrics=None):
         """
         Extrait les mots-clés d'un texte en utilisant le LLM
         Args:
             text (str): Le texte à analyser
             num_keywords (int): Nombre de mots-clés souhaité
+            metrics (list): Si fourni, reçoit les métriques de l'appel LLM
         Returns:
             list: Liste des mots-clés extraits
         """
-        prompt = f"""En tant qu'expert en droit administratif et constitutionnel, identifie les {num_keywords} concepts juridiques principaux dans ce texte.
+        prompt = self._keywords_prompt(text, num_keywords)
+        response = self._invoke("mots-cles", prompt, metrics)
+        return self._parse_keywords(response.content)
+
+    async def aextract_keywords_with_llm(self, text, num_keywords=3, metrics=None):
+        """
+        Version asynchrone de extract_keywords_with_llm
+        """
+        prompt = self._keywords_prompt(text, num_keywords)
+        start = time.perf_counter()
+        response = await self.llm.ainvoke(prompt)
+        self._measure("mots-cles", prompt, response, start, metrics)
+        return self._parse_keywords(response.content)
+
+    def _invoke(self, step, prompt, metrics=None):
+        """
+        Appelle le LLM et enregistre les tokens, le coût et la durée de l'appel
+        """
+        start = time.perf_counter()
+        response = self.llm.invoke(prompt)
+        self._measure(step, prompt, response, start, metrics)
+        return response
+
+    def _measure(self, step, prompt, response, start, metrics=None):
+        measure = usage_meter.measure(
+            step, prompt, response.content, time.perf_counter() - start,
+            getattr(response, "usage_metadata", None), cached=is_cached(response)
+        )
+        if metrics is not None:
+            metrics.append(measure)
+
+    def _parse_keywords(self, content):
+        return [kw.strip() for kw in content.split(',')]
+
+    def _keywords_prompt(self, text, num_keywords):
+        return f"""En tant qu'expert en droit administratif et constitutionnel, identifie les {num_keywords} concepts juridiques principaux dans ce texte.
 
         Concentre-toi sur :
         - La nature générale de la mesure administrative
@@ -119,11 +711,7 @@ class RAGAgent:
         "ARTICLE 1 : Tout mineur agé de moins de 13 ans ne pourra, sans étre accompagné d'une personne majeure, \ncirculer de 23h a 6h sur la voie publique, dans les périmétres Quartiers Prioritaires de la ville figurants sur le \nplan annexé. \nARTICLE 2 : Cette interdiction s'applique toutes les nuits du lundi au dimanche inclus pour la période du 22 \navril au 30 septembre. \nARTICLE 3 : En cas d'urgence ou de danger immédiat pour lui ou pour autrui et sans préjudice des sanctions \npénales prévues a I'article R610-5 du code pénal, tout mineur de 13 ans en infraction avec les dispositions \nsusvisées pourra étre reconduit & son domicile ou au commissariat par les agents de la police nationale ou de \nla police municipale. \nEn application de I'article 40 du code de procédure pénale et de I'article 375 du code civil, les autorités \nsusmentionnées informeront sans délai le Procureur de la République de tous les faits susceptibles de donner \nlieu a 'engagement de poursuites ou a la saisine du Juge des Enfants. \nARTICLE 4 : En cas de manquements aux obligations édictées par le présent arrété, les parents des enfants \nconcernés pourront faire I'objet de poursuites pénales sur le fondement de 'article R610-5 et de 'article L227- \n17 du Code Pénal. \nARTICLE 5 : Madame la Directrice Générale des Services de la Mairie de Béziers, Monsieur le Commissaire \nCentral de Police et Monsieur le Directeur de la Direction de la Police Municipale de la Mairie sont chargés, \nchacun en ce qui le concerne, de I'exécution du présent arrété. \nFait en I'Hétel de Ville de Béziers, 22 AVR 2024"
         Le retour contiendrait au minimum : "couvre-feu pour les mineurs dans une ville de france métropolitaine"
 
-        Texte à analyser :  {text}"""
-
-        response = self.llm.invoke(prompt)
-        keywords = [kw.strip() for kw in response.content.split(',')]
-        return keywords
+        Texte à analyser :  {truncate_to_tokens(text, RAG_CONTEXT_TOKENS)}"""
 
     def analyze_document_keywords(self, file_path):
         """
@@ -151,24 +739,19 @@ class RAGAgent:
         keywords = self.analyze_document_keywords(file_path)
         print("keywords : ", keywords)
         # Recherche des passages pertinents pour chaque mot-clé
-        relevant_passages = []
-        for keyword in keywords:
-            results = self.vector_store.similarity_search_with_score(
-                keyword,
-                k=2
-            )
-            relevant_passages.extend([doc[0].page_content for doc in results])
+        documents = self.retrieve(keywords, k=6)
+        text = "\n".join(doc.page_content for doc in self.load_documents(file_path))
+        context = ContextBuilder().build(text, documents)
 
-        #print("relevant_passages : ", relevant_passages)
         # Préparation du prompt pour l'analyse
         analysis_prompt = f"""En tant qu'expert en droit administratif et constitutionnel, analyse la validité juridique de ce document selon les critères suivants :
 
-        Document à analyser : {self.load_documents(file_path)}
+        Document à analyser : {context.document}
 
         Éléments juridiques identifiés : {', '.join(keywords)}
         
         Références juridiques similaires dans la base de données :
-        {' '.join(relevant_passages[:30])}
+        {context.passages}
 
         Sur la base de ces éléments :
         1. Évalue l'indice de confiance de ce document (0-100%, où 100% indique une confiance totale dans l'authenticité du document)
@@ -179,38 +762,97 @@ class RAGAgent:
         Justification: [liste des points]
         """
         
-        response = self.llm.invoke(analysis_prompt)
+        response = self._invoke("analyse", analysis_prompt)
         return response.content
 
-    def analyze_fraud_risk_from_text(self, text):
+    def analyze_fraud_risk_from_text(self, text, with_metrics=False, codes=None):
         """
         Analyse le risque de fraude d'un texte en se basant sur les mots-clés
         et le contenu similaire dans la base de connaissances
         Args:
             text (str): Texte à analyser
+            with_metrics (bool): Retourner aussi les métriques de tokens, de coût et de contexte
+            codes (list): Codes juridiques consultés (ex : ["CGCT", "CSI"]), tous par défaut
         Returns:
-            dict: Résultats de l'analyse avec indice de confiance et justification
+            str: Analyse avec indice de confiance et justification
+            (dict {"analyse", "metriques"} si with_metrics)
         """
+        metrics = []
         # Extraction des mots-clés du texte
-        keywords = self.extract_keywords_with_llm(text)
+        keywords = self.extract_keywords_with_llm(text, metrics=metrics)
         print("keywords : ", keywords)
-        
-        # Recherche des passages pertinents pour chaque mot-clé
-        relevant_passages = []
-        for keyword in keywords:
-            results = self.vector_store.similarity_search_with_score(
-                keyword,
-                k=6
-            )
-            relevant_passages.extend([doc[0].page_content for doc in results])
+        documents = self._retrieve_for_text(text, keywords, codes)
 
-        # Préparation du prompt pour l'analyse
-        analysis_prompt = f"""En tant qu'expert en droit administratif et constitutionnel, ta mission est d'analyser la validité juridique d'un document administratif en te basant UNIQUEMENT sur les références juridiques de notre base de données.
+        prompt, context = self._validity_prompt(text, keywords, documents)
+        response = self._invoke("analyse", prompt, metrics)
+        if not with_metrics:
+            return response.content
+        return {"analyse": response.content, "metriques": _summarize_metrics(context, metrics)}
 
-        Document à analyser : {text}
+    async def astream_fraud_risk_from_text(self, text, codes=None):
+        """
+        Version en flux de analyze_fraud_risk_from_text : produit des évènements de
+        progression puis les morceaux de la réponse du LLM au fur et à mesure
+        Args:
+            text (str): Texte à analyser
+            codes (list): Codes juridiques consultés, tous par défaut
+        Yields:
+            dict: évènement {"event": ..., "data": ...}
+        """
+        yield {"event": "debut", "data": None}
+
+        metrics = []
+        keywords = await self.aextract_keywords_with_llm(text, metrics=metrics)
+        yield {"event": "mots-cles", "data": keywords}
+
+        # La recherche vectorielle et le comptage des tokens sont bloquants : ils passent par un thread
+        documents = await asyncio.to_thread(self._retrieve_for_text, text, keywords, codes)
+        prompt, context = await asyncio.to_thread(self._validity_prompt, text, keywords, documents)
+        yield {"event": "references", "data": {"nombre": len(documents), "citations": context.citations}}
+
+        start = time.perf_counter()
+        content, cached = "", False
+        async for chunk in self.llm.astream(prompt):
+            cached = cached or is_cached(chunk)
+            if chunk.content:
+                content += chunk.content
+                yield {"event": "token", "data": chunk.content}
+
+        usage = usage_meter.measure("analyse", prompt, content, time.perf_counter() - start, cached=cached)
+        yield {"event": "metriques", "data": _summarize_metrics(context, metrics + [usage])}
+        yield {"event": "fin", "data": None}
+
+    def _retrieve_for_text(self, text, keywords, codes=None):
+        """
+        Passages de référence d'un texte, restreints aux codes demandés ; si le filtre
+        n'en retient aucun, la recherche est relancée sur toute la base
+        """
+        article_refs = cited_articles(text)
+        if codes:
+            # Un code absent de la base ne donnerait jamais de résultat : il ne restreint pas la recherche
+            available = self.available_codes()
+            codes = [code for code in codes if code in available] or None
+        where = build_filter(codes)
+        documents = self.retrieve(keywords, article_refs=article_refs, where=where)
+        if not documents and where:
+            print(f"Aucun passage dans les codes {codes}, recherche sur toute la base")
+            documents = self.retrieve(keywords, article_refs=article_refs)
+        return documents
+
+    def _validity_prompt(self, text, keywords, documents):
+        """
+        Construit le prompt d'analyse de validité juridique : le document puis les passages
+        retrouvés sont placés dans le budget de tokens RAG_CONTEXT_TOKENS
+        Returns:
+            tuple: (prompt, PackedContext)
+        """
+        context = ContextBuilder().build(text, documents)
+        prompt = f"""En tant qu'expert en droit administratif et constitutionnel, ta mission est d'analyser la validité juridique d'un document administratif en te basant UNIQUEMENT sur les références juridiques de notre base de données.
+
+        Document à analyser : {context.document}
 
-        Références juridiques officielles disponibles :
-        {' '.join(relevant_passages[:20])}
+        Références juridiques officielles disponibles (identifiées par [R1], [R2]...) :
+        {context.passages}
 
         Concepts juridiques identifiés : {', '.join(keywords)}
 
@@ -255,30 +897,26 @@ class RAGAgent:
         - [liste des incohérences par rapport aux précédents lié au contenu du document]
 
         **Citations pertinentes des références** :
-        - [extraits précis de la base de données justifiant l'analyse]
+        - [extraits précis de la base de données justifiant l'analyse, avec leur identifiant [R#]]
 
         Conclusion finale : [synthèse de l'analyse]
         """
-        
-        response = self.llm.invoke(analysis_prompt)
-        return response.content
+        return prompt, context
 
 
-def init():
-    rag = RAGAgent()
-    document = rag.load_documents("docs/code_civil.pdf")
-    document1 = rag.load_documents("docs/code_penal.pdf")
-    document2 = rag.load_documents("docs/code_territorial.pdf")
-    document3 = rag.load_documents("docs/code_de_securite_intérieure.pdf")
-    rag.create_vector_store(document)
-    rag.create_vector_store(document1)
-    rag.create_vector_store(document2)
-    rag.create_vector_store(document3)
+def init(**kwargs):
+    """
+    Synchronise la base vectorielle avec les codes juridiques de docs/ :
+    seuls les fichiers et morceaux nouveaux ou modifiés sont encodés (voir ingestion.py)
+    Les arguments nommés sont transmis à ingestion.sync_corpus (nombre de processus, taille des lots...)
+    """
+    from ingestion import sync_corpus
+    return sync_corpus(get_agent(), **kwargs)
 
 
-def get_result(text):
-    rag = RAGAgent()
-    return rag.analyze_fraud_risk_from_text(text)
+def get_result(text, with_metrics=False, codes=None):
+    rag = get_agent()
+    return rag.analyze_fraud_risk_from_text(text, with_metrics=with_metrics, codes=codes)
 
 if __name__ == "__main__":
     init()
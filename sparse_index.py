@@ -0,0 +1,303 @@
+import math
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+# Mots vides français ignorés par l'index BM25
+STOPWORDS = {
+    "a", "au", "aux", "avec", "ce", "ces", "cet", "cette", "dans", "de", "des", "du", "elle", "en", "est",
+    "et", "il", "ils", "l", "la", "le", "les", "leur", "leurs", "lui", "n", "ne", "ni", "ou", "par", "pas",
+    "pour", "qu", "que", "qui", "s", "sa", "se", "ses", "son", "sont", "sur", "un", "une", "y", "d", "c",
+    "j", "m", "t", "on", "ou", "si", "sans", "sous", "entre", "lorsque", "dont", "peut", "etre", "ete",
+}
+
+# Référence d'article préfixée : "L. 2212-2", "R610-5", "articles L 227-17" (numéro à tiret obligatoire)
+_PREFIXED_REF = re.compile(r"(?:\b(?i:articles?)\s+)?\b([LRD])\s?\.?\s?(\d+(?:-\d+)+)\b")
+# Référence d'article sans préfixe, retenue seulement si le code est nommé : "article 375 du code civil"
+_PLAIN_REF = re.compile(
+    r"\b(?i:articles?)\s+(\d+(?:-\d+)*|(?i:premier))\b(?=[^;\n]{0,40}?\b(?:(?i:du|au)\s+(?i:code)\b|CGCT|CSI))"
+)
+# Mention d'un code dans le texte analysé
+_CODE_MENTION = re.compile(r"\b(?i:code)\b|\bCGCT\b|\bCSI\b")
+# Codes de la base (métadonnée "code", voir legal_splitter.CODES) reconnus à partir de la mention
+CODE_NAMES = (
+    (re.compile(r"code\s+g[ée]n[ée]ral\s+des\s+collectivit[ée]s\s+territoriales|CGCT", re.IGNORECASE), "CGCT"),
+    (re.compile(r"code\s+de\s+la\s+s[ée]curit[ée]\s+int[ée]rieure|CSI", re.IGNORECASE), "CSI"),
+    (re.compile(r"code\s+p[ée]nal", re.IGNORECASE), "CP"),
+    (re.compile(r"code\s+civil", re.IGNORECASE), "CC"),
+)
+# Fin de proposition : une référence et le code qui la qualifie appartiennent à la même
+_CLAUSE_END = re.compile(r";|\n\s*\n|\.\s+(?=[A-ZÉÈÀ])")
+# Intitulé d'article en début de ligne, qui identifie l'article défini par un morceau
+_ARTICLE_HEADING = re.compile(
+    r"^\s*(?i:article)\s+(?:([LRD])\s?\.?\s?)?(\d+(?:-\d+)*|(?i:premier))\b",
+    re.MULTILINE,
+)
+
+
+def normalize_article_ref(prefix: str, number: str) -> str:
+    number = "1" if number.lower() == "premier" else number
+    return f"{(prefix or '').upper()}{number}"
+
+
+def _code_at(text: str, position: int):
+    """
+    Code de la base nommé à cette position ; "" pour un code absent de la base (Code électoral...)
+    """
+    for pattern, code in CODE_NAMES:
+        if pattern.match(text, position):
+            return code
+    return ""
+
+
+def _is_heading(text: str, start: int) -> bool:
+    """
+    Vrai si la référence commence une ligne : intitulé d'article de l'acte lui-même ("ARTICLE 2 :")
+    """
+    line_start = text.rfind("\n", 0, start) + 1
+    return not text[line_start:start].strip() and text[start:start + 7].lower().startswith("article")
+
+
+def cited_articles(text: str) -> list:
+    """
+    Articles de code cités dans un texte, avec le code nommé dans la même proposition :
+    - références préfixées à tiret ("L. 2212-2", "R610-5"), avec ou sans code nommé
+    - numéros simples seulement suivis du code ("article 375 du code civil")
+    Les intitulés d'articles de l'acte ("ARTICLE 1 :") et les numéros isolés ("L 3") sont ignorés,
+    ainsi que les références à un code absent de la base.
+    Returns:
+        list: (numéro normalisé, code ou None si aucun code n'est nommé), sans doublon
+    """
+    refs = []
+    clause_start = 0
+    for clause_end in [m.start() for m in _CLAUSE_END.finditer(text)] + [len(text)]:
+        clause = text[clause_start:clause_end]
+        mentions = [(m.start(), _code_at(clause, m.start())) for m in _CODE_MENTION.finditer(clause)]
+        found = [(m.start(), normalize_article_ref(m.group(1), m.group(2)))
+                 for m in _PREFIXED_REF.finditer(clause) if not _is_heading(clause, m.start())]
+        found += [(m.start(), normalize_article_ref("", m.group(1)))
+                  for m in _PLAIN_REF.finditer(clause) if not _is_heading(clause, m.start())]
+        for start, ref in sorted(found):
+            # Code nommé après la référence ("articles L 2122-27 et L 2122-30 du CGCT"), sinon avant
+            after = [code for position, code in mentions if position > start]
+            before = [code for position, code in mentions if position < start]
+            code = after[0] if after else (before[-1] if before else None)
+            if code == "":
+                continue
+            refs.append((ref, code))
+        clause_start = clause_end + 1
+    return list(dict.fromkeys(refs))
+
+
+def extract_article_refs(text: str) -> list:
+    """
+    Numéros des articles cités dans un texte, normalisés (ex : "L2212-2", "375"), voir cited_articles
+    """
+    return list(dict.fromkeys(ref for ref, _ in cited_articles(text)))
+
+
+def article_headings(text: str) -> list:
+    """
+    Numéros des articles dont l'intitulé apparaît en début de ligne dans le texte
+    """
+    return list(dict.fromkeys(
+        normalize_article_ref(prefix, number) for prefix, number in _ARTICLE_HEADING.findall(text)
+    ))
+
+
+def matches_filter(metadata: dict, where: dict) -> bool:
+    """
+    Évalue un filtre de métadonnées au format "where" de Chroma sur les métadonnées d'un morceau
+    (égalité simple, $eq, $ne, $in, $nin, $and, $or)
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def tokenize(text: str) -> list:
+    """
+    Découpe en termes : minuscules, sans accents, sans mots vides
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", text) if len(t) > 1 and t not in STOPWORDS]
+
+
+class SparseIndex:
+    """
+    Index inversé BM25 des morceaux de la base, avec un index direct numéro d'article -> morceaux.
+    Il est construit à l'ingestion à côté de la collection Chroma et partage ses identifiants.
+    """
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.postings = defaultdict(dict)   # terme -> {id: fréquence}
+        self.doc_terms = {}                 # id -> {terme: fréquence}
+        self.doc_lengths = {}               # id -> nombre de termes
+        self.metadatas = {}                 # id -> métadonnées
+        self.articles = defaultdict(set)    # numéro d'article -> ids
+        self.doc_articles = {}              # id -> numéros d'articles définis
+        self.code_counts = Counter()        # code juridique -> nombre de morceaux
+        self.total_length = 0
+
+    @classmethod
+    def load(cls, path: str) -> "SparseIndex":
+        index = cls(path)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            index.postings = defaultdict(dict, state["postings"])
+            index.doc_terms = state["doc_terms"]
+            index.doc_lengths = state["doc_lengths"]
+            index.metadatas = state["metadatas"]
+            index.articles = defaultdict(set, state["articles"])
+            for ref, ids in index.articles.items():
+                for id_ in ids:
+                    index.doc_articles.setdefault(id_, []).append(ref)
+            index.total_length = sum(index.doc_lengths.values())
+            index.code_counts = Counter(m.get("code") for m in index.metadatas.values() if m.get("code"))
+        return index
+
+    def save(self):
+        with self._lock:
+            state = {
+                "postings": dict(self.postings),
+                "doc_terms": self.doc_terms,
+                "doc_lengths": self.doc_lengths,
+                "metadatas": self.metadatas,
+                "articles": dict(self.articles),
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, ids, texts, metadatas=None):
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            for id_, text, metadata in zip(ids, texts, metadatas):
+                if id_ in self.doc_terms:
+                    self._remove(id_)
+                terms = Counter(tokenize(text))
+                self.doc_terms[id_] = dict(terms)
+                self.doc_lengths[id_] = sum(terms.values())
+                self.total_length += self.doc_lengths[id_]
+                self.metadatas[id_] = metadata or {}
+                if self.metadatas[id_].get("code"):
+                    self.code_counts[self.metadatas[id_]["code"]] += 1
+                for term, frequency in terms.items():
+                    self.postings[term][id_] = frequency
+                self.doc_articles[id_] = article_headings(text)
+                for ref in self.doc_articles[id_]:
+                    self.articles[ref].add(id_)
+
+    def remove(self, ids):
+        with self._lock:
+            for id_ in ids:
+                if id_ in self.doc_terms:
+                    self._remove(id_)
+
+    def _remove(self, id_):
+        for term in self.doc_terms.pop(id_):
+            postings = self.postings[term]
+            postings.pop(id_, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(id_)
+        code = self.metadatas.pop(id_, {}).get("code")
+        if code:
+            self.code_counts[code] -= 1
+            if self.code_counts[code] <= 0:
+                del self.code_counts[code]
+        for ref in self.doc_articles.pop(id_, []):
+            self.articles[ref].discard(id_)
+            if not self.articles[ref]:
+                del self.articles[ref]
+
+    def indexed_codes(self) -> set:
+        """
+        Codes juridiques présents dans l'index (métadonnée "code" des morceaux)
+        """
+        with self._lock:
+            return set(self.code_counts)
+
+    def search(self, query: str, k: int = 8, where: dict = None):
+        """
+        Recherche BM25
+        Args:
+            query (str): Requête en texte libre
+            k (int): Nombre de résultats
+            where (dict): Filtre de métadonnées au format Chroma (ex : {"code": {"$in": ["CGCT", "CSI"]}})
+        Returns:
+            list: (id, score) par score décroissant
+        """
+        with self._lock:
+            n = len(self.doc_lengths)
+            if n == 0:
+                return []
+            average_length = self.total_length / n
+            scores = defaultdict(float)
+            allowed = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for id_, frequency in postings.items():
+                    if where:
+                        if id_ not in allowed:
+                            allowed[id_] = matches_filter(self.metadatas.get(id_, {}), where)
+                        if not allowed[id_]:
+                            continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[id_] / average_length)
+                    scores[id_] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def lookup_articles(self, refs, where: dict = None):
+        """
+        Identifiants des morceaux qui définissent les articles demandés, restreints aux morceaux
+        dont les métadonnées satisfont le filtre where
+        Args:
+            refs (list): Numéros (ex : ["L2212-2"]) ou couples (numéro, code) de cited_articles,
+                le code restreignant alors la recherche à ce code
+        """
+        ids = []
+        with self._lock:
+            for ref in refs:
+                ref, code = ref if isinstance(ref, tuple) else (ref, None)
+                for id_ in sorted(self.articles.get(ref, ())):
+                    metadata = self.metadatas.get(id_, {})
+                    if (code is None or metadata.get("code") == code) and matches_filter(metadata, where):
+                        ids.append(id_)
+        return list(dict.fromkeys(ids))
@@ -0,0 +1,95 @@
+from forme import AnalyseArrete, AnalyseDispositif, ConformiteDetail, completer, contenu, pre_extraire, schema_sans
+
+MONTREUIL = """Ville de Montreuil
+Le Maire de Montreuil,
+Vu le Code général des collectivités territoriales ;
+Vu la délibération du 12 mars 2023 du conseil de la Métropole du Grand Paris ;
+Considérant la nécessité d'assurer la sécurité des usagers ;
+ARRÊTE :
+Article premier : La circulation est interdite rue de Paris.
+Article 2 : Le présent arrêté sera notifié au préfet de la Seine-Saint-Denis.
+Article 3 : Le présent arrêté sera affiché en mairie.
+Fait à Montreuil, le 3 avril 2023
+Le Maire
+Patrice BESSAC
+"""
+
+
+def test_collectivite_prise_dans_l_entete_et_non_dans_les_visas():
+    champs, preuves = pre_extraire(MONTREUIL)
+    assert champs["collectivité"] == "Montreuil"
+    assert preuves["collectivité"][0]["debut"] < MONTREUIL.index("Vu le")
+
+
+def test_collectivite_cherchee_dans_le_bloc_de_signature():
+    texte = "ARRÊTE :\nArticle 1 : Vu la délibération de la Métropole du Grand Paris.\n" \
+            "Fait à Montreuil, le 3 avril 2023\nLe Maire de Montreuil\nPatrice BESSAC\n"
+    champs, _ = pre_extraire(texte)
+    assert champs["collectivité"] == "Montreuil"
+
+
+def test_collectivite_a_nom_compose():
+    champs, _ = pre_extraire("La Métropole du Grand Paris\nDÉCIDE :\nArticle 1 : ...")
+    assert champs["collectivité"] == "Grand Paris"
+
+
+def test_notification_au_prefet_n_est_pas_une_publication():
+    texte = "ARRÊTE :\nArticle premier : La circulation est interdite.\nIl a été notifié au préfet le 2 mai 2023.\n"
+    champs, preuves = pre_extraire(texte)
+    assert "publication" not in champs
+    assert "publication" not in preuves
+
+
+def test_publication_par_affichage():
+    champs, preuves = pre_extraire(MONTREUIL)
+    assert champs["publication"].etat == "conforme"
+    assert "« Article 3 : Le présent arrêté sera affiché en mairie. »" in champs["publication"].explication
+    assert all("préfet" not in p["extrait"] for p in preuves["publication"])
+
+
+def test_visas_considerants_et_dispositif_restent_au_modele():
+    champs, preuves = pre_extraire(MONTREUIL)
+    assert len(preuves["visas"]) == 2
+    assert len(preuves["considerants"]) == 1
+    assert [p["extrait"] for p in preuves["dispositif"]][0] == "ARRÊTE :"
+    assert not {"visas", "considerants", "dispositif", "signature"} & set(champs)
+
+
+def test_date_et_signataire():
+    champs, preuves = pre_extraire(MONTREUIL)
+    assert "« Fait à Montreuil, le 3 avril 2023 »" in champs["date"].explication
+    assert (preuves["date"][0]["lieu"], preuves["date"][0]["date"]) == ("Montreuil", "3 avril 2023")
+    assert champs["signataire"] == "Patrice BESSAC"
+    span = preuves["signataire"][0]
+    assert MONTREUIL[span["debut"]:span["fin"]] == "Patrice BESSAC"
+
+
+def test_exemple_du_module():
+    champs, _ = pre_extraire(contenu)
+    assert champs["collectivité"] == "Paris"
+    assert champs["signataire"] == "Anne HIDALGO"
+    assert "considerants" not in champs
+
+
+def test_texte_sans_structure():
+    assert pre_extraire("Texte sans structure") == ({}, {})
+
+
+def test_schema_du_modele_sans_les_champs_pre_extraits():
+    champs, _ = pre_extraire(MONTREUIL)
+    schema = schema_sans(AnalyseArrete, frozenset(champs))
+    conformite = schema.model_fields["conformite_aux_exigences_legales"].annotation
+    assert not {"collectivité", "signataire"} & set(schema.model_fields)
+    assert not {"date", "publication"} & set(conformite.model_fields)
+    assert schema_sans(AnalyseArrete, frozenset(champs)) is schema
+
+
+def test_completer_reprend_les_champs_pre_extraits():
+    champs, _ = pre_extraire(MONTREUIL)
+    champs = {"publication": champs["publication"]}
+    detail = ConformiteDetail(etat="conforme", explication="...")
+    reponse = schema_sans(AnalyseDispositif, frozenset(champs))(
+        observation="", niveau_de_confiance="90%", dispositif=detail, transmission=detail
+    )
+    resultat = completer(AnalyseDispositif, reponse, champs)
+    assert resultat.publication == champs["publication"]
@@ -0,0 +1,323 @@
+import bisect
+import json
+import os
+import threading
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+
+from sparse_index import matches_filter
+
+# Fichiers d'un index exporté (voir export_index.py)
+EMBEDDINGS_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.bin"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.bin"
+IDS_OFFSETS_FILE = "ids_offsets.npy"
+ID_ORDER_FILE = "id_order.npy"
+METADATAS_FILE = "metadatas.bin"
+METADATAS_OFFSETS_FILE = "metadatas_offsets.npy"
+FAISS_FILE = "index.faiss"
+# Ancien format (métadonnées lues en entier par chaque processus)
+LEGACY_METADATA_FILE = "metadata.json"
+
+
+class _TextColumn:
+    """
+    Colonne de textes UTF-8 concaténés dans un fichier, adressés par un tableau de positions :
+    les deux fichiers sont projetés en mémoire et une valeur n'est décodée qu'à la lecture
+    """
+
+    def __init__(self, directory: str, data_file: str, offsets_file: str):
+        self._offsets = np.load(os.path.join(directory, offsets_file), mmap_mode="r")
+        self._data = np.memmap(os.path.join(directory, data_file), dtype=np.uint8, mode="r") \
+            if self._offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return bytes(self._data[start:end]).decode("utf-8")
+
+
+class _TextColumnWriter:
+    def __init__(self, directory: str, data_file: str, offsets_file: str):
+        self.directory = directory
+        self.data_file = data_file
+        self.offsets_file = offsets_file
+        self._file = open(os.path.join(directory, data_file + ".tmp"), "wb")
+        self._offsets = [0]
+
+    def append(self, text: str):
+        encoded = text.encode("utf-8")
+        self._file.write(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+
+    def close(self):
+        self._file.close()
+        np.save(os.path.join(self.directory, self.offsets_file + ".tmp.npy"), np.asarray(self._offsets, dtype=np.int64))
+
+    def commit(self):
+        os.replace(os.path.join(self.directory, self.data_file + ".tmp"), os.path.join(self.directory, self.data_file))
+        os.replace(os.path.join(self.directory, self.offsets_file + ".tmp.npy"),
+                   os.path.join(self.directory, self.offsets_file))
+
+
+class ChromaBackend:
+    """
+    Base vectorielle Chroma persistée sur disque (backend par défaut, en lecture et écriture).
+    Expose le sous-ensemble de l'API d'une collection Chroma utilisé par RAGAgent.
+    """
+
+    def __init__(self, embeddings, collection_name: str, persist_directory: str):
+        self.embeddings = embeddings
+        self.store = Chroma(
+            embedding_function=embeddings,
+            collection_name=collection_name,
+            persist_directory=persist_directory
+        )
+        self._collection = self.store._collection
+
+    @property
+    def metadata(self):
+        return self._collection.metadata
+
+    def count(self):
+        return self._collection.count()
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self._collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def query(self, query_embeddings, n_results, where=None, include=("documents", "metadatas", "distances")):
+        return self._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where or None,
+            include=list(include),
+        )
+
+    def get(self, ids=None, limit=None, offset=None, include=("documents", "metadatas")):
+        return self._collection.get(ids=ids, limit=limit, offset=offset, include=list(include))
+
+    def delete(self, ids):
+        self._collection.delete(ids=ids)
+
+
+class MemmapBackend:
+    """
+    Index en lecture seule ouvert par projection mémoire (mmap) : les vecteurs, textes, identifiants
+    et métadonnées restent dans des fichiers que plusieurs processus (workers uvicorn) partagent via
+    le cache du système, et l'ouverture ne lit aucun de ces fichiers en entier.
+    - embeddings.npy : vecteurs normalisés (float32), une ligne par morceau
+    - documents.bin / offsets.npy : textes UTF-8 concaténés et leurs positions
+    - ids.bin / ids_offsets.npy, id_order.npy : identifiants, et lignes triées par identifiant
+    - metadatas.bin / metadatas_offsets.npy : métadonnées JSON de chaque morceau
+    - index.faiss (facultatif) : index HNSW FAISS, chargé en entier dans chaque processus
+    Mémoire propre à chaque processus : les lignes retenues par chaque filtre (8 octets par ligne,
+    calculées une fois par filtre) et, s'il est utilisé, l'index FAISS (la taille de embeddings.npy
+    plus le graphe HNSW, environ 256 octets par morceau) ; sans lui, la recherche est exacte.
+    Les distances retournées sont des distances L2 au carré, comme Chroma.
+    """
+
+    def __init__(self, embeddings, directory: str):
+        self.embeddings = embeddings
+        self.directory = directory
+        self.metadata = {}
+        if not os.path.exists(os.path.join(directory, METADATAS_FILE)) \
+                and os.path.exists(os.path.join(directory, LEGACY_METADATA_FILE)):
+            raise RuntimeError(f"Index {directory} à l'ancien format : relancer export_index.py")
+        self._vectors = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        self._documents = _TextColumn(directory, DOCUMENTS_FILE, OFFSETS_FILE)
+        self._ids = _TextColumn(directory, IDS_FILE, IDS_OFFSETS_FILE)
+        self._id_order = np.load(os.path.join(directory, ID_ORDER_FILE), mmap_mode="r")
+        self._metadatas = _TextColumn(directory, METADATAS_FILE, METADATAS_OFFSETS_FILE)
+        self._faiss_index = self._load_faiss(os.path.join(directory, FAISS_FILE))
+        self._lock = threading.Lock()
+        self._filter_rows = {}
+
+    @staticmethod
+    def _load_faiss(path):
+        if not os.path.exists(path):
+            return None
+        try:
+            import faiss
+        except ImportError:
+            print(f"faiss n'est pas installé : {path} est ignoré, recherche exacte")
+            return None
+        # Un index HNSW ne se projette pas en mémoire : chaque processus en charge sa copie
+        return faiss.read_index(path)
+
+    def count(self):
+        return len(self._ids)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        raise RuntimeError("Index mmap en lecture seule : ingérer dans Chroma puis relancer export_index.py")
+
+    def delete(self, ids):
+        raise RuntimeError("Index mmap en lecture seule : ingérer dans Chroma puis relancer export_index.py")
+
+    def _metadata(self, row):
+        return json.loads(self._metadatas[row])
+
+    def _row(self, id_):
+        """
+        Ligne d'un identifiant par recherche dichotomique dans id_order, None s'il est absent
+        """
+        position = bisect.bisect_left(self._id_order, id_, key=lambda row: self._ids[int(row)])
+        if position < len(self._id_order) and self._ids[int(self._id_order[position])] == id_:
+            return int(self._id_order[position])
+        return None
+
+    def _rows_matching(self, where):
+        """
+        Lignes dont les métadonnées satisfont le filtre, calculées une fois par filtre
+        """
+        key = json.dumps(where, sort_keys=True)
+        with self._lock:
+            rows = self._filter_rows.get(key)
+            if rows is None:
+                rows = np.array(
+                    [row for row in range(len(self._metadatas)) if matches_filter(self._metadata(row), where)],
+                    dtype=np.int64
+                )
+                self._filter_rows[key] = rows
+        return rows
+
+    def _search(self, queries, n_results, where):
+        """
+        Returns:
+            tuple: (lignes, similarités cosinus) de forme (requêtes, n_results)
+        """
+        if where:
+            rows = self._rows_matching(where)
+            similarities = queries @ self._vectors[rows].T if len(rows) else np.zeros((len(queries), 0))
+        elif self._faiss_index is not None:
+            similarities, rows = self._faiss_index.search(queries, n_results)
+            return rows, similarities
+        else:
+            rows = np.arange(len(self._vectors))
+            similarities = queries @ self._vectors.T
+
+        n = min(n_results, similarities.shape[1])
+        if n == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), similarities[:, :0]
+        top = np.argpartition(-similarities, n - 1, axis=1)[:, :n]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+        return rows[np.take_along_axis(top, order, axis=1)], np.take_along_axis(top_similarities, order, axis=1)
+
+    def query(self, query_embeddings, n_results, where=None, include=("documents", "metadatas", "distances")):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        rows, similarities = self._search(queries, n_results, where)
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        for q in range(len(queries)):
+            hits = [(int(row), float(similarity)) for row, similarity in zip(rows[q], similarities[q]) if row >= 0]
+            result["ids"].append([self._ids[row] for row, _ in hits])
+            if "documents" in include:
+                result["documents"].append([self._documents[row] for row, _ in hits])
+            if "metadatas" in include:
+                result["metadatas"].append([self._metadata(row) for row, _ in hits])
+            if "distances" in include:
+                # Vecteurs normalisés : distance L2 au carré = 2 - 2 cos
+                result["distances"].append([2 - 2 * similarity for _, similarity in hits])
+            if "embeddings" in include:
+                result["embeddings"].append([np.asarray(self._vectors[row]) for row, _ in hits])
+        return result
+
+    def get(self, ids=None, limit=None, offset=None, include=("documents", "metadatas")):
+        if ids is not None:
+            rows = [row for row in map(self._row, ids) if row is not None]
+        else:
+            start = offset or 0
+            end = len(self._ids) if limit is None else min(len(self._ids), start + limit)
+            rows = range(start, end)
+
+        result = {"ids": [self._ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self._documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._metadata(row) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [np.asarray(self._vectors[row]) for row in rows]
+        return result
+
+
+def export_memmap(source, directory: str, page_size: int = 5000, build_faiss: bool = False):
+    """
+    Exporte le contenu d'un backend (Chroma) vers un index MemmapBackend
+    Args:
+        source: Backend source (ChromaBackend)
+        directory (str): Dossier de destination
+        page_size (int): Nombre de morceaux lus par appel
+        build_faiss (bool): Construire aussi un index HNSW FAISS (nécessite faiss)
+    Returns:
+        int: Nombre de morceaux exportés
+    """
+    os.makedirs(directory, exist_ok=True)
+    total = source.count()
+    ids = []
+    vectors = None
+
+    columns = [
+        _TextColumnWriter(directory, DOCUMENTS_FILE, OFFSETS_FILE),
+        _TextColumnWriter(directory, IDS_FILE, IDS_OFFSETS_FILE),
+        _TextColumnWriter(directory, METADATAS_FILE, METADATAS_OFFSETS_FILE),
+    ]
+    documents_column, ids_column, metadatas_column = columns
+    try:
+        offset = 0
+        while offset < total:
+            page = source.get(limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+            if not page["ids"]:
+                break
+            page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            if vectors is None:
+                tmp_vectors = os.path.join(directory, EMBEDDINGS_FILE + ".tmp")
+                vectors = np.lib.format.open_memmap(
+                    tmp_vectors, mode="w+", dtype=np.float32, shape=(total, page_vectors.shape[1])
+                )
+            page_vectors /= np.maximum(np.linalg.norm(page_vectors, axis=1, keepdims=True), 1e-12)
+            vectors[offset:offset + len(page_vectors)] = page_vectors
+            for id_, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                documents_column.append(document or "")
+                ids_column.append(id_)
+                metadatas_column.append(json.dumps(metadata or {}, ensure_ascii=False))
+                ids.append(id_)
+            offset += len(page["ids"])
+    finally:
+        for column in columns:
+            column.close()
+
+    if vectors is None:
+        raise ValueError("La base source est vide : rien à exporter")
+    vectors.flush()
+    del vectors
+    # Lignes triées par identifiant, pour la recherche dichotomique de MemmapBackend.get(ids=...)
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    np.save(os.path.join(directory, ID_ORDER_FILE + ".tmp.npy"), np.asarray(order, dtype=np.int64))
+
+    # Les fichiers ne remplacent l'index précédent qu'une fois tous écrits
+    os.replace(os.path.join(directory, EMBEDDINGS_FILE + ".tmp"), os.path.join(directory, EMBEDDINGS_FILE))
+    for column in columns:
+        column.commit()
+    os.replace(os.path.join(directory, ID_ORDER_FILE + ".tmp.npy"), os.path.join(directory, ID_ORDER_FILE))
+    legacy_path = os.path.join(directory, LEGACY_METADATA_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+    faiss_path = os.path.join(directory, FAISS_FILE)
+    if build_faiss:
+        import faiss
+        matrix = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        index = faiss.IndexHNSWFlat(matrix.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 64
+        index.add(np.ascontiguousarray(matrix))
+        faiss.write_index(index, faiss_path + ".tmp")
+        os.replace(faiss_path + ".tmp", faiss_path)
+    elif os.path.exists(faiss_path):
+        # Un ancien index FAISS ne correspondrait plus aux lignes exportées
+        os.remove(faiss_path)
+    return len(ids)
@@ -0,0 +1,163 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+load_dotenv()
+
+# Taille du pool de threads qui exécute les appels bloquants (LLM, RAG, PDF)
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "8"))
+# Temps d'attente maximal (en secondes) d'une requête dans la file avant un 503
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm-worker")
+_limiters = {}
+
+
+class EndpointLimiter:
+    """
+    Limite le nombre d'appels simultanés d'un endpoint et la taille de sa file d'attente
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.pending = 0
+        self.active = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Réserve une place d'exécution ; lève une HTTPException 429 si la file est pleine
+        et 503 si la place ne se libère pas avant QUEUE_TIMEOUT
+        """
+        if self.pending >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Trop de requêtes en attente sur {self.name}, réessayez plus tard",
+                headers={"Retry-After": "5"},
+            )
+        self.pending += 1
+        try:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Service {self.name} saturé, réessayez plus tard",
+                    headers={"Retry-After": "10"},
+                )
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+                self.semaphore.release()
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+def get_limiter(name: str, max_concurrency: int = 4, max_queue: int = 16) -> EndpointLimiter:
+    """
+    Retourne le limiteur d'un endpoint ; les valeurs par défaut peuvent être
+    surchargées par MAX_CONCURRENCY_<NOM> et MAX_QUEUE_<NOM> dans l'environnement
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        env_name = name.upper().replace("-", "_")
+        limiter = EndpointLimiter(
+            name,
+            max_concurrency=int(os.getenv(f"MAX_CONCURRENCY_{env_name}", max_concurrency)),
+            max_queue=int(os.getenv(f"MAX_QUEUE_{env_name}", max_queue)),
+        )
+        _limiters[name] = limiter
+    return limiter
+
+
+async def reserve_slot(name: str) -> AsyncExitStack:
+    """
+    Réserve une place de l'endpoint avant de répondre (429/503 possibles), pour une réponse en flux :
+    la place est libérée par LimitedStreamingResponse
+    """
+    stack = AsyncExitStack()
+    await stack.enter_async_context(get_limiter(name).slot())
+    return stack
+
+
+class LimitedStreamingResponse(StreamingResponse):
+    """
+    Réponse en flux qui occupe une place réservée par reserve_slot : la place est libérée quand
+    l'envoi de la réponse se termine, y compris si le client se déconnecte avant ou pendant le corps
+    (le générateur du corps peut alors ne jamais s'exécuter)
+    """
+
+    def __init__(self, slot: AsyncExitStack, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Corps interrompu : le générateur est fermé (tâches en cours annulées) avant de rendre la place
+            close = getattr(self.body_iterator, "aclose", None)
+            try:
+                if close is not None:
+                    await close()
+            finally:
+                await self.slot.aclose()
+
+
+async def run_blocking(name: str, func, *args, **kwargs):
+    """
+    Exécute une fonction bloquante dans le pool de threads, sous la limite de l'endpoint
+    """
+    async with get_limiter(name).slot():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def iterate_blocking(iterator):
+    """
+    Parcourt un itérateur bloquant (générateur d'extraction, ...) élément par élément dans le pool de threads
+    """
+    loop = asyncio.get_running_loop()
+    fin = object()
+    try:
+        while True:
+            item = await loop.run_in_executor(_executor, next, iterator, fin)
+            if item is fin:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await loop.run_in_executor(_executor, close)
+
+
+def stats() -> dict:
+    return {
+        "workers": LLM_WORKERS,
+        "endpoints": {name: limiter.stats() for name, limiter in _limiters.items()},
+    }